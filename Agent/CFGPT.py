@@ -1,26 +1,58 @@
 """CFGPT 类，用于智能体调用金融知识模型"""
-import torch
 import os
 import gc
-from transformers import AutoTokenizer, AutoModelForCausalLM
+import threading
+try:
+    from .prompt_registry import registry
+except:
+    from prompt_registry import registry
+try:
+    from metrics import metrics
+except ImportError:
+    # 单独运行本文件（项目根目录不在 sys.path 中）时不统计
+    metrics = None
 # 获取当前程序的路径
 current_path = os.path.dirname(os.path.abspath(__file__))
 
-# 从 CFGPT_path.txt 中读取路径
-with open(os.path.join(current_path, 'CFGPT_path.txt'), 'r', encoding='utf-8') as f:
-    CFGPT_path = f.read().strip()
-tokenizer = AutoTokenizer.from_pretrained(CFGPT_path, trust_remote_code=True)
-# Set `torch_dtype=torch.float16` to load model in float16, otherwise it will be loaded as float32 and cause OOM Error.
-model = AutoModelForCausalLM.from_pretrained(CFGPT_path, torch_dtype=torch.float16, trust_remote_code=True, device_map="auto")
-model = model.eval()
+# 模型在第一次对话时才加载，不使用专家的消融实验不需要加载模型（也不需要GPU）
+_models = {}    # 设备 -> (tokenizer, model)
+_models_lock = threading.Lock()
+
+
+def load_model(device='auto'):
+    """
+    加载 CFGPT 模型（每个设备只加载一次）
+    :param device: 'auto' - 由 transformers 自动分配；'cpu'；'cuda:0' 等
+    :return: (tokenizer, model)
+    """
+    with _models_lock:
+        if device not in _models:
+            import torch
+            from transformers import AutoTokenizer, AutoModelForCausalLM
+
+            # 从 CFGPT_path.txt 中读取路径
+            with open(os.path.join(current_path, 'CFGPT_path.txt'), 'r', encoding='utf-8') as f:
+                CFGPT_path = f.read().strip()
+            tokenizer = AutoTokenizer.from_pretrained(CFGPT_path, trust_remote_code=True)
+            # Set `torch_dtype=torch.float16` to load model in float16, otherwise it will be loaded as float32 and cause OOM Error.
+            # CPU 上不支持大部分 float16 运算，使用 float32
+            torch_dtype = torch.float32 if device == 'cpu' else torch.float16
+            model = AutoModelForCausalLM.from_pretrained(CFGPT_path, torch_dtype=torch_dtype, trust_remote_code=True, device_map=device)
+            model = model.eval()
+            _models[device] = (tokenizer, model)
+        return _models[device]
+
 
 class CFGPT:
-    """CFGPT 类，仅支持单轮对话"""
-    def __init__(self):
+    """CFGPT 类，仅支持单轮对话；多个智能体可能并发请求专家，对话过程加锁串行执行"""
+    def __init__(self, device='auto'):
         """
-        初始化时清空历史
+        初始化时清空历史，模型在第一次对话时加载
+        :param device: 模型所在设备，'auto' / 'cpu' / 'cuda:0' 等
         """
         self.history = []
+        self.device = device
+        self.lock = threading.Lock()  # 对话历史与本地模型由所有智能体共享
 
     def clear_history(self):
         """
@@ -36,7 +68,12 @@ class CFGPT:
         :param prompt: 提示词
         :return: 响应，仅文本
         """
-        response, self.history = model.chat(tokenizer, prompt, history=self.history, temperature=0.5, top_p=0.5)
+        tokenizer, model = load_model(self.device)
+        if metrics is None:
+            response, self.history = model.chat(tokenizer, prompt, history=self.history, temperature=0.5, top_p=0.5)
+            return response
+        with metrics.span('expert.generate'):
+            response, self.history = model.chat(tokenizer, prompt, history=self.history, temperature=0.5, top_p=0.5)
         return response
 
     def news_analysis(self, news: str):
@@ -47,17 +84,17 @@ class CFGPT:
         :return: 分析结果 - str
         """
         turns = 1
-        with open(os.path.join(current_path, "templates/expert/expert_news_analysis_0.txt"), 'r', encoding='utf-8') as f:
-            prompts = f.read().split('-----*****-----\n')
+        prompts = registry.get(os.path.join(current_path, "templates/expert/expert_news_analysis_0.txt"))
 
         # 清除历史，开始对话
-        self.clear_history()
-        for i in range(turns):
-            if i == 0:
-                prompt = prompts[i].format(
-                    news=news
-                )
-                return self.chat_with_history(prompt)
+        with self.lock:
+            self.clear_history()
+            for i in range(turns):
+                if i == 0:
+                    prompt = prompts[i].format(
+                        news=news
+                    )
+                    return self.chat_with_history(prompt)
 
     def advise_to_agent(self, identity: str,  strategy: str):
         """
@@ -66,18 +103,18 @@ class CFGPT:
         :return: 专家建议 - str
         """
         turns = 1
-        with open(os.path.join(current_path, "templates/expert/expert_advise_0.txt"), 'r', encoding='utf-8') as f:
-            prompts = f.read().split('-----*****-----\n')
+        prompts = registry.get(os.path.join(current_path, "templates/expert/expert_advise_0.txt"))
 
         # 清除历史，开始对话
-        self.clear_history()
-        for i in range(turns):
-            if i == 0:
-                prompt = prompts[i].format(
-                    identity=identity,
-                    strategy=strategy
-                )
-                return self.chat_with_history(prompt)
+        with self.lock:
+            self.clear_history()
+            for i in range(turns):
+                if i == 0:
+                    prompt = prompts[i].format(
+                        identity=identity,
+                        strategy=strategy
+                    )
+                    return self.chat_with_history(prompt)
 
     def without_expert(self):
         '''
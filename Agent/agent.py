@@ -3,6 +3,10 @@ try:
     from .chat_volc import ChatBasicVolc
 except:
     from chat_volc import ChatBasicVolc
+try:
+    from .response_cache import get_cache
+except:
+    from response_cache import get_cache
 import os
 
 # 获取当前主程序的路径
@@ -13,7 +17,8 @@ class AgentBasic:
     智能体基类，只保留所有智能体的最基础功能
     """
 
-    def __init__(self, profile, model_name="deepseek-v3-2-251201", temperature=0.6, top_p=0.9, log_file='log.out'):
+    def __init__(self, profile, model_name="deepseek-v3-2-251201", temperature=0.6, top_p=0.9, log_file='log.out',
+                 response_cache=None, response_cache_size_mb=512, name=None):
         """
         初始化函数
         :param model_name: 模型名称
@@ -21,18 +26,26 @@ class AgentBasic:
         :param temperature: 温度参数，默认 0.6
         :param top_p: top_p 参数，默认0.9
         :param log_file: 日志文件，默认路径 "log,out"
+        :param response_cache: LLM响应缓存模式，None - 不使用；'read_write' - 读写；'replay' - 只读回放。缓存文件保存在日志目录下
+        :param response_cache_size_mb: 响应缓存的最大体积（MB）
+        :param name: 智能体名称，用于 metrics 中按智能体统计 LLM 调用
         """
+        self.log_file = os.path.join(current_path, log_file)
+        folder=os.path.dirname(self.log_file)
+        os.makedirs(folder,exist_ok=True)
+        cache = None
+        if response_cache:
+            cache = get_cache(folder, mode=response_cache, max_size_mb=response_cache_size_mb)
         self.chat = ChatBasicVolc(
             model=model_name,
             context=[],
             temperature=temperature,
-            top_p=top_p
+            top_p=top_p,
+            cache=cache,
+            name=name
         )
         self.profile = profile
         self.chat.append_context(profile, role='system')
-        self.log_file = os.path.join(current_path, log_file)
-        folder=os.path.dirname(self.log_file)
-        os.makedirs(folder,exist_ok=True)
 
     def get_befores(self):
         """ return before - [before_long, before_short, before_before_long, before_before_short]"""
@@ -42,6 +55,14 @@ class AgentBasic:
         """ return tokens usage - (prompt, completion)"""
         return self.chat.get_usage()
 
+    def get_global_usage(self):
+        """ return tokens usage of all agents - (prompt, completion)"""
+        return self.chat.get_global_usage()
+
+    def set_global_usage(self, prompt_tokens, completion_tokens):
+        """ 恢复所有智能体的 tokens 总用量（从检查点恢复时） """
+        self.chat.set_global_usage(prompt_tokens, completion_tokens)
+
     def get_profile(self):
         """ return self.profile """
         return self.profile
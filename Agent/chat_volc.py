@@ -9,6 +9,15 @@ try:
     from . import global_variables
 except:
     import global_variables
+try:
+    from .response_cache import ResponseCache
+except:
+    from response_cache import ResponseCache
+try:
+    from metrics import metrics
+except ImportError:
+    # 单独运行本文件（项目根目录不在 sys.path 中）时不统计
+    metrics = None
 
 VOLC_KEY_PATH = 'volc_key.txt'
 
@@ -25,7 +34,7 @@ class ChatBasicVolc:
     """
     火山引擎大语言模型chat接口调用，同步
     """
-    def __init__(self, model='deepseek-v3-250324', context=None, temperature=0.85, top_p=0.95, max_tokens=8192, thinking: str ='disabled'):
+    def __init__(self, model='deepseek-v3-250324', context=None, temperature=0.85, top_p=0.95, max_tokens=8192, thinking: str ='disabled', cache=None, name=None):
         """
         初始化函数，
         :param model: 模型id，从官网获取， https://www.volcengine.com/docs/82379/1513689
@@ -34,6 +43,8 @@ class ChatBasicVolc:
         :param top_p: top_p
         :param max_tokens: 最大生成token数
         :param thinking: 是否限制模型思考,默认为‘auto’，模型自行选择
+        :param cache: 响应缓存 response_cache.ResponseCache，默认不使用缓存
+        :param name: 智能体名称，作为 metrics 中 LLM 调用统计的标签，默认使用模型id
         """
         self.model = model
         if context is None:
@@ -47,10 +58,53 @@ class ChatBasicVolc:
         self.prompt_tokens = 0
         self.completion_tokens = 0
         self.client=Ark(api_key=VOLC_KEY)
+        self.cache = cache
+        self.cache_requests = {}    # 同一上下文已经请求的次数，用于区分校验失败后的重试
+        self.name = name if name is not None else model
+
+    def _record(self, start, response=None, retries=0):
+        """将一次请求（从 start 开始，包括重试）记入 metrics，response 为 None 表示命中缓存"""
+        if metrics is None or not metrics.enabled:
+            return
+        if response is None:
+            metrics.record_llm(self.name, time.perf_counter() - start, cached=True)
+        else:
+            metrics.record_llm(self.name, time.perf_counter() - start, response.usage.prompt_tokens,
+                               response.usage.completion_tokens, retries=retries)
+
+    def _cache_lookup(self):
+        """
+        以当前的上下文查询响应缓存
+        :return: (缓存键, 命中的回复)；未启用缓存时均为 None，未命中时回复为 None
+        """
+        if self.cache is None:
+            return None, None
+        key = ResponseCache.make_key(self.model, self.temperature, self.top_p, self.context)
+        occurrence = self.cache_requests.get(key, 0)
+        self.cache_requests[key] = occurrence + 1
+        if occurrence > 0:
+            key = ResponseCache.make_key(self.model, self.temperature, self.top_p, self.context, occurrence)
+        hit = self.cache.get(key)
+        if hit is None:
+            return key, None
+        return key, hit[0]
 
     def get_usage(self):
         """ return tokens usage - (prompt, completion)"""
         return self.prompt_tokens, self.completion_tokens
+
+    @staticmethod
+    def get_global_usage():
+        """ return tokens usage of all agents - (prompt, completion)"""
+        with global_variables.Usage_Lock:
+            return global_variables.Prompt_Usage, global_variables.Completion_Usage
+
+    @staticmethod
+    def set_global_usage(prompt_tokens, completion_tokens):
+        """ 恢复所有智能体的 tokens 总用量（从检查点恢复时） """
+        with global_variables.Usage_Lock:
+            global_variables.Prompt_Usage = prompt_tokens
+            global_variables.Completion_Usage = completion_tokens
     
     def append_context(self, content, role='user'):
         """
@@ -88,6 +142,12 @@ class ChatBasicVolc:
         :return: LLM 的输出(dict{'role', 'content'})
         """
         self.append_context(prompt)
+        start = time.perf_counter()
+        cache_key, content = self._cache_lookup()
+        if content is not None:
+            # 命中缓存，不再请求模型
+            self._record(start)
+            return self.append_context(content, role='assistant')
         for i in range(5):
             try:
                 response = self.client.chat.completions.create(
@@ -105,8 +165,10 @@ class ChatBasicVolc:
                 )
                 self.prompt_tokens += response.usage.prompt_tokens
                 self.completion_tokens += response.usage.completion_tokens
-                global_variables.Prompt_Usage+=response.usage.prompt_tokens
-                global_variables.Completion_Usage+=response.usage.completion_tokens
+                with global_variables.Usage_Lock:
+                    global_variables.Prompt_Usage+=response.usage.prompt_tokens
+                    global_variables.Completion_Usage+=response.usage.completion_tokens
+                self._record(start, response, retries=i)
                 break
             except:
                 # 请求失败
@@ -117,6 +179,9 @@ class ChatBasicVolc:
             print('\n', self.context)
             raise TimeoutError('Deepseek API 出错')
 
+        if cache_key is not None:
+            self.cache.put(cache_key, response.choices[0].message.content,
+                           response.usage.prompt_tokens, response.usage.completion_tokens)
         return self.append_context(response.choices[0].message.content, role='assistant')
         
     def chat_basic_temp(self, pop_fn, check_fn, **kwargs) -> int | list:
@@ -140,26 +205,37 @@ class ChatBasicVolc:
 
             while True:
                 try:
-                    # LLM generation
-                    response = self.client.chat.completions.create(
-                        model=self.model,
-                        messages=self.context,
-                        stream=False,
-                        max_tokens=self.max_tokens,
-                        top_p=self.top_p,
-                        temperature=self.temperature,
-                        thinking={
-                            "type": "disabled", # 不使用深度思考能力
-                            # "type": "enabled", # 使用深度思考能力
-                            # "type": "auto", # 模型自行判断是否使用深度思考能力
-                        }
-                    )
-                    self.prompt_tokens += response.usage.prompt_tokens
-                    self.completion_tokens += response.usage.completion_tokens
-                    global_variables.Prompt_Usage+=response.usage.prompt_tokens
-                    global_variables.Completion_Usage+=response.usage.completion_tokens
+                    start = time.perf_counter()
+                    cache_key, answer = self._cache_lookup()
+                    if answer is None:
+                        # LLM generation
+                        response = self.client.chat.completions.create(
+                            model=self.model,
+                            messages=self.context,
+                            stream=False,
+                            max_tokens=self.max_tokens,
+                            top_p=self.top_p,
+                            temperature=self.temperature,
+                            thinking={
+                                "type": "disabled", # 不使用深度思考能力
+                                # "type": "enabled", # 使用深度思考能力
+                                # "type": "auto", # 模型自行判断是否使用深度思考能力
+                            }
+                        )
+                        self.prompt_tokens += response.usage.prompt_tokens
+                        self.completion_tokens += response.usage.completion_tokens
+                        with global_variables.Usage_Lock:
+                            global_variables.Prompt_Usage+=response.usage.prompt_tokens
+                            global_variables.Completion_Usage+=response.usage.completion_tokens
+                        self._record(start, response)
 
-                    answer=response.choices[0].message.content
+                        answer=response.choices[0].message.content
+                        if cache_key is not None:
+                            self.cache.put(cache_key, answer,
+                                           response.usage.prompt_tokens, response.usage.completion_tokens)
+                        del response
+                    else:
+                        self._record(start)
 
                     # response check
                     valid, data = check_fn(answer, n)
@@ -169,7 +245,6 @@ class ChatBasicVolc:
                             # exist output data
                             output.append(data)
                         n += 1
-                        del response
                         del answer
                         break
 
@@ -177,7 +252,7 @@ class ChatBasicVolc:
                     retry += 1
                     if retry > 5:
                         raise ValueError('Cannot generate valid output in 5 times. -00')
-                    del response, answer
+                    del answer
                 except ValueError:
                     # data format error in generation
                     if retry > 5:
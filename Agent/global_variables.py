@@ -1,6 +1,9 @@
 # This is all global variance file
 import os
+import threading
 
 Usage = 0
 Prompt_Usage=0
-Completion_Usage=0
\ No newline at end of file
+Completion_Usage=0
+# 多个智能体并发对话时，更新 token 用量需要加锁
+Usage_Lock = threading.Lock()
@@ -3,6 +3,10 @@ try:
     from .agent import AgentBasic
 except:
     from agent import AgentBasic
+try:
+    from .prompt_registry import registry
+except:
+    from prompt_registry import registry
 import json, os, re
 
 # 获取当前主程序的路径
@@ -29,13 +33,12 @@ P_transaction_request = [
 def read_prompts(file_name):
     """
     读取 prompt 文件中的所有提示词，多轮提示词由 -----*****-----\n 分割
-    保留预编译字符串的状态
+    保留预编译字符串的状态；文件内容由 prompt_registry 缓存，只在第一次读取时访问磁盘
     :param file_name: 文件名
     :return: 一个列表
     """
     try:
-        with open(file_name, 'r', encoding='utf-8') as f:
-            return f.read().split("-----*****-----\n")
+        return list(registry.get(file_name))
     except FileNotFoundError:
         print('file not found')
 
@@ -74,16 +77,19 @@ def extract_json(uttr: str, target_keys: list):
 
 class Player(AgentBasic):
     """ 所有玩家智能体的基类，包含统一的创建方法，数据提取方法：交易单，撮合成功，广播等 """
-    def __init__(self, profile_file, config_file, security_fund_rate=12.5, limit=20):
+    def __init__(self, profile_file, config_file, security_fund_rate=12.5, limit=20, log_dir=None):
         """
         通过文件导入人设
         :param profile_file: 人设文件路径
+        :param log_dir: 日志目录，给定时代替配置文件中 log_file 的目录（文件名不变），用于同时运行多个模拟
         """
         # load configs
         model_name = 'deepseek-v3-2-251201'
         temperature = 0.5
         top_p = 0.9
         log_file = 'log.out'
+        response_cache = None   # LLM响应缓存，'read_write' / 'replay'
+        response_cache_size_mb = 512
         with open(config_file, 'r', encoding='utf-8') as f:
             config = json.load(f)
             kws = config.keys()
@@ -95,8 +101,14 @@ class Player(AgentBasic):
                 top_p = config['top_p']
             if 'log_file' in kws:
                 log_file = config['log_file']
+            if 'response_cache' in kws:
+                response_cache = config['response_cache']
+            if 'response_cache_size_mb' in kws:
+                response_cache_size_mb = config['response_cache_size_mb']
             for key, value in config.items():
                 setattr(self, key, value)
+        if log_dir is not None:
+            log_file = os.path.join(log_dir, os.path.basename(log_file))
 
         # create object
         with open(profile_file, 'r', encoding='utf-8') as f:
@@ -105,7 +117,10 @@ class Player(AgentBasic):
                 profile=f.read().strip(),
                 temperature=temperature,
                 top_p=top_p,
-                log_file=log_file
+                log_file=log_file,
+                response_cache=response_cache,
+                response_cache_size_mb=response_cache_size_mb,
+                name=config.get('name')
             )
 
         # 统一初始化内容
@@ -158,6 +173,39 @@ class Player(AgentBasic):
         self.profit = account_info['profit_loss']
         return 0
 
+    def get_state(self):
+        """ 检查点中保存的玩家状态（可以写入 json）：回合、编号、账户信息、反思列表、对话上下文与 tokens 用量 """
+        return {
+            'current_round': self.current_round,
+            'player_id': self.player_id,
+            'capital': self.capital,
+            'security_deposit': self.security_deposit,
+            'available_deposit': self.available_deposit,
+            'Ni_long': self.Ni_long,
+            'Ni_short': self.Ni_short,
+            'profit': self.profit,
+            'reflections': self.reflections,
+            'context': self.chat.context,
+            'usage': [self.chat.prompt_tokens, self.chat.completion_tokens]
+        }
+
+    def set_state(self, state):
+        """ 从检查点恢复玩家状态，与 get_state 对应 """
+        self.current_round = state['current_round']
+        self.player_id = state['player_id']
+        self.capital = state['capital']
+        self.security_deposit = state['security_deposit']
+        self.available_deposit = state['available_deposit']
+        self.Ni_long = [tuple(contract) for contract in state['Ni_long']]
+        self.Ni_short = [tuple(contract) for contract in state['Ni_short']]
+        self.profit = state['profit']
+        self.reflections = list(state['reflections'])
+        self.chat.context = [dict(uttr) for uttr in state['context']]
+        self.chat.prompt_tokens, self.chat.completion_tokens = state['usage']
+        with open(self.log_file, 'a', encoding='utf-8') as f:
+            f.write(f'-------------从检查点恢复，第{self.current_round}回合结束-------------\n\n')
+        return 0
+
     # 查询成员属性
     def get_id(self):
         """查询在游戏中的ID"""
@@ -0,0 +1,111 @@
+"""提示词模板注册表，进程内只读取并分割一次 Agent/templates 下的所有模板文件"""
+import os
+import string
+import threading
+
+# 获取当前程序的路径
+current_path = os.path.dirname(os.path.abspath(__file__))
+# templates
+templates_folder = os.path.join(current_path, 'templates')
+
+# 多轮提示词之间的分隔符
+SEPARATOR = "-----*****-----\n"
+
+
+class PromptRegistry:
+    """
+    提示词模板注册表
+    第一次使用时读取 folder 下的所有模板文件并按 SEPARATOR 分割，之后的读取不再访问磁盘；修改模板后调用 reload
+    可选地将模板预编译为 string.Formatter 的解析结果，通过 render 填充
+    """
+
+    def __init__(self, folder=templates_folder, precompile=False):
+        """
+        :param folder: 模板目录
+        :param precompile: 加载时是否同时预编译所有模板
+        """
+        self.folder = folder
+        self.precompile = precompile
+        self.prompts = {}   # 文件绝对路径 -> [提示词]
+        self.parsed = {}    # 文件绝对路径 -> [解析结果]
+        self.loaded = False
+        self.lock = threading.Lock()
+        self.formatter = string.Formatter()
+
+    def _read(self, path):
+        with open(path, 'r', encoding='utf-8') as f:
+            prompts = f.read().split(SEPARATOR)
+        self.prompts[path] = prompts
+        if self.precompile:
+            self.parsed[path] = [list(self.formatter.parse(prompt)) for prompt in prompts]
+        return prompts
+
+    def load(self):
+        """读取模板目录下的所有文件（已经读取过则直接返回）"""
+        with self.lock:
+            if self.loaded:
+                return self
+            if os.path.isdir(self.folder):
+                for root, _, files in os.walk(self.folder):
+                    for name in files:
+                        self._read(os.path.abspath(os.path.join(root, name)))
+            self.loaded = True
+        return self
+
+    def reload(self):
+        """清空并重新读取所有模板"""
+        with self.lock:
+            self.prompts = {}
+            self.parsed = {}
+            self.loaded = False
+        return self.load()
+
+    def get(self, file_name):
+        """
+        获取模板文件中的所有提示词，不在模板目录中的文件在第一次读取后同样会被缓存
+        :param file_name: 文件路径
+        :return: list[str]（共享对象，请勿修改）
+        :raise FileNotFoundError: 文件不存在
+        """
+        if not self.loaded:
+            self.load()
+        path = os.path.abspath(file_name)
+        prompts = self.prompts.get(path)
+        if prompts is None:
+            with self.lock:
+                prompts = self.prompts.get(path)
+                if prompts is None:
+                    prompts = self._read(path)
+        return prompts
+
+    def parse(self, file_name):
+        """
+        获取模板文件预编译的解析结果
+        :return: list[list[(literal_text, field_name, format_spec, conversion)]]
+        """
+        path = os.path.abspath(file_name)
+        parsed = self.parsed.get(path)
+        if parsed is None:
+            parsed = [list(self.formatter.parse(prompt)) for prompt in self.get(file_name)]
+            self.parsed[path] = parsed
+        return parsed
+
+    def render(self, file_name, i, **kwargs):
+        """
+        使用预编译的解析结果填充第 i 个提示词，结果与 prompts[i].format(**kwargs) 相同
+        """
+        pieces = []
+        for literal_text, field_name, format_spec, conversion in self.parse(file_name)[i]:
+            pieces.append(literal_text)
+            if field_name is None:
+                continue
+            obj, _ = self.formatter.get_field(field_name, (), kwargs)
+            obj = self.formatter.convert_field(obj, conversion)
+            if format_spec and '{' in format_spec:
+                format_spec = self.formatter.vformat(format_spec, (), kwargs)
+            pieces.append(self.formatter.format_field(obj, format_spec))
+        return ''.join(pieces)
+
+
+# 进程内共享的注册表
+registry = PromptRegistry()
@@ -0,0 +1,137 @@
+"""LLM 响应缓存，保存在日志目录下的 SQLite 文件中，用于重复实验和中断后的重跑"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+CACHE_FILE_NAME = 'response_cache.sqlite'
+
+# 同一个缓存文件只打开一次，由同一目录下的所有智能体共享
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(folder, mode='read_write', max_size_mb=512):
+    """
+    获取 folder 目录下的响应缓存（同一文件只创建一个对象）
+    :param folder: 缓存所在目录，通常为日志目录
+    :param mode: 'read_write' - 命中时直接返回，未命中时写入；'replay' - 只读回放，不写入新的响应
+    :param max_size_mb: 缓存文件中响应内容的最大体积（MB），超过后淘汰最久未使用的响应
+    :return: ResponseCache
+    """
+    path = os.path.abspath(os.path.join(folder, CACHE_FILE_NAME))
+    with _caches_lock:
+        if path not in _caches:
+            _caches[path] = ResponseCache(path, read_only=(mode == 'replay'), max_size_mb=max_size_mb)
+        return _caches[path]
+
+
+class ResponseCache:
+    """
+    LLM 响应缓存
+    键为 (模型, temperature, top_p, 完整的对话上下文, 同一上下文的请求序号) 的哈希值，值为模型回复与 token 用量
+    支持多线程（多个智能体并发对话）访问
+    """
+
+    def __init__(self, path, read_only=False, max_size_mb=512):
+        """
+        :param path: SQLite 文件路径
+        :param read_only: 只读回放模式，命中时返回缓存，未命中时不写入
+        :param max_size_mb: 响应内容的最大体积（MB）
+        """
+        self.path = path
+        self.read_only = read_only
+        self.max_size = int(max_size_mb * 1024 * 1024)
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS `responses` (
+                `key` TEXT PRIMARY KEY,
+                `content` TEXT NOT NULL,
+                `prompt_tokens` INTEGER NOT NULL,
+                `completion_tokens` INTEGER NOT NULL,
+                `size` INTEGER NOT NULL,
+                `last_access` REAL NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS `last_access` ON `responses` (`last_access`)")
+        self.conn.commit()
+        self.total_size = self.conn.execute("SELECT COALESCE(SUM(`size`), 0) FROM `responses`").fetchone()[0]
+
+    @staticmethod
+    def make_key(model, temperature, top_p, messages, occurrence=0):
+        """
+        计算缓存键
+        :param messages: 完整的对话上下文 list[dict{'role', 'content'}]
+        :param occurrence: 同一上下文在本次运行中第几次被请求（调用方校验失败后会以相同的上下文重试，需要区分）
+        :return: str
+        """
+        raw = json.dumps(
+            {'model': model, 'temperature': temperature, 'top_p': top_p, 'messages': messages,
+             'occurrence': occurrence},
+            ensure_ascii=False, sort_keys=True
+        )
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """
+        查询缓存
+        :return: (content, prompt_tokens, completion_tokens)；未命中时返回 None
+        """
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT `content`, `prompt_tokens`, `completion_tokens` FROM `responses` WHERE `key` = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            if not self.read_only:
+                self.conn.execute("UPDATE `responses` SET `last_access` = ? WHERE `key` = ?", (time.time(), key))
+                self.conn.commit()
+            return row
+
+    def put(self, key, content, prompt_tokens=0, completion_tokens=0):
+        """写入缓存，只读模式下不写入；总体积超过上限时淘汰最久未使用的响应"""
+        if self.read_only:
+            return
+        size = len(content.encode('utf-8'))
+        with self.lock:
+            old = self.conn.execute("SELECT `size` FROM `responses` WHERE `key` = ?", (key,)).fetchone()
+            if old is not None:
+                self.total_size -= old[0]
+            self.conn.execute(
+                "INSERT OR REPLACE INTO `responses` VALUES (?, ?, ?, ?, ?, ?)",
+                (key, content, prompt_tokens, completion_tokens, size, time.time())
+            )
+            self.total_size += size
+            if self.total_size > self.max_size:
+                self._evict()
+            self.conn.commit()
+
+    def _evict(self):
+        """淘汰最久未使用的响应，直至体积降到上限的 90% 以下（调用方持有锁）"""
+        target = self.max_size * 0.9
+        rows = self.conn.execute("SELECT `key`, `size` FROM `responses` ORDER BY `last_access` ASC").fetchall()
+        evicted = []
+        for key, size in rows:
+            if self.total_size <= target:
+                break
+            evicted.append((key,))
+            self.total_size -= size
+        self.conn.executemany("DELETE FROM `responses` WHERE `key` = ?", evicted)
+
+    def stats(self):
+        """命中与未命中次数"""
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': self.total_size}
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -1,3 +1,11 @@
+# 存储后端：'mysql' - 连接 connect_config 中的 MySQL 服务；'sqlite' - 使用 SQLite 数据库文件，无需数据库服务
+backend = 'mysql'
+
+# SQLite 配置：每个数据库对应 folder 下的 <数据库名>.sqlite 文件；folder 为 ':memory:' 时使用内存数据库
+sqlite_config = {
+    "folder": "./databases"
+}
+
 # 数据库连接配置
 connect_config = {
     "host": "localhost",
@@ -103,3 +111,25 @@ deal_record_field = """
     CONSTRAINT `bid` FOREIGN KEY (`bid_order_id`) REFERENCES `order` (`order_id`) ON DELETE CASCADE ON UPDATE CASCADE,
     CONSTRAINT `sell` FOREIGN KEY (`sell_order_id`) REFERENCES `order` (`order_id`) ON DELETE CASCADE ON UPDATE CASCADE
 """
+
+# 引擎高频查询使用的组合索引，engine_init 建表后创建（已经存在的索引会跳过）
+# {表名: [(索引名, 索引字段), ...]}，尽量覆盖查询中用到的字段，避免回表
+index_fields = {
+    'order': [
+        # deal_making：本次出价未成交的订单；settlement_of_round：本回合未成交的订单
+        ('order_round_num_status', '`order_round`,`order_num`,`order_status`'),
+    ],
+    'deal_record': [
+        # deal_making：本次出价的成交单；_cal_avg_price：平均成交价
+        ('deal_round_num', '`deal_round`,`deal_num`,`deal_lots`,`deal_price`'),
+        # 持仓、结算、交割：仍然持有的买方/卖方合约
+        ('deal_bid_status', '`bid_status`,`bid_order_id`'),
+        ('deal_sell_status', '`sell_status`,`sell_order_id`'),
+    ],
+    'agent_record': [
+        # 玩家某一回合的账户信息
+        ('agent_record_agent_round', '`agent_id`,`round`'),
+        # 账本加载、回合切换：某一回合所有玩家的账户信息
+        ('agent_record_round', '`round`,`agent_id`'),
+    ],
+}
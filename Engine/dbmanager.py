@@ -1,8 +1,72 @@
 # pip install mysql-connector-python
 # pip install DBUtils
-import mysql.connector
-from dbutils.pooled_db import PooledDB
-from mysql.connector import Error
+import re
+import sqlite3
+from contextlib import contextmanager
+
+try:
+    import mysql.connector
+    from dbutils.pooled_db import PooledDB
+    from mysql.connector import Error as MySQLError
+except ImportError:
+    # 只使用 SQLite 后端时可以不安装
+    mysql = None
+    PooledDB = None
+    MySQLError = sqlite3.Error
+
+try:
+    from metrics import metrics
+except ImportError:
+    # 单独使用引擎（项目根目录不在 sys.path 中）时不统计查询用时
+    metrics = None
+
+# 各存储后端的数据库错误
+Error = (MySQLError, sqlite3.Error)
+
+# 查询类别中的表名：各类语句的主表
+_TABLE_PATTERNS = {
+    'select': re.compile(r'\bFROM\s+`?(\w+)', re.IGNORECASE),
+    'insert': re.compile(r'\bINTO\s+`?(\w+)', re.IGNORECASE),
+    'update': re.compile(r'\bUPDATE\s+`?(\w+)', re.IGNORECASE),
+    'delete': re.compile(r'\bFROM\s+`?(\w+)', re.IGNORECASE),
+}
+
+
+def query_category(sql):
+    """
+    查询的类别，用于统计各类查询的用时：<语句类型>.<主表>，如 select.order、update.agent_record
+    WITH 开头的语句（结算时的 CTE + UPDATE）按其中的 UPDATE 归类
+    """
+    verb = sql.lstrip()[:6].lower()
+    if verb.startswith('with'):
+        verb = 'update' if re.search(r'\bUPDATE\b', sql, re.IGNORECASE) else 'select'
+    pattern = _TABLE_PATTERNS.get(verb)
+    if pattern is None:
+        return verb.split()[0] if verb.split() else 'other'
+    match = pattern.search(sql)
+    return f"{verb}.{match.group(1)}" if match else verb
+
+
+class TimedCursor:
+    """包装数据库游标，metrics 启用时按 query_category 统计每次 execute / executemany 的用时"""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, sql, params=None):
+        if metrics is None or not metrics.enabled:
+            return self._cursor.execute(sql, params)
+        with metrics.span('db.query', event=False, category=query_category(sql)):
+            return self._cursor.execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        if metrics is None or not metrics.enabled:
+            return self._cursor.executemany(sql, seq_of_params)
+        with metrics.span('db.query', event=False, category=query_category(sql)):
+            return self._cursor.executemany(sql, seq_of_params)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
 
 
 class DatabaseManager:
@@ -11,6 +75,13 @@ class DatabaseManager:
     # 初始化数据库连接
     def __init__(self, host, port, user, password):
 
+        # 是否处于 transaction() 中，处于事务中时各方法不再单独提交
+        self._in_transaction = False
+
+        if mysql is None:
+            print("未安装 mysql-connector-python 或 DBUtils，无法连接 MySQL，请安装或在 config.py 中使用 sqlite 后端")
+            exit(-1)
+
         self.pool = PooledDB(
             creator=mysql.connector,  # 连接模块
             mincached=10,  # 连接池
@@ -26,7 +97,7 @@ class DatabaseManager:
         # 打开数据库连接
         try:
             self._conn = self.pool.connection()
-            self._cursor = self._conn.cursor()
+            self._cursor = TimedCursor(self._conn.cursor())
 
         except Exception as e:
             print(f"连接数据库失败，错误为: {e}，请检查参数配置或连接！")
@@ -46,6 +117,36 @@ class DatabaseManager:
         if self._conn:
             self._conn.close()
 
+    # 提交，处于事务中时推迟到事务结束
+    def _commit(self):
+        if not self._in_transaction:
+            self._conn.commit()
+
+    @contextmanager
+    def transaction(self):
+        """
+        事务，块内所有增删改在块结束时一次提交，块内抛出异常（包括 exit）时整体回滚
+        嵌套使用时并入最外层的事务
+            with db.transaction():
+                db.order_update(...)
+                db.agent_record_update_many(...)
+        """
+        if self._in_transaction:
+            yield self
+            return
+        self._in_transaction = True
+        try:
+            yield self
+        except BaseException:
+            self._in_transaction = False
+            try:
+                self._conn.rollback()
+            except Exception as e:
+                print(f"事务回滚失败，错误原因为：{e}")
+            raise
+        self._in_transaction = False
+        self._conn.commit()
+
     # 创建新数据库
     def create_db(self, db_name):
         try:
@@ -56,6 +157,13 @@ class DatabaseManager:
             self.close_db()
             print(f"创建数据库失败，发生错误: {e}!")
 
+    # 删除数据库（不存在时忽略），返回0，失败返回-1
+    def drop_db(self, db_name):
+        status = self.execute_sql(f"DROP DATABASE IF EXISTS {db_name}")
+        if status is None:
+            return -1
+        return 0
+
     # 选择数据库
     def select_db(self, db_name):
         try:
@@ -76,6 +184,94 @@ class DatabaseManager:
             self.close_db()
             print(f"创建表失败，发生错误: {e}!")
 
+    # 创建索引，索引已经存在时跳过，返回0，失败返回-1
+    def create_index(self, table_name, index_name, columns):
+        try:
+            self._cursor.execute(f"CREATE INDEX `{index_name}` ON `{table_name}` ({columns})")
+            print(f"索引 {table_name}.{index_name} 创建成功!")
+            return 0
+
+        except Error as e:
+            if getattr(e, 'errno', None) == 1061:  # ER_DUP_KEYNAME，索引已经存在
+                return 0
+            print(f"创建索引失败，发生错误: {e}!")
+            return -1
+
+    # 创建表 table 的快照表 <表名>_snapshot（已经存在时跳过），主键与原表相同
+    def _create_snapshot_table(self, table, key):
+        self._cursor.execute(f"CREATE TABLE IF NOT EXISTS `{table}_snapshot` LIKE `{table}`")
+
+    def snapshot_tables(self, tables: dict, round):
+        """
+        增量更新快照：各表复制到 <表名>_snapshot，snapshot_round 表记录快照对应的回合，数据修改在一个事务中完成
+        只复制上一次快照之后新增的行（主键更大），并重新复制上一次快照时仍然可能被修改的行，每回合的开销与历史长度无关
+        :param tables: {表名: (自增主键, 条件)}，条件选出快照之后仍然可能被修改的行，其中 {round} 为上一次快照的回合；
+                       不满足条件的行之后不再被修改，各表的行也不会被删除
+        :param round: 快照对应的回合
+        :return: 0 - 成功；-1 - 失败
+        """
+        try:
+            # 建表不能放在事务中（MySQL 的 DDL 会隐式提交）
+            for table, (key, _) in tables.items():
+                self._create_snapshot_table(table, key)
+            self._cursor.execute("CREATE TABLE IF NOT EXISTS `snapshot_round` (`round` int NOT NULL)")
+            self._commit()
+            previous = self.snapshot_round()
+            with self.transaction():
+                for table, (key, mutable) in tables.items():
+                    snapshot = f"{table}_snapshot"
+                    if previous is not None:
+                        # 上一次快照时仍然可能被修改的行，按原表的当前内容重新复制
+                        self._cursor.execute(f"SELECT `{key}` FROM `{snapshot}` WHERE {mutable.format(round=previous)}")
+                        keys = [row[0] for row in self._cursor.fetchall()]
+                        for i in range(0, len(keys), 1000):
+                            chunk = keys[i:i + 1000]
+                            placeholders = ', '.join(['%s'] * len(chunk))
+                            self._cursor.execute(f"DELETE FROM `{snapshot}` WHERE `{key}` IN ({placeholders})", chunk)
+                            self._cursor.execute(
+                                f"INSERT INTO `{snapshot}` SELECT * FROM `{table}` WHERE `{key}` IN ({placeholders})",
+                                chunk)
+                    # 新增的行
+                    self._cursor.execute(f"SELECT MAX(`{key}`) FROM `{snapshot}`")
+                    last = self._cursor.fetchone()[0]
+                    self._cursor.execute(f"INSERT INTO `{snapshot}` SELECT * FROM `{table}` WHERE `{key}`>%s",
+                                         (last if last is not None else -1,))
+                self._cursor.execute("DELETE FROM `snapshot_round`")
+                self._cursor.execute("INSERT INTO `snapshot_round` (`round`) VALUES (%s)", (round,))
+            return 0
+
+        except Error as e:
+            print(f"更新快照失败，错误原因为：{e}")
+            return -1
+
+    # 快照对应的回合，没有快照时返回 None
+    def snapshot_round(self):
+        try:
+            self._cursor.execute("SELECT `round` FROM `snapshot_round`")
+            row = self._cursor.fetchone()
+            return None if row is None else int(row[0])
+
+        except Error:
+            return None
+
+    def restore_tables(self, tables: list):
+        """
+        将各表恢复为快照 <表名>_snapshot 中的内容，在一个事务中完成
+        :param tables: 表名列表，被引用的表在前（先按逆序清空，再按顺序写入，满足外键约束）
+        :return: 0 - 成功；-1 - 失败（快照不存在等）
+        """
+        try:
+            with self.transaction():
+                for table in reversed(tables):
+                    self._cursor.execute(f"DELETE FROM `{table}`")
+                for table in tables:
+                    self._cursor.execute(f"INSERT INTO `{table}` SELECT * FROM `{table}_snapshot`")
+            return 0
+
+        except Error as e:
+            print(f"恢复快照失败，错误原因为：{e}")
+            return -1
+
     def execute_sql(self, sql, isNeed=False):
         if isNeed:
             try:
@@ -104,17 +300,20 @@ class DatabaseManager:
                 # 执行
                 self._cursor.execute(sql, data)
                 # 提交
-                self._conn.commit()
+                self._commit()
                 # print(f"执行成功，影响{self._cursor.rowcount}行！")
+                return 0
 
             except Error as e:
                 print(f"发生错误: {e}，执行回滚！")
                 self._conn.rollback()
                 self.close_db()
+                return -1
 
         else:
             self._cursor.execute(sql, data)
-            self._conn.commit()
+            self._commit()
+            return 0
 
     """
         SELECT column1, column2, ...
@@ -211,7 +410,7 @@ class DatabaseManager:
 
             # 执行插入操作
             self._cursor.executemany(sql, values_list)
-            self._conn.commit()
+            self._commit()
 
             # print(f"插入成功，共计插入{self._cursor.rowcount}行！")
 
@@ -275,7 +474,7 @@ class DatabaseManager:
 
         try:
             self._cursor.execute(sql, tuple(agent_inf.values()))
-            self._conn.commit()
+            self._commit()
             # print(f"插入成功，共计插入{self._cursor.rowcount}行！")
             return self._cursor.lastrowid
 
@@ -300,7 +499,7 @@ class DatabaseManager:
 
         try:
             self._cursor.execute(sql)
-            self._conn.commit()
+            self._commit()
             print(f"删除成功，共计删除{self._cursor.rowcount}行！")
             return 0
 
@@ -324,7 +523,7 @@ class DatabaseManager:
 
         try:
             self._cursor.execute(sql, tuple(data.values()))
-            self._conn.commit()
+            self._commit()
             # print(f"更新成功，共计影响{self._cursor.rowcount}行！")
             return 0
 
@@ -403,7 +602,7 @@ class DatabaseManager:
 
         try:
             self._cursor.execute(sql, tuple(agent_record_inf.values()))
-            self._conn.commit()
+            self._commit()
             # print(f"插入成功，共计插入{self._cursor.rowcount}行！")
             return self._cursor.lastrowid
 
@@ -421,7 +620,7 @@ class DatabaseManager:
 
         try:
             self._cursor.execute(sql)
-            self._conn.commit()
+            self._commit()
             # print(f"删除成功，共计删除{self._cursor.rowcount}行！")
             return 0
 
@@ -438,7 +637,7 @@ class DatabaseManager:
 
         try:
             self._cursor.execute(sql, tuple(data.values()))
-            self._conn.commit()
+            self._commit()
             # print(f"更新成功，共计影响{self._cursor.rowcount}行！")
             return 0
 
@@ -448,6 +647,54 @@ class DatabaseManager:
             self.close_db()
             return -1
 
+    def agent_record_update_many(self, columns, datas: list):
+        """
+        批量更新账户记录，所有更新在一次提交中完成
+        :param columns: 需要更新的字段
+        :param datas: list(tuple)，每个tuple为(各字段的值..., agent_record_id)
+        """
+        set_clause = ', '.join([f"{k} = %s" for k in columns])
+        sql = f"UPDATE `agent_record` SET {set_clause} WHERE agent_record_id = %s"
+
+        try:
+            self._cursor.executemany(sql, datas)
+            self._commit()
+            return 0
+
+        except Error as e:
+            print(f"批量更新失败，错误原因为：{e}")
+            self._conn.rollback()
+            self.close_db()
+            return -1
+
+    # 按结算价计算所有持仓的盈亏，一条语句更新第round回合的账户（LEFT JOIN 与 GREATEST 为 MySQL 语法）
+    settle_sql = """
+        UPDATE `agent_record` LEFT JOIN (
+            SELECT `agent_id`,SUM(`pnl`) AS `pnl` FROM (
+                SELECT `order`.`agent_id`,(%s-`deal_price`)*`deal_lots` AS `pnl`
+                FROM `deal_record` JOIN `order` ON `order`.`order_id`=`deal_record`.`bid_order_id`
+                WHERE `deal_record`.`bid_status`='open'
+                UNION ALL
+                SELECT `order`.`agent_id`,(`deal_price`-%s)*`deal_lots` AS `pnl`
+                FROM `deal_record` JOIN `order` ON `order`.`order_id`=`deal_record`.`sell_order_id`
+                WHERE `deal_record`.`sell_status`='open'
+            ) AS `legs` GROUP BY `agent_id`
+        ) AS `profits` ON `profits`.`agent_id`=`agent_record`.`agent_id`
+        SET `agent_record`.`current_funds`=GREATEST(`agent_record`.`available_funds`,0)+`agent_record`.`security_funds`+COALESCE(`profits`.`pnl`,0),
+            `agent_record`.`profit_loss`=COALESCE(`profits`.`pnl`,0),
+            `agent_record`.`available_funds`=GREATEST(`agent_record`.`available_funds`,0)
+        WHERE `agent_record`.`round`=%s AND `agent_record`.`agent_id`<>%s
+    """
+
+    def agent_record_settle(self, price, round, excluded_agent_id):
+        """
+        回合结算：所有仍然持有（open）的合约按 price 计算盈亏，计入第round回合的账户
+        current_funds = max(available_funds, 0) + security_funds + 盈亏，profit_loss = 盈亏，available_funds = max(available_funds, 0)
+        :param excluded_agent_id: 不参与结算的玩家（超级用户）
+        :return: 0 - 成功；-1 - 失败
+        """
+        return self.execute(self.settle_sql, (price, price, round, excluded_agent_id))
+
     def agent_record_select(self, columns: str = '*', conditions: dict = None, order_by: str = None,
                             order_direction: str = 'ASC', limit: int = None):
         sql = f"SELECT {columns} FROM `agent_record`"
@@ -507,7 +754,7 @@ class DatabaseManager:
 
         try:
             self._cursor.execute(sql, tuple(futures_inf.values()))
-            self._conn.commit()
+            self._commit()
             # print(f"插入成功，共计插入{self._cursor.rowcount}行！")
             return self._cursor.lastrowid
 
@@ -525,7 +772,7 @@ class DatabaseManager:
 
         try:
             self._cursor.execute(sql)
-            self._conn.commit()
+            self._commit()
             # print(f"删除成功，共计删除{self._cursor.rowcount}行！")
             return 0
 
@@ -542,7 +789,7 @@ class DatabaseManager:
 
         try:
             self._cursor.execute(sql, tuple(data.values()))
-            self._conn.commit()
+            self._commit()
             # print(f"更新成功，共计影响{self._cursor.rowcount}行！")
             return 0
 
@@ -612,7 +859,7 @@ class DatabaseManager:
 
         try:
             self._cursor.execute(sql, tuple(futures_record_inf.values()))
-            self._conn.commit()
+            self._commit()
             # print(f"插入成功，共计插入{self._cursor.rowcount}行！")
             return self._cursor.lastrowid
 
@@ -630,7 +877,7 @@ class DatabaseManager:
 
         try:
             self._cursor.execute(sql)
-            self._conn.commit()
+            self._commit()
             # print(f"删除成功，共计删除{self._cursor.rowcount}行！")
             return 0
 
@@ -647,7 +894,7 @@ class DatabaseManager:
 
         try:
             self._cursor.execute(sql, tuple(data.values()))
-            self._conn.commit()
+            self._commit()
             # print(f"更新成功，共计影响{self._cursor.rowcount}行！")
             return 0
 
@@ -717,7 +964,7 @@ class DatabaseManager:
 
         try:
             self._cursor.execute(sql, tuple(order_inf.values()))
-            self._conn.commit()
+            self._commit()
             # print(f"插入成功，共计插入{self._cursor.rowcount}行！")
             return self._cursor.lastrowid
 
@@ -727,6 +974,42 @@ class DatabaseManager:
             self.close_db()
             return -1
 
+    def order_insert_many(self, order_infs: list):
+        """
+        批量插入订单，所有订单在一次executemany与一次提交中完成
+        每次运行使用独立的数据库，引擎是唯一的写入者，因此在同一事务中插入前的最大订单编号之后的订单就是本批订单，
+        读回的数量与本批订单数不一致时视为失败
+        :param order_infs: list(dict)，每个dict的格式与order_insert相同，且键的顺序一致
+        :return: 按插入顺序排列的订单编号列表，失败返回-1
+        """
+        if not order_infs:
+            return []
+        keys = list(order_infs[0].keys())
+        sql = "INSERT INTO `order` ({}) VALUES ({})".format(
+            ", ".join(keys),
+            ", ".join(["%s"] * len(keys))
+        )
+        values_list = [tuple(order_inf[key] for key in keys) for order_inf in order_infs]
+
+        try:
+            self._cursor.execute("SELECT COALESCE(MAX(order_id), 0) FROM `order`")
+            last_id = self._cursor.fetchone()[0]
+            self._cursor.executemany(sql, values_list)
+            self._cursor.execute("SELECT order_id FROM `order` WHERE order_id > %s ORDER BY order_id", (last_id,))
+            order_ids = [row[0] for row in self._cursor.fetchall()]
+            if len(order_ids) != len(order_infs):
+                print(f"批量插入失败，插入{len(order_infs)}个订单，读回{len(order_ids)}个订单编号")
+                self._conn.rollback()
+                return -1
+            self._commit()
+            return order_ids
+
+        except Error as e:
+            print(f"批量插入失败，错误原因为：{e}")
+            self._conn.rollback()
+            self.close_db()
+            return -1
+
     def order_delete(self, condition=None):
 
         sql = f"DELETE FROM `order`"
@@ -735,7 +1018,7 @@ class DatabaseManager:
 
         try:
             self._cursor.execute(sql)
-            self._conn.commit()
+            self._commit()
             # print(f"删除成功，共计删除{self._cursor.rowcount}行！")
             return 0
 
@@ -752,7 +1035,7 @@ class DatabaseManager:
 
         try:
             self._cursor.execute(sql, tuple(data.values()))
-            self._conn.commit()
+            self._commit()
             # print(f"更新成功，共计影响{self._cursor.rowcount}行！")
             return 0
 
@@ -796,6 +1079,45 @@ class DatabaseManager:
             self.close_db()
             return -1
 
+    def order_select_many(self, order_ids: list, columns: str = '*'):
+        """
+        按订单编号一次查询多个订单（WHERE order_id IN (...)）
+        :return: list(tuple)，顺序不保证与 order_ids 一致，失败返回-1
+        """
+        if not order_ids:
+            return []
+        sql = f"SELECT {columns} FROM `order` WHERE order_id IN ({', '.join(['%s'] * len(order_ids))})"
+
+        try:
+            self._cursor.execute(sql, tuple(order_ids))
+            return self._cursor.fetchall()
+
+        except Error as e:
+            print(f"查询失败，发生错误: {e}")
+            self.close_db()
+            return -1
+
+    def order_update_many(self, data: dict, order_ids: list):
+        """
+        将多个订单更新为相同的值，一次UPDATE（WHERE order_id IN (...)）与一次提交
+        :return: 0 - 成功；-1 - 失败
+        """
+        if not order_ids:
+            return 0
+        set_clause = ', '.join([f"{k} = %s" for k in data.keys()])
+        sql = f"UPDATE `order` SET {set_clause} WHERE order_id IN ({', '.join(['%s'] * len(order_ids))})"
+
+        try:
+            self._cursor.execute(sql, tuple(data.values()) + tuple(order_ids))
+            self._commit()
+            return 0
+
+        except Error as e:
+            print(f"更新失败，错误原因为：{e}")
+            self._conn.rollback()
+            self.close_db()
+            return -1
+
     # 现货表
     def actuals_insert(self, actuals_inf: dict):
         """
@@ -818,7 +1140,7 @@ class DatabaseManager:
 
         try:
             self._cursor.execute(sql, tuple(actuals_inf.values()))
-            self._conn.commit()
+            self._commit()
             # print(f"插入成功，共计插入{self._cursor.rowcount}行！")
             return self._cursor.lastrowid
 
@@ -836,7 +1158,7 @@ class DatabaseManager:
 
         try:
             self._cursor.execute(sql)
-            self._conn.commit()
+            self._commit()
             # print(f"删除成功，共计删除{self._cursor.rowcount}行！")
             return 0
 
@@ -853,7 +1175,7 @@ class DatabaseManager:
 
         try:
             self._cursor.execute(sql, tuple(data.values()))
-            self._conn.commit()
+            self._commit()
             # print(f"更新成功，共计影响{self._cursor.rowcount}行！")
             return 0
 
@@ -922,7 +1244,7 @@ class DatabaseManager:
 
         try:
             self._cursor.execute(sql, tuple(deal_record_inf.values()))
-            self._conn.commit()
+            self._commit()
             # print(f"插入成功，共计插入{self._cursor.rowcount}行！")
             return self._cursor.lastrowid
 
@@ -940,7 +1262,7 @@ class DatabaseManager:
 
         try:
             self._cursor.execute(sql)
-            self._conn.commit()
+            self._commit()
             # print(f"删除成功，共计删除{self._cursor.rowcount}行！")
             return 0
 
@@ -957,7 +1279,7 @@ class DatabaseManager:
 
         try:
             self._cursor.execute(sql, tuple(data.values()))
-            self._conn.commit()
+            self._commit()
             # print(f"更新成功，共计影响{self._cursor.rowcount}行！")
             return 0
 
@@ -967,6 +1289,26 @@ class DatabaseManager:
             self.close_db()
             return -1
 
+    def deal_record_update_many(self, columns, datas: list):
+        """
+        批量更新成交记录，所有更新在一次提交中完成
+        :param columns: 需要更新的字段
+        :param datas: list(tuple)，每个tuple为(各字段的值..., deal_id)
+        """
+        set_clause = ', '.join([f"{k} = %s" for k in columns])
+        sql = f"UPDATE `deal_record` SET {set_clause} WHERE deal_id = %s"
+
+        try:
+            self._cursor.executemany(sql, datas)
+            self._commit()
+            return 0
+
+        except Error as e:
+            print(f"批量更新失败，错误原因为：{e}")
+            self._conn.rollback()
+            self.close_db()
+            return -1
+
     def deal_record_select(self, columns: str = '*', conditions: dict = None, order_by: str = None,
                            order_direction: str = 'ASC', limit: int = None):
         sql = f"SELECT {columns} FROM `deal_record`"
@@ -1,5 +1,6 @@
 """引擎类，连接数据库，计算等"""
-from decimal import Decimal
+from decimal import Decimal, ROUND_HALF_EVEN, ROUND_FLOOR, ROUND_CEILING
+from functools import wraps
 
 try:
     import config
@@ -9,15 +10,59 @@ try:
     from dbmanager import DatabaseManager
 except:
     from .dbmanager import DatabaseManager
+try:
+    from sqlite_manager import SQLiteDatabaseManager
+except:
+    from .sqlite_manager import SQLiteDatabaseManager
+try:
+    from orderbook import OrderBook
+except:
+    from .orderbook import OrderBook
+try:
+    from ledger import AccountLedger
+except:
+    from .ledger import AccountLedger
+try:
+    from positions import PositionBook
+except:
+    from .positions import PositionBook
+try:
+    from money import to_fixed, to_decimal, to_float, mul
+except:
+    from .money import to_fixed, to_decimal, to_float, mul
 
 error_file = open("Error.txt", "w", encoding='utf-8')
 
+# 检查点保存的表（被引用的表在前）：表名 -> (自增主键, 快照之后仍然可能被修改的行)，{round} 为上一个检查点的回合
+# 订单与账户记录只在所属的回合内修改，成交单在平仓/交割前（状态为 open）修改保证金与状态，各表的行不会被删除
+CHECKPOINT_TABLES = {
+    'order': ('order_id', "`order_round`>={round}"),
+    'deal_record': ('deal_id', "`bid_status`='open' OR `sell_status`='open' OR `deal_round`>={round}"),
+    'agent_record': ('agent_record_id', "`round`>={round}"),
+    'futures_record': ('futures_record_id', "`round` IS NULL OR `round`>={round}"),
+    'actuals': ('actuals_id', "`current_round`>={round}"),
+}
+
+
+def in_transaction(method):
+    """装饰器，整个方法在数据库的一个事务中执行，中途失败（exit）时回滚"""
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.db.transaction():
+            return method(self, *args, **kwargs)
+    return wrapper
+
 
 class Engine:
     """引擎类"""
 
-    def __init__(self):
+    def __init__(self, backend: str = None):
+        """
+        :param backend: 存储后端，'mysql' / 'sqlite'，默认使用 config.backend
+        """
         self.round = 0
+        self.backend = backend if backend is not None else config.backend
+        self.db_name = None
         self.db = None  # 修改，原来的self.cursor变成dbmanager的内置变量了，这里直接通过self.db实现对数据库的所有操作
         self.futures = []
         # 镍编号
@@ -33,6 +78,23 @@ class Engine:
         # 上一轮交易收盘价，用于保证价格限制
         self.last_round_price = Decimal(0)
         self.super_user_id = 999  # 超级用户的id，被动参与交易
+        # 本回合的限价订单簿，跨回合内的多次出价保持，回合结算时清空（价格与数量为定点整数，见 money.py）
+        self.order_book = OrderBook()
+        # 当前回合所有玩家的账户信息，保证金的扣除/退还在内存中完成，批量写回数据库（资金为定点整数）
+        self.ledger = AccountLedger()
+        # 所有玩家仍然持有的合约，按玩家汇总多头/空头持仓量
+        self.positions = PositionBook()
+        # 本回合的下单情况（pending/done/cancel 状态的订单），order_totals[类型]=[下单总量，下单总金额]
+        self.order_totals = {'buy': [Decimal(0), Decimal(0)], 'sell': [Decimal(0), Decimal(0)]}
+
+    def _connect(self):
+        """按存储后端创建数据库管理对象"""
+        if self.backend == 'mysql':
+            return DatabaseManager(**config.connect_config)
+        if self.backend == 'sqlite':
+            return SQLiteDatabaseManager(**config.sqlite_config)
+        print(f"未知的存储后端{self.backend}，进程意外退出")
+        exit(-1)
 
     def sync_system_setting(self, security_fund_rate, limit, contract_round):
         """同步系统设定，security_fund_rate & limit & contract_round"""
@@ -79,14 +141,15 @@ class Engine:
         self.price_limit = Decimal(self.price_limit)
         self.last_round_price = Decimal(initial_futures_price).quantize(Decimal('0.0000000'))
 
+        self.order_book.clear()
+
         # 连接数据库
-        self.db = DatabaseManager(**config.connect_config)
+        self.db = self._connect()
         # conn = self.db.get_connect()
 
         # 创建数据库
-        db_find_sql = f"DROP DATABASE IF EXISTS {db_name}"
-        status = self.db.execute_sql(db_find_sql)
-        if status is None:
+        status = self.db.drop_db(db_name)
+        if status == -1:
             print(f"DROP DATABASE IF EXISTS {db_name}失败")
             exit(-1)
         print(f"数据库{db_name}存在，删除数据库完成")
@@ -94,6 +157,7 @@ class Engine:
 
         # 选择数据库
         self.db.select_db(db_name)
+        self.db_name = db_name
 
         # 创建表单
         self.db.create_table('agent', config.agent_field)  # 智能体表
@@ -103,6 +167,7 @@ class Engine:
         self.db.create_table('futures_record', config.futures_record_field)  # 期货合约记录表
         self.db.create_table('actuals', config.actuals_field)  # 现货表
         self.db.create_table('deal_record', config.deal_record_field)  # 订单成交记录表
+        self.migrate_schema()  # 高频查询的组合索引
 
         # 加入期货信息
         # 目前为镍，包含编号、名称、品种、初始价格、限额、保证金比例、最晚交割回合，传入insert的是{"":""}，需要指定的通过变量表示
@@ -180,8 +245,99 @@ class Engine:
             exit(-1)
         # print(f"镍现货信息加入成功,status={status}")
 
+        self._load_ledger()
+        self._load_positions()
+        self.resync_order_info()
+
+        return 0
+
+    def migrate_schema(self):
+        """
+        数据库结构迁移：为引擎的高频查询创建 config.index_fields 中的组合索引，已经存在的索引跳过
+        :return: 0
+        """
+        for table_name, indexes in config.index_fields.items():
+            for index_name, columns in indexes:
+                status = self.db.create_index(table_name, index_name, columns)
+                if status == -1:
+                    print(f"创建索引{table_name}.{index_name}失败，进程意外结束")
+                    exit(-1)
+        return 0
+
+    def checkpoint(self):
+        """
+        回合边界的检查点：引擎状态，数据库快照由 snapshot 单独更新
+        :return: 引擎状态字典（可以写入 json），用于 resume
+        """
+        return {
+            'db_name': self.db_name,
+            'round': self.round,
+            'last_price': str(self.last_price),
+            'last_round_price': str(self.last_round_price)
+        }
+
+    def snapshot(self):
+        """增量更新 CHECKPOINT_TABLES 的数据库快照，记录为当前回合的快照"""
+        status = self.db.snapshot_tables(CHECKPOINT_TABLES, self.round)
+        if status == -1:
+            print(f"保存{self.round}轮的数据库快照失败，进程意外退出")
+            exit(-1)
         return 0
 
+    def resume(self, state: dict):
+        """
+        从检查点恢复，代替 engine_init：连接已有的数据库（不删除），各表恢复为检查点回合的快照，
+        丢弃之后未完成的回合写入的数据，并重新加载账本、持仓与下单统计
+        需要先调用 sync_system_setting
+        :param state: checkpoint 返回的引擎状态
+        :return: 0 - 成功结束；-1 - 数据库快照不是 state 对应回合的快照
+        """
+        db = self._connect()
+        db.select_db(state['db_name'])
+        snapshot_round = db.snapshot_round()
+        if snapshot_round != state['round']:
+            print(f"数据库快照的回合（{snapshot_round}）与检查点的回合（{state['round']}）不一致")
+            db.close_db()
+            return -1
+
+        self.round = state['round']
+        self.last_price = Decimal(state['last_price'])
+        self.last_round_price = Decimal(state['last_round_price'])
+        self.order_book.clear()
+        self.db = db
+        self.db_name = state['db_name']
+        status = self.db.restore_tables(list(CHECKPOINT_TABLES))
+        if status == -1:
+            print(f"从{self.round}轮的数据库快照恢复失败，进程意外结束")
+            exit(-1)
+        print(f"数据库{self.db_name}已恢复到第{self.round}轮结束时的状态")
+
+        self._load_ledger()
+        self._load_positions()
+        self.resync_order_info()
+        return 0
+
+    def _load_ledger(self):
+        """从数据库中重新加载当前回合的账户信息（直接通过SQL修改`agent_record`之后需要调用）"""
+        status = self.ledger.load(self.db, self.round)
+        if status == -1:
+            print(f"加载{self.round}轮的账户信息失败，进程意外退出")
+            exit(-1)
+
+    def _load_positions(self):
+        """从数据库中重新加载持仓簿（直接通过SQL修改`deal_record`的状态之后需要调用）"""
+        status = self.positions.load(self.db)
+        if status == -1:
+            print("加载持仓信息失败，进程意外退出")
+            exit(-1)
+
+    def _flush_ledger(self):
+        """将账户信息的修改批量写回数据库"""
+        status = self.ledger.flush()
+        if status == -1:
+            print(f"将{self.round}轮的账户信息写回数据库失败，进程意外退出")
+            exit(-1)
+
     def _order_info_insert(self, agent_id, order_type, order_price, order_lots, order_round, order_num: int = 0,
                            remain_lots: Decimal = Decimal(0), order_status: str = 'done'):
         '''
@@ -340,6 +496,9 @@ class Engine:
         if status == -1:
             print(f"在更新玩家{self.super_user_id}的账户信息时出错，进程意外退出")
             exit(-1)
+        self._load_ledger()  # 账户信息已直接修改，重新加载账本
+        self._load_positions()  # 新增了模拟开始前的持仓
+        self.resync_order_info()  # 新增了模拟开始前的订单
 
     def _contract(self, all_agent_record):
         '''
@@ -379,6 +538,7 @@ class Engine:
                 if status == -1:
                     print(f"更新成交单{buy_order[2]}的买方状态失败")
                     exit(-1)
+                self.positions.close(buy_order[2], 'buy')
             # 获取卖单
             sell_orders_sql = f"""
             SELECT `deal_lots`,`deal_price`,`deal_id`
@@ -395,6 +555,7 @@ class Engine:
                 if status == -1:
                     print(f"更新成交单{sell_order[2]}的卖方状态失败")
                     exit(-1)
+                self.positions.close(sell_order[2], 'sell')
 
             # 交割结算
             available_funds = available_funds + security_funds + total_profit  # 退还保证金，自负盈亏
@@ -410,6 +571,7 @@ class Engine:
                 exit(-1)
         return
 
+    @in_transaction
     def round_end(self):
         """回合结束，当前回合+1，返回增加后的回合数。如果到达最晚交割回合，完成交割"""
         self.round += 1
@@ -423,6 +585,8 @@ class Engine:
 
         if self.round > self.contract_round:  # 交割
             self._contract(all_agent_record=all_agent_record)
+            self._load_ledger()  # 账本切换到交割后的账户信息
+            self._reset_order_info()
             print("最终交割完成")
             return self.round
 
@@ -440,6 +604,8 @@ class Engine:
             if status == -1:  # 失败
                 print(f"插入玩家{agent_record[0]}的新一轮信息失败，进程意外退出")
                 exit(-1)
+        self._load_ledger()  # 账本切换到新的一回合
+        self._reset_order_info()  # 新的一回合还没有订单
         print(f"本回合结束，下一个回合{self.round}，下一回合的账户信息初始化成功")
         return self.round
 
@@ -464,72 +630,13 @@ class Engine:
             exit(-1)
         current_Ni_price = float(current_Ni_price[0][0])
 
-        # 镍期货持有信息，排除超级用户的影响
-        sql_bid_user = f"""
-        SELECT `agent`.`agent_name`,SUM(`deal_record`.`deal_lots`) AS bid_deal
-        FROM `order` JOIN `deal_record` ON `deal_record`.`bid_order_id`=`order`.`order_id` JOIN `agent` ON `agent`.`agent_id`=`order`.`agent_id`
-        WHERE `deal_record`.`bid_status`='open' AND `agent`.`agent_id`!={self.super_user_id}
-        GROUP BY `order`.`agent_id`
-        """  # sql语句，买入镍期货合约的用户情况
-        bid_user = self.db.execute_sql(sql_bid_user)  # 形式为：[(购买用户名，购买量),...]
-        if bid_user is None:
-            print("获取买入镍期货合约的用户失败，进程意外退出")
-            exit(-1)
-        # 将deal_lots转为float
-        cnt = 0
-        for user in bid_user:
-            bid_user[cnt] = (user[0], float(user[1]))
-            cnt += 1
-        bid_user.sort(key=lambda x: ((-1) * x[1], x[0]))
-
-        sql_sell_user = f"""
-        SELECT `agent`.`agent_name`,SUM(`deal_record`.`deal_lots`) AS sell_deal
-        FROM `order` JOIN `deal_record` ON `deal_record`.`sell_order_id`=`order`.`order_id` JOIN `agent` ON `agent`.`agent_id`=`order`.`agent_id`
-        WHERE `deal_record`.`sell_status`='open' AND `agent`.`agent_id`!={self.super_user_id}
-        GROUP BY `order`.`agent_id`
-        """  # sql语句，卖出镍期货合约的用户情况
-        sell_user = self.db.execute_sql(sql_sell_user)  # 形式为：[(卖出用户名，卖出量),...]
-        if sell_user is None:
-            print("获取卖出镍期货合约的用户失败，进程意外退出")
-            exit(-1)
-        cnt = 0
-        for user in sell_user:
-            sell_user[cnt] = (user[0], float(user[1]))
-            cnt += 1
-        sell_user.sort(key=lambda x: ((-1) * x[1], x[0]))
-
-        # 上一轮交易情况信息，也排除超级用户的影响
-        last_sql_bid_user = f"""
-        SELECT `agent`.`agent_name`,SUM(`deal_record`.`deal_lots`) AS bid_deal
-        FROM `order` JOIN `deal_record` ON `deal_record`.`bid_order_id`=`order`.`order_id` JOIN `agent` ON `agent`.`agent_id`=`order`.`agent_id`
-        WHERE `deal_record`.`deal_round`={self.round - 1} AND `deal_record`.`bid_status`='open' AND `agent`.`agent_id`!={self.super_user_id}
-        GROUP BY `order`.`agent_id`
-        """  # sql语句，上一轮买入镍期货合约的用户情况
-        last_bid_user = self.db.execute_sql(last_sql_bid_user)  # 形式为：[(购买用户名，购买量),...]
-        if last_bid_user is None:
-            print("获取上一轮买入镍期货合约的用户失败，进程意外退出")
-            exit(-1)
-        cnt = 0
-        for user in last_bid_user:
-            last_bid_user[cnt] = (user[0], float(user[1]))
-            cnt += 1
-        last_bid_user.sort(key=lambda x: ((-1) * x[1], x[0]))
-
-        last_sql_sell_user = f"""
-        SELECT `agent`.`agent_name`,SUM(`deal_record`.`deal_lots`) AS sell_deal
-        FROM `order` JOIN `deal_record` ON `deal_record`.`sell_order_id`=`order`.`order_id` JOIN `agent` ON `agent`.`agent_id`=`order`.`agent_id`
-        WHERE `deal_record`.`deal_round`={self.round - 1} AND `deal_record`.`sell_status`='open' AND `agent`.`agent_id`!={self.super_user_id}
-        GROUP BY `order`.`agent_id`
-        """  # sql语句，卖出镍期货合约的用户情况
-        last_sell_user = self.db.execute_sql(last_sql_sell_user)  # 形式为：[(卖出用户名，卖出量),...]
-        if last_sell_user is None:
-            print("获取上一轮卖出镍期货合约的用户失败，进程意外退出")
-            exit(-1)
-        cnt = 0
-        for user in last_sell_user:
-            last_sell_user[cnt] = (user[0], float(user[1]))
-            cnt += 1
-        last_sell_user.sort(key=lambda x: ((-1) * x[1], x[0]))
+        # 镍期货持有信息，排除超级用户的影响，来自持仓簿，形式为：[(用户名，持仓量),...]
+        bid_user = self.positions.holders('buy', excluded=(self.super_user_id,))
+        sell_user = self.positions.holders('sell', excluded=(self.super_user_id,))
+
+        # 上一轮交易情况信息（上一回合成交、仍然持有的合约），也排除超级用户的影响
+        last_bid_user = self.positions.holders('buy', deal_round=self.round - 1, excluded=(self.super_user_id,))
+        last_sell_user = self.positions.holders('sell', deal_round=self.round - 1, excluded=(self.super_user_id,))
 
         # print(f"current_Ni_price={current_Ni_price},Ni_inventory={Ni_inventory}\n")
 
@@ -548,68 +655,31 @@ class Engine:
 
     def retrieve_account_info(self, player_id):
         """
-        根据角色id和当前回合，检索当前账户信息
-        :param player_id: 角色 id
-        :return: Dict
+        检索玩家账户信息，来自账本与持仓簿，不查询数据库
+        :return: 一个字典 {capital, security_deposit, available_deposit, Ni_long, Ni_short, profit_loss}
         """
-
-        # 资金信息从`agent_record`中获取
-        result = self.db.agent_record_select(columns='current_funds,available_funds,security_funds,profit_loss',
-                                             conditions={'agent_id': player_id, 'round': self.round})
-        # result的形式为：[(current_funds，available_funds，security_funds)]
-        if result == -1:
+        account = self.ledger.get(player_id)
+        if account is None:
             print(f"获取玩家{player_id}的账户信息失败，进程意外退出")
             exit(-1)
-        capital = float(result[0][0])
-        available_deposit = float(result[0][1])
-        security_deposit = float(result[0][2])
-        profit_loss = float(result[0][3])
-        # print(
-        # f"<玩家{player_id}>：capital={capital},available_deposit={available_deposit},security_deposit={security_deposit}")
-
-        # 合约信息从deal_record中获取
-        Ni_long_sql = f"""
-        SELECT SUM(`deal_lots`),`deal_price`
-        FROM `deal_record` JOIN `order` ON `deal_record`.`bid_order_id`=`order`.`order_id`
-        WHERE `order`.`agent_id`={player_id} AND `deal_record`.`bid_status`='open'
-        GROUP BY `deal_price`
-        """  # 如果没有信息，则为[]；否则为[(交易量，交易价格),...]
-        Ni_long = self.db.execute_sql(Ni_long_sql)
-        if Ni_long is None:
-            print(f"获取玩家{player_id}的买入合约失败，进程意外退出")
-            exit(-1)
-        cnt = 0
-        for long in Ni_long:
-            Ni_long[cnt] = (float(long[0]), float(long[1]))
-            cnt += 1
-        # print(f"Ni_long={Ni_long}")
-
-        Ni_short_sql = f"""
-        SELECT  SUM(`deal_lots`),`deal_price`
-        FROM `deal_record` JOIN `order` ON `deal_record`.`sell_order_id`=`order`.`order_id`
-        WHERE `order`.`agent_id`={player_id} AND `deal_record`.`sell_status`='open'
-        GROUP BY `deal_price`
-        """  # 如果没有信息，则为[]；否则为[(交易量，交易价格),...]
-        Ni_short = self.db.execute_sql(Ni_short_sql)
-        if Ni_short is None:
-            print(f"获取玩家{player_id}的卖出合约失败，进程意外退出")
-            exit(-1)
-        cnt = 0
-        for short in Ni_short:
-            Ni_short[cnt] = (float(short[0]), float(short[1]))
-            cnt += 1
-        # print(f"Ni_short={Ni_short}")
-
         returnDict = {
-            "capital": capital,  # - 总资产 float
-            "security_deposit": security_deposit,  # - 保证金 float
-            "available_deposit": available_deposit,  # - 可用资金 float
-            "Ni_long": Ni_long,  # - 多头合约（持有的买单信息） list(tuple)——合并了价格相同的成交订单
-            "Ni_short": Ni_short,  # - 空头合约
-            "profit_loss": profit_loss  # 盈亏
+            "capital": to_float(account['current_funds']),  # - 总资产 float
+            "security_deposit": to_float(account['security_funds']),  # - 保证金 float
+            "available_deposit": to_float(account['available_funds']),  # - 可用资金 float
+            "Ni_long": self.positions.contracts(player_id, 'buy'),  # - 多头合约（持有的买单信息） list(tuple)——合并了价格相同的成交订单，[(交易量，交易价格),...]
+            "Ni_short": self.positions.contracts(player_id, 'sell'),  # - 空头合约
+            "profit_loss": to_float(account['profit_loss'])  # 盈亏
         }
         return returnDict
 
+    def retrieve_all_account_info(self):
+        """
+        一次获取所有玩家（不含超级用户）的账户信息，不查询数据库
+        :return: {玩家编号: retrieve_account_info 的返回值}
+        """
+        return {agent_id: self.retrieve_account_info(agent_id) for agent_id in sorted(self.ledger.accounts)
+                if agent_id != self.super_user_id}
+
     def fund_supplement(self, agent_id: int, amount):
         '''
         补充资金
@@ -617,182 +687,117 @@ class Engine:
         :param amount：补充资金数（直接增加到可用资金）
         返回：1，更新成功
         '''
-        results = self.db.agent_record_select(columns='agent_record_id,current_funds,available_funds',
-                                              conditions={'agent_id': agent_id, 'round': self.round})
-        if results == -1:
+        account = self.ledger.get(agent_id)
+        if account is None:
             print(f"在补充资金时，搜索{agent_id}编号玩家的账户信息失败")
             exit(-1)
-        agent_record_id = results[0][0]
-        current_funds = results[0][1]
-        available_funds = results[0][2]
         # 补充资金
-        current_funds += Decimal(amount)
-        available_funds += Decimal(amount)
+        amount = to_fixed(Decimal(amount))
+        current_funds = account['current_funds'] + amount
+        available_funds = account['available_funds'] + amount
         # 更新账户信息
-        status = self.db.agent_record_update(data={'current_funds': current_funds, 'available_funds': available_funds},
-                                             condition=f'agent_record_id={agent_record_id}')
-        if status == -1:
-            print(f"在补充资金时，更新{agent_id}编号玩家的账户信息失败")
-            exit(-1)
+        self.ledger.update(agent_id, current_funds=current_funds, available_funds=available_funds)
+        self._flush_ledger()
         return 1
 
-    def get_order_info(self):
-        '''
-        获取本回合截止目前的下单情况
-        返回：买单总量，买单平均价格，卖单总量，卖单平均价格
-        '''
-        buy_order_sql = f"""
-        SELECT SUM(`order_lots`),SUM(`order_lots`*`order_price`)/SUM(`order_lots`)
-        FROM `order`
-        WHERE `order_round`={self.round} AND `order_type`='buy' AND (`order_status`='pending' OR `order_status`='done' OR `order_status`='cancel')
+    def _reset_order_info(self):
+        for totals in self.order_totals.values():
+            totals[0] = Decimal(0)
+            totals[1] = Decimal(0)
+
+    def _count_order(self, order_type, order_lots, order_price, sign=1):
+        """订单进入（sign=1）或离开（sign=-1）本回合的下单统计（pending/done/cancel 状态）"""
+        totals = self.order_totals[order_type]
+        totals[0] += sign * order_lots
+        totals[1] += sign * order_lots * order_price
+
+    def resync_order_info(self):
         """
-        results = self.db.execute_sql(sql=buy_order_sql)
-        if results is None:
-            print(f"获取{self.round}轮的下单情况失败")
-            exit(-1)
-        long_amount = results[0][0]
-        long_price = results[0][1]
-        if long_amount is None:
-            long_amount = 0
-            long_price = 0
-
-        sell_order_sql = f"""
-        SELECT SUM(`order_lots`),SUM(`order_lots`*`order_price`)/SUM(`order_lots`)
+        从数据库中重新统计本回合的下单情况（直接通过SQL修改`order`之后需要调用）
+        :return: 0
+        """
+        self._reset_order_info()
+        order_sql = f"""
+        SELECT `order_type`,SUM(`order_lots`),SUM(`order_lots`*`order_price`)
         FROM `order`
-        WHERE `order_round`={self.round} AND `order_type`='sell' AND (`order_status`='pending' OR `order_status`='done' OR `order_status`='cancel')
+        WHERE `order_round`={self.round} AND (`order_status`='pending' OR `order_status`='done' OR `order_status`='cancel')
+        GROUP BY `order_type`
         """
-        results = self.db.execute_sql(sql=sell_order_sql)
+        results = self.db.execute_sql(sql=order_sql)
         if results is None:
             print(f"获取{self.round}轮的下单情况失败")
             exit(-1)
-        sell_amount = results[0][0]
-        sell_price = results[0][1]
-        if sell_amount is None:
-            sell_amount = 0
-            sell_price = 0
+        for order_type, lots, notional in results:
+            self.order_totals[order_type] = [Decimal(lots), Decimal(notional)]
+        return 0
+
+    def get_order_info(self):
+        '''
+        获取本回合截止目前的下单情况，来自下单、撤单与结算时增量维护的统计，不查询数据库
+        返回：买单总量，买单平均价格，卖单总量，卖单平均价格
+        '''
+        long_amount, long_notional = self.order_totals['buy']
+        long_price = long_notional / long_amount if long_amount else 0
+        sell_amount, sell_notional = self.order_totals['sell']
+        sell_price = sell_notional / sell_amount if sell_amount else 0
 
         return float(long_amount), float(long_price), float(sell_amount), float(sell_price)
 
-    def _match_orders_modify(self, buy_orders, sell_orders):
+    def _match_orders_modify(self):
         '''
         撮合交易函数，实现时间优先、价格优先原则，同时避免同一个玩家的订单彼此成交。在订单成交前，会判断可用资金是否充足，若不充足，则不会成交。
-        :param buy_orders/sell_orders:list(tuple)，tuple的元组为：(订单编号，玩家编号，剩余未成交量，价格，优先级)
-        返回：需要更新remain_lots的买/卖订单，匹配成功的订单
+        待撮合的订单来自订单簿 self.order_book，订单格式为：[订单编号，玩家编号，剩余未成交量，价格，优先级]
+        返回：需要更新remain_lots的买/卖订单，匹配成功的订单（其中的数量、价格均为定点整数）
         '''
-        cnt_loop=0
-        max_iter = len(buy_orders) * len(sell_orders)*2+max(len(buy_orders),len(sell_orders)) #最大允许迭代次数
-
-        # 获取所有玩家编号
-        results = self.db.agent_select(columns='agent_id')  # [(agent_id))]
-        if results == -1:
-            print("获取所有玩家的编号信息失败")
-            exit(-1)
-        # 获取玩家编号对应的可用资金数
-        available_funds = {}  # 记录可用资金数目，available_fund[agent_id]=可用资金
-        for i in results:
-            agent_id = i[0]
-            account = self.db.agent_record_select(columns='available_funds',
-                    conditions={'agent_id': agent_id, 'round': self.round})
-            if account == -1:
-                print(f"获取玩家{agent_id}在{self.round}轮的账户信息失败")
-                exit(-1)
-            available_funds[agent_id] = account[0][0]
-        # 按照买入价格从高到低排序，优先级编号（时间）从低到高排序
-        buy_orders.sort(key=lambda x: ((-1) * x[3], x[4]))
-        # 按照卖出价格从低到高排序，优先级编号（时间）从低到高排序
-        sell_orders.sort(key=lambda x: (x[3], x[4]))
+        # 获取玩家编号对应的可用资金数（来自账本，已经扣除了本回合挂单的保证金）
+        available_funds = self.ledger.available_funds()  # 记录可用资金数目，available_fund[agent_id]=可用资金
+        # 撮合过程中的价格、数量与资金均为定点整数，上一笔成交价在撮合结束后转换回 Decimal
+        margin_rate = to_fixed(self.margin_rate)
+        last_price = to_fixed(self.last_price)
 
         matches = []  # 记录成交信息,(买家订单编号，卖家订单编号，成交量，成交价格，买方编号，卖方编号，买方出价，卖方出价)[后面四个是为了方便我计算保证金]
         update_buy = {}  # 记录remain_lots有更新的项目，形式为：{订单编号（独一无二的）:(tuple元组)}
         update_sell = {}
 
-        j=0 # 记录当前待匹配的买单下标
-        while j < len(buy_orders):  # 买单不为空
-            progressed = False  # 防死循环哨兵
-
-            buy_order = buy_orders[j]  # 取出优先级最高的待匹配买单——买单不用担心可用资金不足，因为买单的保证金最多退回/不变，可用资金增加/不变
-            buy_volumes = buy_order[2]  # 买方购买量
-
-            if len(sell_orders) > 0:
-                if buy_order[3] < sell_orders[0][3]:
-                    # 优先级最高的买单价格已经低于卖单价格了，无法匹配，直接退出
-                    break
-            else:  # 没有sell_orders了
-                break
-
-            if cnt_loop>max_iter:
-                break
-
-            i=0 # 卖单指针
-            while i < len(sell_orders) and buy_volumes>0: # 遍历所有卖单，直至结束/匹配完买单的量
-                
-                cnt_loop+=1
-                if cnt_loop>max_iter:
-                    break
-
-                sell_order = sell_orders[i] # 卖单的保证金可能不变/需要补缴，这个时候就需要充足的可用资金了
-                # 同一玩家不能成交
-                if buy_order[1] == sell_order[1]:
-                    i += 1
-                    continue
-
-                # 价格不满足，直接结束当前买单
-                if buy_order[3] < sell_order[3]:
-                    break
-
-                trade_volume = min(buy_volumes, sell_order[2]) # 成交量为买入量和卖出量的最小值
-
-                # === 成交价 ===
-                if self.last_price >= buy_order[3]:
-                    # 如果上一笔交易成交价大于等于买价，则成交价为买价
-                    price = buy_order[3]
-                elif self.last_price <= sell_order[3]:
-                    # 上一笔交易成交价小于等于卖价，则成交价为卖价
-                    price = sell_order[3]
-                else:
-                    # 处于两者中间，成交价为上一笔成交价
-                    price = self.last_price
-                
-                # 根据可用资金判断是否能够成交
-                margin_sell = Decimal(self.margin_rate * (price - sell_order[3]) * trade_volume).quantize(Decimal('0.0000000'))  # 对于卖方来说，需要补缴的保证金
-                if margin_sell > available_funds[sell_order[1]]:  # 可用资金不足，当前订单无法成交，判断下一笔卖单
-                    i+=1
-                    continue
-
-                # === 执行成交 ===
-                # 可用资金充足，但这笔订单成交后，买卖双方的可用资金都需要相应变化
-                available_funds[sell_order[1]] -= margin_sell
-                margin_buy = Decimal(self.margin_rate * (price - buy_order[3]) * trade_volume).quantize(Decimal('0.0000000'))  # 负数，需要退还的保证金
-                available_funds[buy_order[1]] -= margin_buy
-
-                matches.append((buy_order[0], sell_order[0], trade_volume, price, buy_order[1], sell_order[1],buy_order[3], sell_order[3]))  # 成交信息
-                self.last_price = price  # 更新上一笔交易的价格
-                progressed = True  # 有进展
-
-                # 更新买单买入量，要全部赋值，因为tuple不支持单item更新
-                buy_order = (buy_order[0], buy_order[1], buy_order[2] - trade_volume, buy_order[3], buy_order[4])
-                buy_volumes -= trade_volume
-                update_buy[buy_order[0]] = buy_order
-
-                sell_remain = sell_order[2] - trade_volume
-                sell_order = (sell_order[0], sell_order[1], sell_remain, sell_order[3], sell_order[4])
-                sell_orders[i] = sell_order
-                update_sell[sell_order[0]] = sell_order
-
-                if sell_remain == 0: # 卖单已经全部卖出，更新卖单队列
-                    sell_orders.pop(i) # 不应该修改i的值，因为匹配完的已经删除了，下一个待匹配的下标仍旧为1
-                else:  # 未全部卖出，更新卖单队列内容（且此时必定意味着买方已经全部成交）
-                    sell_orders[i] = sell_order
-                    i+=1
-
-                if buy_volumes==0: #买单已全部匹配，处理下一个
-                    buy_orders.pop(j)
-                    j=0
-                    break
-            
-            # 如果这一轮啥也没发生，强制推进 j
-            if not progressed:
-                j+=1
+        def try_match(buy_order, sell_order):
+            '''尝试撮合一对订单，返回成交量，0说明不能成交'''
+            nonlocal last_price
+            # 同一玩家的订单由订单簿跳过，不会传入
+            trade_volume = min(buy_order[2], sell_order[2])  # 成交量为买入量和卖出量的最小值
+
+            # === 成交价 ===
+            if last_price >= buy_order[3]:
+                # 如果上一笔交易成交价大于等于买价，则成交价为买价
+                price = buy_order[3]
+            elif last_price <= sell_order[3]:
+                # 上一笔交易成交价小于等于卖价，则成交价为卖价
+                price = sell_order[3]
+            else:
+                # 处于两者中间，成交价为上一笔成交价
+                price = last_price
+
+            # 根据可用资金判断是否能够成交，卖单的保证金可能不变/需要补缴，这个时候就需要充足的可用资金了
+            margin_sell = mul(margin_rate, price - sell_order[3], trade_volume)  # 对于卖方来说，需要补缴的保证金
+            if margin_sell > available_funds[sell_order[1]]:  # 可用资金不足，当前订单无法成交，判断下一笔卖单
+                return 0
+
+            # === 执行成交 ===
+            # 可用资金充足，但这笔订单成交后，买卖双方的可用资金都需要相应变化
+            available_funds[sell_order[1]] -= margin_sell
+            margin_buy = mul(margin_rate, price - buy_order[3], trade_volume)  # 负数，需要退还的保证金
+            available_funds[buy_order[1]] -= margin_buy
+
+            matches.append((buy_order[0], sell_order[0], trade_volume, price, buy_order[1], sell_order[1], buy_order[3], sell_order[3]))  # 成交信息
+            last_price = price  # 更新上一笔交易的价格
+
+            # 记录成交后的剩余量，订单簿中的剩余量由订单簿自行扣减
+            update_buy[buy_order[0]] = (buy_order[0], buy_order[1], buy_order[2] - trade_volume, buy_order[3], buy_order[4])
+            update_sell[sell_order[0]] = (sell_order[0], sell_order[1], sell_order[2] - trade_volume, sell_order[3], sell_order[4])
+            return trade_volume
+
+        self.order_book.match(try_match)
+        if matches:
+            self.last_price = to_decimal(last_price)
 
         return update_buy, update_sell, matches
 
@@ -800,23 +805,21 @@ class Engine:
         '''
         缴纳保证金
         :param player_id：玩家编号
-        :param margin:要缴纳的保证金价格，正数说明是缴纳，负数说明是退还
+        :param margin:要缴纳的保证金价格（定点整数），正数说明是缴纳，负数说明是退还
         '''
-        margin = Decimal(margin).quantize(Decimal('0.0000000'))
         # 先获取当前可用资金，查看是否足以缴纳保证金
-        results = self.db.agent_record_select(columns='available_funds,security_funds,agent_record_id',
-                                              conditions={'agent_id': player_id, 'round': self.round})
-        if results == -1:
+        account = self.ledger.get(player_id)
+        if account is None:
             print(f"获取玩家{player_id}的当前可用资金失败，进程意外退出")
             exit(-1)
-        available_funds = results[0][0]
-        security_funds = results[0][1]
-        record_id = results[0][2]
+        available_funds = account['available_funds']
+        security_funds = account['security_funds']
         if available_funds < margin:  # 不足以缴纳保证金
             return 0
         available_funds -= margin  # 更新可用资金
         security_funds += margin  # 更新保证金
         if security_funds < 0:
+            margin, security_funds, available_funds = to_decimal(margin), to_decimal(security_funds), to_decimal(available_funds)  # 错误信息中显示为金额
             if security_funds < -1:
                 print(
                     f"<Error>:{self.round}轮出现未知情况，{player_id}的保证金居然小于-1！margin={margin},security={security_funds},available={available_funds}")
@@ -828,14 +831,11 @@ class Engine:
                 error_file.write(
                     f"<Error>:{self.round}轮出现未知情况，{player_id}的保证金居然小于-1！margin={margin},security={security_funds},available={available_funds}，但为了安全考虑，保证金设置为0\n")
             security_funds = 0
-        status = self.db.agent_record_update(
-            data={'available_funds': available_funds, 'security_funds': security_funds},
-            condition=f'agent_record_id={record_id}')  # 更新存储信息
-        if status == -1:
-            print(f"在更新玩家{player_id}的账户信息时出错，进程意外退出")
-            exit(-1)
+            available_funds = to_fixed(available_funds)
+        self.ledger.update(player_id, available_funds=available_funds, security_funds=security_funds)  # 更新账本，由调用方批量写回
         return 1
 
+    @in_transaction
     def deal_making(self, transactions: list):
         """
         transactions 中包含用户 ID 信息
@@ -852,107 +852,94 @@ class Engine:
         if len(transactions) == 0:  # 没有交易
             return [], [], []
         turn = transactions[0][1]
-        # 首先，将订单插入order中并扣除保证金，并在这个时候检查价格是否超过涨跌限制，若超过，直接将状态设置为'无效'(invalid)
-        high_price = self.last_round_price * (1 + self.price_limit)  # 最高价
-        low_price = self.last_round_price * (1 - self.price_limit)  # 最低价
-        cnt = 0  # 已经处理的order数量
+        # 首先在内存中检查价格是否超过涨跌限制（超过则状态为'无效'(invalid)），并在账本中扣除保证金，确定每个订单的最终状态
+        # 价格、数量与保证金均为定点整数，涨跌停价格向内取整后与定点价格比较，结果与 Decimal 比较相同
+        high_price = to_fixed(self.last_round_price * (1 + self.price_limit), rounding=ROUND_FLOOR)  # 最高价
+        low_price = to_fixed(self.last_round_price * (1 - self.price_limit), rounding=ROUND_CEILING)  # 最低价
+        margin_rate = to_fixed(self.margin_rate)
+        order_infs = []
+        fixed_orders = []  # [(价格，数量)]，定点整数
         for transaction in transactions:
+            # 价格与数量按数据库的精度（7位小数）保存，保证订单簿与数据库中的数值一致
+            order_price = to_fixed(transaction[4])
+            order_lots = to_fixed(transaction[3])
+            fixed_orders.append((order_price, order_lots))
             order_inf = {
                 'agent_id': transaction[0],
                 'futures_id': self.Ni_id,
                 'order_type': transaction[2],
-                'order_price': transaction[4],
-                'order_lots': transaction[3],
-                'remain_lots': transaction[3],
+                'order_price': to_decimal(order_price),
+                'order_lots': to_decimal(order_lots),
+                'remain_lots': to_decimal(order_lots),
                 'order_round': self.round,
-                'order_num': transaction[1]
+                'order_num': transaction[1],
+                'order_status': 'pending'
             }
-            if Decimal(transaction[4]) >= low_price and Decimal(transaction[4]) <= high_price:  # 正常价格
-                order_inf['order_status'] = 'pending'
-                status = self.db.order_insert(order_inf)
-                if status == -1:
-                    print(f"玩家{transaction[0]}的本轮交易插入失败，进程意外退出")
-                    exit(-1)
-                transactions[cnt].insert(1,
-                                         status)  # 从[agent_id, turn, type, amount, price]变成[agent_id, order_id, turn, type, amount, price]
-                # transactions变了之后，transaction也变了
-                cnt += 1
-            else:  # 超过波动，直接无法参加下一波交易
+            order_infs.append(order_inf)
+            if order_price < low_price or order_price > high_price:  # 超过波动，直接无法参加下一波交易
                 order_inf['order_status'] = 'invalid'
-                status = self.db.order_insert(order_inf)
-                if status == -1:
-                    print(f"玩家{transaction[0]}的本轮交易插入失败，进程意外退出")
-                    exit(-1)
-                transactions[cnt].insert(1,
-                                         status)  # 从[agent_id, turn, type, amount, price]变成[agent_id, order_id, turn, type, amount, price]
-                cnt += 1
                 continue
 
             # 下单时先自动扣除保证金，为出价*保证金率（如果订单成交了，需要再将其与合同成交价对比返回对应保证金？）
-            margin = (self.margin_rate * Decimal(transaction[4]) * Decimal(transaction[5])).quantize(
-                Decimal('0.0000000'))  # 保证金=保证金率*期货合约量*单位价格
+            margin = mul(margin_rate, order_lots, order_price)  # 保证金=保证金率*期货合约量*单位价格
             res = self._pay_margin(transaction[0], margin)
             if res == 0:
                 # 说明可用资金不足以缴纳保证金，状态自动变为no_margin(无充足可用资金)
-                res = self.db.order_update(data={'order_status': 'no_margin'}, condition=f'order_id={status}')
-                if res == -1:
-                    print(f"玩家{transaction[0]}所下订单无充足可用资金，order_id={status}，但状态更新失败")
-                    exit(-1)
-        # print(f"将订单编号插入后，transactions={transactions}")
-        # input("初始保证金扣除成功")
+                order_inf['order_status'] = 'no_margin'
 
-        # 进行交易撮合
-        # 首先找出本轮中未成功交易的订单（编号是唯一标识）
-        buy_deals = self.db.order_select(columns='order_id,agent_id,remain_lots,order_price,order_num',
-                                         conditions={'order_type': 'buy', 'order_round': self.round,
-                                                     'order_status': 'pending'})
-        if buy_deals == -1:
-            print(f"找出{self.round}轮中（第{turn}回合）的待撮合买单交易失败！")
-            exit(-1)
-
-        sell_deals = self.db.order_select(columns='order_id,agent_id,remain_lots,order_price,order_num',
-                                          conditions={'order_type': 'sell', 'order_round': self.round,
-                                                      'order_status': 'pending'})
-        if sell_deals == -1:
-            print(f"找出{self.round}轮中（第{turn}回合）的待撮合卖单交易失败！")
+        # 所有订单一次性插入order中
+        order_ids = self.db.order_insert_many(order_infs)
+        if order_ids == -1 or len(order_ids) != len(transactions):
+            print(f"{self.round}轮第{turn}次出价的订单插入失败，进程意外退出")
             exit(-1)
+        for transaction, order_id, order_inf, (order_price, order_lots) in zip(transactions, order_ids, order_infs,
+                                                                                fixed_orders):
+            transaction.insert(1, order_id)  # 从[agent_id, turn, type, amount, price]变成[agent_id, order_id, turn, type, amount, price]
+            if order_inf['order_status'] == 'pending':
+                self._count_order(transaction[3], order_inf['order_lots'], order_inf['order_price'])
+                # 保证金缴纳成功，挂入订单簿等待撮合
+                self.order_book.add(order_id=order_id, agent_id=transaction[0], side=transaction[3],
+                                    lots=order_lots, price=order_price, order_num=transaction[2])
+        # print(f"将订单编号插入后，transactions={transactions}")
+        # input("初始保证金扣除成功")
 
+        # 进行交易撮合，待撮合的订单（本回合内所有pending状态的订单）都保存在订单簿中，无需再从数据库中查询
         # 交易撮合部分,matches=(买家订单编号，卖家订单编号，成交量，成交价格，买方编号，卖方编号，买方出价，卖方出价）
-        # update_buy, update_sell, matches = self._mathch_orders_new(buy_orders=buy_deals, sell_orders=sell_deals)
-        update_buy, update_sell, matches = self._match_orders_modify(buy_orders=buy_deals, sell_orders=sell_deals)  
+        update_buy, update_sell, matches = self._match_orders_modify()
         # print(f"update_buy={update_buy}\nupdate_sell={update_sell}\nmatches={matches}")
 
         # 更新买单的剩余量
         for key, i in update_buy.items():
             if i[2] == 0:  # 全部卖光，还需要更新状态
-                status = self.db.order_update(data={'remain_lots': i[2], 'order_status': 'done'},
+                status = self.db.order_update(data={'remain_lots': to_decimal(i[2]), 'order_status': 'done'},
                                               condition=f'order_id={i[0]}')
                 if status == -1:
                     print(f"下单买单编号{i[0]}已经全部买入，状态更新失败")
                     exit(-1)
             else:
-                status = self.db.order_update(data={'remain_lots': i[2]}, condition=f'order_id={i[0]}')
+                status = self.db.order_update(data={'remain_lots': to_decimal(i[2])}, condition=f'order_id={i[0]}')
                 if status == -1:
                     print(f"下单买单编号{i[0]}已买入部分，状态更新失败")
                     exit(-1)
         # 更新卖单的剩余量
         for key, i in update_sell.items():
             if i[2] == 0:
-                status = self.db.order_update(data={'remain_lots': i[2], 'order_status': 'done'},
+                status = self.db.order_update(data={'remain_lots': to_decimal(i[2]), 'order_status': 'done'},
                                               condition=f'order_id={i[0]}')
                 if status == -1:
                     print(f"下单买单编号{i[0]}已经全部卖出，状态更新失败")
                     exit(-1)
             else:
-                status = self.db.order_update(data={'remain_lots': i[2]}, condition=f'order_id={i[0]}')
+                status = self.db.order_update(data={'remain_lots': to_decimal(i[2])}, condition=f'order_id={i[0]}')
                 if status == -1:
                     print(f"下单买单编号{i[0]}已卖出部分，状态更新失败")
                     exit(-1)
         # no_available_agent_record_id=list()
         # 将成交单加入成交表中，并且更新缴纳的保证金
         for i in matches:
-            margin_match = (self.margin_rate * i[3] * i[2]).quantize(Decimal('0.0000000'))  # 双方实际缴纳的保证金数值
-            match_info = {'bid_order_id': i[0], 'sell_order_id': i[1], 'deal_lots': i[2], 'deal_price': i[3],
+            deal_lots, deal_price = to_decimal(i[2]), to_decimal(i[3])
+            margin_match = to_decimal(mul(margin_rate, i[3], i[2]))  # 双方实际缴纳的保证金数值
+            match_info = {'bid_order_id': i[0], 'sell_order_id': i[1], 'deal_lots': deal_lots, 'deal_price': deal_price,
                           'bid_status': 'open', 'bid_security_funds': margin_match, 'sell_status': 'open',
                           'sell_security_funds': margin_match, 'deal_round': self.round, 'deal_num': turn,
                           'delivery_round': self.contract_round}
@@ -960,20 +947,22 @@ class Engine:
             if deal_id == -1:
                 print(f"将成交单{match_info}插入成交表中失败")
                 exit(-1)
+            self.positions.add(deal_id, self.round, i[4], i[5], deal_lots, deal_price)
 
             # 保证金缴纳更新，双方需要再缴纳的保证金为(成交价-出价)*保证金率*成交量
-            margin_buy = ((i[3] - i[6]) * self.margin_rate * i[2]).quantize(Decimal('0.0000000'))
-            margin_sell = ((i[3] - i[7]) * self.margin_rate * i[2]).quantize(Decimal('0.0000000'))
+            margin_buy = mul(i[3] - i[6], margin_rate, i[2])
+            margin_sell = mul(i[3] - i[7], margin_rate, i[2])
             status = self._pay_margin(i[4], margin_buy)
             if status == 0:  # 在撮合函数下，不可能出现这种情况，除非撮合函数出错【本质上说，这种情况肯定不会发生，因为买方最多退还保证金/保证金不变
                 print(f"在处理{deal_id}成交单时，买方玩家{i[4]}的账户可用资金居然不足以缴纳保证金，这说明撮合函数错误")
                 error_file.write(
-                    f"<Error>{self.round}轮中，在处理{deal_id}成交单时，买方玩家{i[4]}的账户可用资金居然不足以缴纳保证金，这说明撮合函数错误。撮合结果信息为：update_buy={update_buy},update_sell={update_sell},matches={matches}。无对应处理办法，且未扣除该项保证金，相当于它的账户上额外增加了{margin_buy}元\n")
+                    f"<Error>{self.round}轮中，在处理{deal_id}成交单时，买方玩家{i[4]}的账户可用资金居然不足以缴纳保证金，这说明撮合函数错误。撮合结果信息为：update_buy={update_buy},update_sell={update_sell},matches={matches}。无对应处理办法，且未扣除该项保证金，相当于它的账户上额外增加了{to_decimal(margin_buy)}元\n")
             status = self._pay_margin(i[5], margin_sell)
             if status == 0:
                 print(f"在处理{deal_id}成交单时，卖方玩家{i[5]}的账户可用资金居然不足以缴纳保证金，这说明撮合函数错误")
                 error_file.write(
-                    f"<Error>{self.round}轮中，在处理{deal_id}成交单时，卖方玩家{i[5]}的账户可用资金居然不足以缴纳保证金，这说明撮合函数错误。撮合结果信息为：update_buy={update_buy},update_sell={update_sell},matches={matches}。无对应处理办法，且未扣除该项保证金，相当于它的账户上额外增加了{margin_sell}元\n")
+                    f"<Error>{self.round}轮中，在处理{deal_id}成交单时，卖方玩家{i[5]}的账户可用资金居然不足以缴纳保证金，这说明撮合函数错误。撮合结果信息为：update_buy={update_buy},update_sell={update_sell},matches={matches}。无对应处理办法，且未扣除该项保证金，相当于它的账户上额外增加了{to_decimal(margin_sell)}元\n")
+        self._flush_ledger()  # 本次下单与撮合中所有保证金的变化，一次性写回数据库
         succeeded_requests_sql = f"""
         SELECT `order`.`agent_id`,`order`.`order_id`,`order`.`order_type`,`deal_record`.`deal_lots`,`deal_record`.`deal_price`
         FROM `deal_record` JOIN `order` ON `order`.`order_id`=`deal_record`.`bid_order_id` OR `order`.`order_id`=`deal_record`.`sell_order_id`
@@ -1019,103 +1008,85 @@ class Engine:
 
         return succeeded_requests, failed_requests, deals
 
+    @in_transaction
     def withdraw_requests(self, withdraw_requests: list):
         """
         处理撤单请求，新增撤单记录，刷新账户可用资金
+        一次查询取出所有要撤销的订单，一次UPDATE将其状态改为cancel，同一玩家退还的保证金合并后更新一次账本
+        模拟器在每次出价后将所有玩家的撤单请求合并，只调用一次
         :param withdraw_requests: 撤单请求列表 list[order_id]
         :return: 0
         """
-        # 撤单，需要更新order并退还保证金
-        for i in withdraw_requests:
-            # 先找出对应订单
-            results = self.db.order_select(columns='order_price,remain_lots,order_status,agent_id',
-                                           conditions={'order_id': i})
-            if results == -1:
-                print("获取要撤销的订单信息失败！")
-                exit(-1)
-            order_price = results[0][0]
-            remain_lots = results[0][1]
-            order_status = results[0][2]
-            agent_id = results[0][3]
+        order_ids = list(dict.fromkeys(withdraw_requests))  # 去重，保持顺序
+        if not order_ids:
+            return 0
+        # 先找出对应订单
+        results = self.db.order_select_many(order_ids, columns='order_id,order_price,remain_lots,order_status,agent_id')
+        if results == -1:
+            print("获取要撤销的订单信息失败！")
+            exit(-1)
+        orders = {result[0]: result[1:] for result in results}
+        margin_rate = to_fixed(self.margin_rate)
+        cancelled = []
+        refunds = {}  # 玩家编号 -> 退还的保证金（负数）
+        for i in order_ids:
+            if i not in orders:
+                print(f"订单编号{i}对应订单不存在，无法取消")
+                continue
+            order_price, remain_lots, order_status, agent_id = orders[i]
             if order_status != 'pending':
                 print(f"订单编号{i}对应订单并不是等待撮合状态，而是{order_status}，无法取消")
                 continue
-            # 全部取消，订单状态变成cancel即可
-            status = self.db.order_update(data={'order_status': 'cancel'}, condition=f'order_id={i}')
-            if status == -1:
-                print(f"更新订单{i}失败")
-                exit(-1)
-            margin = (-1 * remain_lots * order_price * self.margin_rate).quantize(Decimal('0.0000000'))  # 退还保证金
-            self._pay_margin(agent_id, margin)  # 更新数据库中的可用资金和保证金
+            cancelled.append(i)
+            margin = mul(-to_fixed(remain_lots), to_fixed(order_price), margin_rate)  # 退还保证金
+            refunds[agent_id] = refunds.get(agent_id, 0) + margin
+        # 全部取消，订单状态变成cancel即可
+        status = self.db.order_update_many(data={'order_status': 'cancel'}, order_ids=cancelled)
+        if status == -1:
+            print(f"更新订单{cancelled}失败")
+            exit(-1)
+        for i in cancelled:
+            self.order_book.cancel(i)  # 从订单簿中撤下
+        for agent_id, margin in refunds.items():
+            self._pay_margin(agent_id, margin)  # 更新账本中的可用资金和保证金
+        self._flush_ledger()
         return 0
 
-    def _close_position_for_buy(self, deal_id: int, abs_profit: Decimal, buy_account_id: int):
+    def _close_position_for_buy(self, deal_id: int, abs_profit: Decimal, buy_player_id: int, sell_player_id: int,
+                                bid_security_funds: Decimal, sell_security_funds: Decimal):
         '''
         强制平仓（针对买方），只针对某一个玩家的某一笔订单，买方平仓，那卖方自然也会平仓（赚钱)
+        双方的账户信息在账本中更新，由调用方批量写回
         :param deal_id:成交订单编号
         :param abs_profit:盈亏的绝对值
-        :param buy_account_id：买方的账户信息编号
+        :param buy_player_id/sell_player_id：买方/卖方玩家编号
+        :param bid_security_funds/sell_security_funds：买方/卖方为本笔成交单缴纳的保证金
         ------
-        return：买方强制平仓后的可用资金和保证金（方便在平仓此笔订单后，处理后续订单）
+        return：买方强制平仓后的可用资金和保证金（定点整数，方便在平仓此笔订单后，处理后续订单）
         '''
-        # input(f"对订单{deal_id}进行强制平仓（由于买方），盈亏为{abs_profit}")
-        result = self.db.deal_record_select(columns='sell_order_id,bid_security_funds,sell_security_funds',
-                                            conditions={'deal_id': deal_id})
-        if result == -1:
-            print(f"获取成交订单{deal_id}信息失败")
-            exit(-1)
-        sell_order_id = result[0][0]
-        bid_security_funds = result[0][1]
-        sell_security_funds = result[0][2]
-        # available_funds_status=-1 #说明可用资金不为负数
-
+        # 账本中为定点整数，盈亏按写入数据库时的精度舍入
+        abs_profit = to_fixed(abs_profit)
+        bid_security_funds, sell_security_funds = to_fixed(bid_security_funds), to_fixed(sell_security_funds)
         # 对于买方，强制平仓，退还保证金为可用资金，可用资金减去亏损资金
-        result = self.db.agent_record_select(columns='current_funds,available_funds,security_funds',
-                                             conditions={'agent_record_id': buy_account_id})
-        if result == -1:
-            print(f"获取买方玩家的账户信息（编号{buy_account_id})失败")
-            exit(-1)
-        buy_current_funds = result[0][0]
-        buy_available_funds = result[0][1]
-        buy_security_funds = result[0][2]
-        buy_security_funds -= bid_security_funds  # 本笔订单的保证金归0
-        buy_available_funds = buy_available_funds + bid_security_funds - abs_profit  # 退还本笔保证金为可用资金，但同时需要承担亏损（亏损金额绝对值为abs_profit）
-        # if buy_available_funds<0: #无法覆盖这个亏损，可用资金状态不对
-        #     available_funds_status=1
-        buy_current_funds -= abs_profit  # 亏损也会体现在总资金上
-        status = self.db.agent_record_update(
-            data={'current_funds': buy_current_funds, 'available_funds': buy_available_funds,
-                  'security_funds': buy_security_funds}, condition=f'agent_record_id={buy_account_id}')  # 更新账户信息
-        if status == -1:
-            print(f"更新买方玩家的账户信息（编号{buy_account_id})失败")
+        account = self.ledger.get(buy_player_id)
+        if account is None:
+            print(f"获取买方玩家{buy_player_id}的账户信息失败")
             exit(-1)
+        buy_security_funds = account['security_funds'] - bid_security_funds  # 本笔订单的保证金归0
+        buy_available_funds = account['available_funds'] + bid_security_funds - abs_profit  # 退还本笔保证金为可用资金，但同时需要承担亏损（亏损金额绝对值为abs_profit）
+        buy_current_funds = account['current_funds'] - abs_profit  # 亏损也会体现在总资金上
+        self.ledger.update(buy_player_id, current_funds=buy_current_funds, available_funds=buy_available_funds,
+                           security_funds=buy_security_funds)
 
         # 对于卖方，因买方平仓，该笔订单结束，退还保证金为可用资金，同时获得盈利
-        # 根据卖方订单编号获取卖方编号
-        result = self.db.order_select(columns='agent_id', conditions={'order_id': sell_order_id})
-        if result == -1:
-            print(f"根据下单编号{sell_order_id}获取卖方编号agent_id失败")
-            exit(-1)
-        sell_player_id = result[0][0]
-        # 获取卖方账户信息
-        result = self.db.agent_record_select(columns='agent_record_id,current_funds,available_funds,security_funds',
-                                             conditions={'agent_id': sell_player_id, 'round': self.round})
-        if result == -1:
-            print(f"根据卖方编号{sell_player_id}获取卖方在{self.round}轮的账户信息失败")
-            exit(-1)
-        short_account_id = result[0][0]
-        short_current_funds = result[0][1]
-        short_available_funds = result[0][2]
-        short_security_funds = result[0][3]
-        short_security_funds -= sell_security_funds  # 本笔订单保证金归还
-        short_available_funds = short_available_funds + sell_security_funds + abs_profit  # 归还保证金，获取利润
-        short_current_funds += abs_profit  # 盈利也体现在总资产上
-        status = self.db.agent_record_update(
-            data={'current_funds': short_current_funds, 'available_funds': short_available_funds,
-                  'security_funds': short_security_funds}, condition=f'agent_record_id={short_account_id}')  # 更新账户信息
-        if status == -1:
-            print(f"更新卖方玩家的账户信息（编号{short_account_id})失败")
+        account = self.ledger.get(sell_player_id)
+        if account is None:
+            print(f"获取卖方玩家{sell_player_id}在{self.round}轮的账户信息失败")
             exit(-1)
+        self.ledger.update(sell_player_id,
+                           current_funds=account['current_funds'] + abs_profit,  # 盈利也体现在总资产上
+                           available_funds=account['available_funds'] + sell_security_funds + abs_profit,  # 归还保证金，获取利润
+                           security_funds=account['security_funds'] - sell_security_funds)  # 本笔订单保证金归还
 
         # 更新成交单的买卖双方状态和结算轮次
         status = self.db.deal_record_update(
@@ -1124,78 +1095,45 @@ class Engine:
         if status == -1:
             print(f"更新成交单{deal_id}的买卖双方状态和结算轮次失败")
             exit(-1)
+        self.positions.close(deal_id)
 
-        # input(f"对订单{deal_id}进行强制平仓（由于买方），盈亏为{abs_profit},平仓结束")
         return buy_available_funds, buy_security_funds
-        # return buy_available_funds,buy_security_funds,available_funds_status
 
-    def _close_position_for_sell(self, deal_id: int, abs_profit: Decimal, sell_account_id: int):
+    def _close_position_for_sell(self, deal_id: int, abs_profit: Decimal, sell_player_id: int, buy_player_id: int,
+                                 sell_security_funds: Decimal, bid_security_funds: Decimal):
         '''
         强制平仓（针对卖方），只针对某一个玩家的某一笔订单，卖方平仓，那买方自然也会平仓（赚钱)
+        双方的账户信息在账本中更新，由调用方批量写回
         :param deal_id:成交订单编号
         :param abs_profit:盈亏的绝对值
-        :param sell_account_id：买方的账户信息编号
+        :param sell_player_id/buy_player_id：卖方/买方玩家编号
+        :param sell_security_funds/bid_security_funds：卖方/买方为本笔成交单缴纳的保证金
         ------
-        return：卖方强制平仓后的可用资金和保证金（方便在平仓此笔订单后，处理后续订单）
+        return：卖方强制平仓后的可用资金和保证金（定点整数，方便在平仓此笔订单后，处理后续订单）
         '''
-        # input(f"对订单{deal_id}进行强制平仓（由于卖方），盈亏为{abs_profit}")
-        result = self.db.deal_record_select(columns='bid_order_id,bid_security_funds,sell_security_funds',
-                                            conditions={'deal_id': deal_id})
-        if result == -1:
-            print(f"获取成交订单{deal_id}信息失败")
-            exit(-1)
-        bid_order_id = result[0][0]
-        bid_security_funds = result[0][1]
-        sell_security_funds = result[0][2]
-        # available_funds_status=-1 #可用资金状态，-1说明不为负
-
+        # 账本中为定点整数，盈亏按写入数据库时的精度舍入
+        abs_profit = to_fixed(abs_profit)
+        sell_security_funds, bid_security_funds = to_fixed(sell_security_funds), to_fixed(bid_security_funds)
         # 对于卖方，强制平仓，退还保证金为可用资金，可用资金减去亏损资金
-        result = self.db.agent_record_select(columns='current_funds,available_funds,security_funds',
-                                             conditions={'agent_record_id': sell_account_id})
-        if result == -1:
-            print(f"获取买方玩家的账户信息（编号{sell_account_id})失败")
-            exit(-1)
-        short_current_funds = result[0][0]
-        short_available_funds = result[0][1]
-        short_security_funds = result[0][2]
-        short_security_funds -= sell_security_funds  # 本笔订单的保证金归0
-        short_available_funds = short_available_funds + sell_security_funds - abs_profit  # 退还本笔保证金为可用资金，但同时需要承担亏损（亏损金额绝对值为abs_profit）
-        # if short_available_funds<0: #无法覆盖这个亏损，可用资金状态不对
-        #     available_funds_status=-1
-        short_current_funds -= abs_profit  # 亏损也会体现在总资金上
-        status = self.db.agent_record_update(
-            data={'current_funds': short_current_funds, 'available_funds': short_available_funds,
-                  'security_funds': short_security_funds}, condition=f'agent_record_id={sell_account_id}')  # 更新账户信息
-        if status == -1:
-            print(f"更新卖方玩家的账户信息（编号{sell_account_id})失败")
+        account = self.ledger.get(sell_player_id)
+        if account is None:
+            print(f"获取卖方玩家{sell_player_id}的账户信息失败")
             exit(-1)
+        short_security_funds = account['security_funds'] - sell_security_funds  # 本笔订单的保证金归0
+        short_available_funds = account['available_funds'] + sell_security_funds - abs_profit  # 退还本笔保证金为可用资金，但同时需要承担亏损（亏损金额绝对值为abs_profit）
+        short_current_funds = account['current_funds'] - abs_profit  # 亏损也会体现在总资金上
+        self.ledger.update(sell_player_id, current_funds=short_current_funds, available_funds=short_available_funds,
+                           security_funds=short_security_funds)
 
         # 对于买方，因卖方平仓，该笔订单结束，退还保证金为可用资金，同时获得盈利
-        # 根据买方订单编号获取买方编号
-        result = self.db.order_select(columns='agent_id', conditions={'order_id': bid_order_id})
-        if result == -1:
-            print(f"根据下单编号{bid_order_id}获取买方编号agent_id失败")
-            exit(-1)
-        buy_player_id = result[0][0]
-        # 获取买方账户信息
-        result = self.db.agent_record_select(columns='agent_record_id,current_funds,available_funds,security_funds',
-                                             conditions={'agent_id': buy_player_id, 'round': self.round})
-        if result == -1:
-            print(f"根据买方编号{buy_player_id}获取买方在{self.round}轮的账户信息失败")
-            exit(-1)
-        buy_account_id = result[0][0]
-        buy_current_funds = result[0][1]
-        buy_available_funds = result[0][2]
-        buy_security_funds = result[0][3]
-        buy_security_funds -= bid_security_funds  # 本笔订单保证金归还
-        buy_available_funds = buy_available_funds + bid_security_funds + abs_profit  # 归还保证金，获取利润
-        buy_current_funds += abs_profit  # 盈利也体现在总资产上
-        status = self.db.agent_record_update(
-            data={'current_funds': buy_current_funds, 'available_funds': buy_available_funds,
-                  'security_funds': buy_security_funds}, condition=f'agent_record_id={buy_account_id}')  # 更新账户信息
-        if status == -1:
-            print(f"更新买方玩家的账户信息（编号{buy_account_id})失败")
+        account = self.ledger.get(buy_player_id)
+        if account is None:
+            print(f"获取买方玩家{buy_player_id}在{self.round}轮的账户信息失败")
             exit(-1)
+        self.ledger.update(buy_player_id,
+                           current_funds=account['current_funds'] + abs_profit,  # 盈利也体现在总资产上
+                           available_funds=account['available_funds'] + bid_security_funds + abs_profit,  # 归还保证金，获取利润
+                           security_funds=account['security_funds'] - bid_security_funds)  # 本笔订单保证金归还
 
         # 更新成交单的买卖双方状态和结算轮次
         status = self.db.deal_record_update(
@@ -1204,10 +1142,9 @@ class Engine:
         if status == -1:
             print(f"更新成交单{deal_id}的买卖双方状态和结算轮次失败")
             exit(-1)
+        self.positions.close(deal_id)
 
-        # input(f"对订单{deal_id}进行强制平仓（由于卖方），盈亏为{abs_profit},平仓结束")
         return short_available_funds, short_security_funds
-        # return short_available_funds,short_security_funds,available_funds_status
 
     def _cal_avg_price(self):
         '''
@@ -1246,6 +1183,7 @@ class Engine:
         print(f"本回合的平均成交价={avg_price},status={status}")
         return avg_price
 
+    @in_transaction
     def settlement_of_round(self):
         """
         账户重新结算，计算最新价格，刷新账户资产，计算平仓问题
@@ -1254,9 +1192,9 @@ class Engine:
         avg_price = self._cal_avg_price()  # 计算平均成交价格
 
         # 对于目前order中未成交的订单，都应该关闭并返回保证金
-        close_order = self.db.order_select(columns='order_id,agent_id,order_price,remain_lots',
+        close_order = self.db.order_select(columns='order_id,agent_id,order_price,remain_lots,order_type,order_lots',
                                            conditions={'order_status': 'pending',
-                                                       'order_round': self.round})  # [(订单编号，智能体编号，订单价格，剩余未成交量)]
+                                                       'order_round': self.round})  # [(订单编号，智能体编号，订单价格，剩余未成交量，订单类型，下单量)]
         if close_order == -1:
             print(f"获取{self.round}轮中未成交的订单信息失败")
             exit(-1)
@@ -1266,139 +1204,95 @@ class Engine:
             if status == -1:
                 print(f"更新{self.round}轮中未成交的订单{i[0]}的状态失败")
                 exit(-1)
+            self._count_order(i[4], i[5], i[2], sign=-1)  # 关闭的订单不再计入下单情况
             # 退还保证金，更新账户余额
-            margin = (-i[2] * i[3] * self.margin_rate).quantize(Decimal('0.0000000'))
+            margin = mul(-to_fixed(i[2]), to_fixed(i[3]), to_fixed(self.margin_rate))
             self._pay_margin(i[1], margin)
+        self.order_book.clear()  # 未成交的订单都已关闭，清空订单簿
         # print("订单关闭，退还保证金成功")
 
         # 计算账户的变动信息，根据平均成交价格计算盈亏金额、是否需要新增保证金、当前资金和可用资金等的变化
         # 盈亏金额：对于买单，等于现价-合约价；对于卖单，等于合约价-现价。现价在这里是当日平均期货成交价
-        # 如果保证金不足以覆盖亏损的钱，那么需要补充保证金至亏损资金
-        # 获取所有玩家的编号
-        all_player = self.db.agent_select(columns='agent_id')
-        profits_info = {}  # agent_record_id:profit_loss
-        # 根据玩家编号获取他们的账户信息、买单和卖单
-        for i in all_player:
-            player_id = i[0]
-            if player_id == self.super_user_id:  # 不需要处理超级用户
+        # 如果保证金不足以覆盖亏损的钱，那么需要补充保证金至亏损资金；可用资金不足以补充时，强制平仓
+        # 1. 一次查询找出所有保证金不足以覆盖亏损的持仓（超级用户不参与结算）
+        # [(成交单编号，持仓方编号，对手方编号，成交量，成交价，持仓方保证金，对手方保证金)]
+        buy_orders_sql = f"""
+        SELECT `deal_record`.`deal_id`,`bid`.`agent_id`,`sell`.`agent_id`,`deal_lots`,`deal_price`,`bid_security_funds`,`sell_security_funds`
+        FROM `deal_record` JOIN `order` AS `bid` ON `bid`.`order_id`=`deal_record`.`bid_order_id`
+        JOIN `order` AS `sell` ON `sell`.`order_id`=`deal_record`.`sell_order_id`
+        WHERE `deal_record`.`bid_status`='open' AND `bid`.`agent_id`<>{self.super_user_id}
+        AND (`deal_price`-{avg_price})*`deal_lots`>`bid_security_funds`
+        """
+        buy_orders = self.db.execute_sql(buy_orders_sql)
+        if buy_orders is None:
+            print(f"计算账户变动信息时，获取{self.round}轮中需要补充保证金的买单信息失败")
+            exit(-1)
+        sell_orders_sql = f"""
+        SELECT `deal_record`.`deal_id`,`sell`.`agent_id`,`bid`.`agent_id`,`deal_lots`,`deal_price`,`sell_security_funds`,`bid_security_funds`
+        FROM `deal_record` JOIN `order` AS `bid` ON `bid`.`order_id`=`deal_record`.`bid_order_id`
+        JOIN `order` AS `sell` ON `sell`.`order_id`=`deal_record`.`sell_order_id`
+        WHERE `deal_record`.`sell_status`='open' AND `sell`.`agent_id`<>{self.super_user_id}
+        AND ({avg_price}-`deal_price`)*`deal_lots`>`sell_security_funds`
+        """
+        sell_orders = self.db.execute_sql(sell_orders_sql)
+        if sell_orders is None:
+            print(f"计算账户变动信息时，获取{self.round}轮中需要补充保证金的卖单信息失败")
+            exit(-1)
+
+        # 2. 按玩家编号依次处理（同一玩家先处理买单，再处理卖单），补缴保证金只修改账本，强制平仓逐笔处理
+        legs = [('buy', leg) for leg in buy_orders] + [('sell', leg) for leg in sell_orders]
+        legs.sort(key=lambda x: (x[1][1], 0 if x[0] == 'buy' else 1, x[1][0]))
+        bid_margin_updates = []  # [(买方保证金，成交单编号)]
+        sell_margin_updates = []  # [(卖方保证金，成交单编号)]
+        for order_type, leg in legs:
+            deal_id, player_id, counterparty_id, deal_lots, deal_price, security, counterparty_security = leg
+            if order_type == 'buy':
+                profit = (avg_price - deal_price) * deal_lots
+            else:
+                profit = (deal_price - avg_price) * deal_lots
+            if profit >= 0 or security >= -profit:  # 保证金足以覆盖亏损
                 continue
-            # 获取账户信息
-            account = self.db.agent_record_select(columns='agent_record_id,available_funds,security_funds',
-                                                  conditions={'agent_id': player_id, 'round': self.round})
-            if account == -1:
+            margin = to_fixed((-profit) - security, rounding=ROUND_HALF_EVEN)  # 补充缴纳的金额（定点整数）
+            account = self.ledger.get(player_id)
+            if account is None:
                 print(f"计算账户变动信息时，获取{player_id}的账户信息失败")
                 exit(-1)
-            flag = False  # 如果flag为True，说明该玩家的账户可用资金可能为负
-            agent_record_id = account[0][0]
-            available_funds = account[0][1]
-            security_funds = account[0][2]
+            if account['available_funds'] < margin:  # 无充足可用资金，强制平仓
+                if order_type == 'buy':
+                    self._close_position_for_buy(deal_id=deal_id, abs_profit=-profit, buy_player_id=player_id,
+                                                 sell_player_id=counterparty_id, bid_security_funds=security,
+                                                 sell_security_funds=counterparty_security)
+                else:
+                    self._close_position_for_sell(deal_id=deal_id, abs_profit=-profit, sell_player_id=player_id,
+                                                  buy_player_id=counterparty_id, sell_security_funds=security,
+                                                  bid_security_funds=counterparty_security)
+            else:  # 补充缴纳保证金
+                self.ledger.update(player_id, available_funds=account['available_funds'] - margin,
+                                   security_funds=account['security_funds'] + margin)
+                if order_type == 'buy':
+                    bid_margin_updates.append((-profit, deal_id))
+                else:
+                    sell_margin_updates.append((-profit, deal_id))
 
-            # 获取买单
-            buy_orders_sql = f"""
-            SELECT `deal_lots`,`deal_price`,`bid_security_funds`,`deal_id`
-            FROM `deal_record` JOIN `order` ON `order`.`order_id`=`deal_record`.`bid_order_id`
-            WHERE `order`.`agent_id`={player_id} AND `deal_record`.`bid_status`='open'
-            """
-            buy_orders = self.db.execute_sql(buy_orders_sql)  # 买单,[(成交量，成交价，买方缴纳保证金，成交单编号)]
-            if buy_orders is None:
-                print(f"计算账户变动信息时，获取{player_id}的买单信息失败")
-                exit(-1)
-            total_profit = Decimal(0)  # 总盈亏
-            for buy_order in buy_orders:  # 处理每一个买单
-                profit = (avg_price - buy_order[1]) * buy_order[0]
-                if profit < 0:  # 说明亏损，我们需要要求保证金大于|亏损|
-                    if buy_order[2] < -profit:  # 说明不足以覆盖亏损，应该补充缴纳保证金至-profit
-                        margin = ((-profit) - buy_order[2]).quantize(Decimal('0.0000000'))  # 补充缴纳的金额
-                        if available_funds < margin:  # 无充足可用资金，强制平仓
-                            available_funds, security_funds = self._close_position_for_buy(deal_id=buy_order[3],
-                                                                                           abs_profit=-profit,
-                                                                                           buy_account_id=agent_record_id)
-                            # if available_funds_status==1:
-                            #     flag=True
-                        else:  # 补充缴纳保证金
-                            available_funds -= margin
-                            security_funds += margin
-                            status = self.db.agent_record_update(
-                                data={'available_funds': available_funds, 'security_funds': security_funds},
-                                condition=f'agent_record_id={agent_record_id}')  # 更新账户信息
-                            if status == -1:
-                                print(f"玩家{player_id}的账户信息（编号{agent_record_id}）更新失败")
-                                exit(-1)
-                            status = self.db.deal_record_update(data={'bid_security_funds': (-profit)},
-                                                                condition=f'deal_id={buy_order[3]}')
-                            if status == -1:
-                                print(f"玩家{player_id}的成交单信息（编号{buy_order[3]}，买方）更新失败")
-                                exit(-1)
-                            total_profit += profit  # 计入总盈亏
-                    else:  # 足以覆盖亏损，计入总盈亏
-                        total_profit += profit
-                else:  # 赚钱，计入总盈亏即可
-                    total_profit += profit
-            # 获取卖单
-            sell_orders_sql = f"""
-            SELECT `deal_lots`,`deal_price`,`sell_security_funds`,`deal_id`
-            FROM `deal_record` JOIN `order` ON `order`.`order_id`=`deal_record`.`sell_order_id`
-            WHERE `order`.`agent_id`={player_id} AND `deal_record`.`sell_status`='open'
-            """
-            sell_orders = self.db.execute_sql(sell_orders_sql)  # 卖单[(成交量，成交价，缴纳保证金，成交单编号)]
-            if sell_orders is None:
-                print(f"计算账户变动信息时，获取{player_id}的卖单信息失败")
-                exit(-1)
-            for sell_order in sell_orders:  # 处理每一个卖单
-                profit = (sell_order[1] - avg_price) * sell_order[0]
-                if profit < 0:  # 说明亏损，我们需要要求保证金大于|亏损|
-                    if sell_order[2] < -profit:  # 说明不足以覆盖亏损，应该补充缴纳保证金至-profit
-                        margin = ((-profit) - sell_order[2]).quantize(Decimal('0.0000000'))  # 补充缴纳的金额
-                        if available_funds < margin:  # 无充足可用资金，强制平仓
-                            available_funds, security_funds = self._close_position_for_sell(deal_id=sell_order[3],
-                                                                                            abs_profit=-profit,
-                                                                                            sell_account_id=agent_record_id)
-                            # if available_funds_status==1:
-                            #     flag=True
-                        else:  # 补充缴纳保证金
-                            available_funds -= margin
-                            security_funds += margin
-                            status = self.db.agent_record_update(
-                                data={'available_funds': available_funds, 'security_funds': security_funds},
-                                condition=f'agent_record_id={agent_record_id}')  # 更新账户信息
-                            if status == -1:
-                                print(f"玩家{player_id}的账户信息（编号{agent_record_id}）更新失败")
-                                exit(-1)
-                            status = self.db.deal_record_update(data={'sell_security_funds': (-profit)},
-                                                                condition=f'deal_id={sell_order[3]}')
-                            if status == -1:
-                                print(f"玩家{player_id}的成交单信息（编号{sell_order[3]}，卖方）更新失败")
-                                exit(-1)
-                            total_profit += profit  # 计入总盈亏
-                    else:  # 可以覆盖亏损，计入总盈亏
-                        total_profit += profit
-                else:  # 赚钱，计入总盈亏即可
-                    total_profit += profit
-
-            profits_info[agent_record_id] = total_profit  # 记录盈亏信息
-        # print(f"---profits_info={profits_info}")
-        # 最终结算
-        for account_id, profits in profits_info.items():
-            # print(f"account_id={account_id},profits={profits}")
-            results = self.db.agent_record_select(columns='available_funds,security_funds',
-                                                  conditions={'agent_record_id': account_id})
-            if results == -1:
-                print(f"获取账户记录{agent_record_id}失败")
+        # 3. 批量写回补缴的保证金和账户信息
+        if bid_margin_updates:
+            status = self.db.deal_record_update_many(columns=('bid_security_funds',), datas=bid_margin_updates)
+            if status == -1:
+                print(f"{self.round}轮中补缴保证金的成交单信息（买方）更新失败")
                 exit(-1)
-            available_funds = results[0][0]
-            if available_funds < 0:  # 在所有平仓结束后，可用资金为负，设置为0
-                available_funds = Decimal(0)
-            security_funds = results[0][1]
-            current_funds = available_funds + security_funds + profits  # 目前的总资产
-            # print(f"available_funds={available_funds},security_funds={security_funds},current_funds={current_funds}")
-            status = self.db.agent_record_update(
-                data={'current_funds': current_funds, 'available_funds': available_funds,
-                      'security_funds': security_funds, 'profit_loss': profits},
-                condition=f'agent_record_id={account_id}')
+        if sell_margin_updates:
+            status = self.db.deal_record_update_many(columns=('sell_security_funds',), datas=sell_margin_updates)
             if status == -1:
-                print(f"更新{player_id}的账户变动信息失败")
+                print(f"{self.round}轮中补缴保证金的成交单信息（卖方）更新失败")
                 exit(-1)
-            # print(f"status={status}")
-        # print("账户变动信息更新成功！")
+        self._flush_ledger()
+
+        # 4. 最终结算：所有仍然持有的合约按平均成交价计算盈亏，一条语句更新所有玩家的账户
+        # 被强制平仓的合约盈亏已经计入可用资金，不再重复计入；在所有平仓结束后，可用资金为负，设置为0
+        status = self.db.agent_record_settle(avg_price, self.round, self.super_user_id)
+        if status == -1:
+            print(f"更新{self.round}轮的账户变动信息失败")
+            exit(-1)
+        self._load_ledger()  # 结算直接修改了账户信息，重新加载账本
 
         return float(avg_price)
@@ -0,0 +1,80 @@
+"""账户账本，在内存中维护当前回合所有玩家的资金信息，保证金的扣除与退还先在内存中完成，再批量写回数据库"""
+try:
+    from money import to_fixed, to_decimal
+except:
+    from .money import to_fixed, to_decimal
+
+
+class AccountLedger:
+    """
+    账户账本
+    accounts[agent_id] = {'agent_record_id', 'current_funds', 'available_funds', 'security_funds', 'profit_loss'}
+    只保存当前回合（round）的账户记录；被修改过的账户记为“脏”账户，flush时统一写回`agent_record`
+    资金均为定点整数（单位 1e-7，见 money.py），load/flush 时与数据库中的 Decimal 相互转换
+    注意：直接通过SQL修改`agent_record`之前需要先flush，修改之后需要重新load，否则账本与数据库不一致
+    """
+    FIELDS = ('current_funds', 'available_funds', 'security_funds', 'profit_loss')
+
+    def __init__(self):
+        self.db = None
+        self.round = None
+        self.accounts = {}
+        self.dirty = set()  # 需要写回数据库的玩家编号
+
+    def load(self, db, round):
+        """
+        从数据库中读取第round回合所有玩家的账户信息（一次查询）
+        :return: 0 - 成功；-1 - 失败
+        """
+        results = db.agent_record_select(
+            columns='agent_id,agent_record_id,current_funds,available_funds,security_funds,profit_loss',
+            conditions={'round': round})
+        if results == -1:
+            return -1
+        self.db = db
+        self.round = round
+        self.accounts = {}
+        self.dirty = set()
+        for result in results:
+            self.accounts[result[0]] = {
+                'agent_record_id': result[1],
+                'current_funds': to_fixed(result[2]),
+                'available_funds': to_fixed(result[3]),
+                'security_funds': to_fixed(result[4]),
+                'profit_loss': to_fixed(result[5])
+            }
+        return 0
+
+    def get(self, agent_id):
+        """获取玩家的账户信息（字典，只读），不存在时返回None"""
+        return self.accounts.get(agent_id)
+
+    def update(self, agent_id, **fields):
+        """修改玩家的账户信息（定点整数），并标记为需要写回"""
+        account = self.accounts[agent_id]
+        for key, value in fields.items():
+            if key not in self.FIELDS:
+                raise KeyError(f"账户信息中不存在字段{key}")
+            account[key] = value
+        self.dirty.add(agent_id)
+
+    def available_funds(self):
+        """所有玩家当前可用资金的副本，available_funds[agent_id]=可用资金"""
+        return {agent_id: account['available_funds'] for agent_id, account in self.accounts.items()}
+
+    def flush(self):
+        """
+        将所有被修改过的账户在一个事务中批量写回数据库
+        :return: 0 - 成功；-1 - 失败
+        """
+        if not self.dirty:
+            return 0
+        datas = []
+        for agent_id in sorted(self.dirty):
+            account = self.accounts[agent_id]
+            datas.append(tuple(to_decimal(account[key]) for key in self.FIELDS) + (account['agent_record_id'],))
+        status = self.db.agent_record_update_many(columns=self.FIELDS, datas=datas)
+        if status == -1:
+            return -1
+        self.dirty = set()
+        return 0
@@ -0,0 +1,54 @@
+"""
+定点数金额表示：价格、数量与资金在撮合与账本中以整数保存，单位为 1e-7（与数据库 Decimal(30,7) 的精度相同）
+只在与数据库交互时转换为 Decimal，撮合与保证金计算中的整数运算比 Decimal 快数倍
+"""
+from decimal import Decimal, ROUND_HALF_UP
+
+PLACES = 7
+SCALE = 10 ** PLACES
+_QUANTUM = Decimal(1).scaleb(-PLACES)
+
+
+def to_fixed(value, rounding=ROUND_HALF_UP):
+    """
+    Decimal / int / str 转换为定点整数，超过7位的小数按 rounding 舍入（默认与数据库写入时相同，四舍五入）
+    float 先转换为 str，与 Decimal(str(x)) 一致
+    """
+    if type(value) is int:
+        return value * SCALE
+    if type(value) is float:
+        value = str(value)
+    return int(Decimal(value).quantize(_QUANTUM, rounding=rounding).scaleb(PLACES))
+
+
+def to_decimal(fixed):
+    """定点整数转换为7位小数的 Decimal（精确）"""
+    return Decimal(fixed).scaleb(-PLACES)
+
+
+def to_float(fixed):
+    """定点整数转换为 float，与 float(to_decimal(fixed)) 相同"""
+    return fixed / SCALE
+
+
+def _div_round(numerator, denominator):
+    """整数除法，结果按银行家舍入（ROUND_HALF_EVEN，与 Decimal.quantize 的默认舍入相同），denominator > 0"""
+    quotient, remainder = divmod(numerator, denominator)
+    twice = 2 * remainder
+    if twice > denominator or (twice == denominator and quotient % 2 == 1):
+        quotient += 1
+    return quotient
+
+
+def mul(*fixed):
+    """
+    多个定点数的乘积，结果舍入到7位小数
+    与 Decimal 的 (a * b * c).quantize(Decimal('0.0000000')) 结果相同（乘积精确计算，只舍入一次）
+    """
+    product = 1
+    for value in fixed:
+        product *= value
+    if len(fixed) <= 1:
+        return product
+    return _div_round(product, SCALE ** (len(fixed) - 1))
+
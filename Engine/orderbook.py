@@ -0,0 +1,185 @@
+"""限价订单簿，按价格档位组织挂单，同一价位内按时间先后排队，在一个回合的多次出价之间保持"""
+import heapq
+from collections import deque
+
+
+class OrderBook:
+    """
+    限价订单簿
+    买卖双方各自维护：价格 -> FIFO 队列 的映射，以及一个价格堆（买方存负价格，使堆顶为最优价格）
+    订单以 list 形式保存：[订单编号，玩家编号，剩余未成交量，价格，优先级]，与 _match_orders_modify 原有的元组顺序一致
+    撤单采用惰性删除：只在索引中去掉订单，队列中的条目在遍历到时才清理
+    """
+
+    def __init__(self):
+        self.levels = {'buy': {}, 'sell': {}}  # 价格档位，levels[side][price]=deque([订单,...])
+        self.heaps = {'buy': [], 'sell': []}  # 价格堆
+        self.in_heap = {'buy': set(), 'sell': set()}  # 当前位于价格堆中的价格，避免重复入堆
+        self.orders = {}  # 仍在订单簿中的订单，orders[order_id]=订单
+
+    def __len__(self):
+        return len(self.orders)
+
+    def __contains__(self, order_id):
+        return order_id in self.orders
+
+    def clear(self):
+        """清空订单簿（回合结算后，所有未成交的订单都已关闭）"""
+        self.__init__()
+
+    def add(self, order_id, agent_id, side, lots, price, order_num):
+        """
+        挂单
+        :param side: 'buy' / 'sell'
+        :param lots: 剩余未成交量
+        :param price: 价格
+        :param order_num: 优先级（回合内的出价轮次），同价位下先到先得
+        """
+        order = [order_id, agent_id, lots, price, order_num]
+        level = self.levels[side].get(price)
+        if level is None:
+            level = deque()
+            self.levels[side][price] = level
+            if price not in self.in_heap[side]:
+                heapq.heappush(self.heaps[side], -price if side == 'buy' else price)
+                self.in_heap[side].add(price)
+        level.append(order)
+        self.orders[order_id] = order
+        return order
+
+    def cancel(self, order_id):
+        """
+        撤单，返回被撤销的订单；订单不在订单簿中时返回None
+        """
+        order = self.orders.pop(order_id, None)
+        if order is not None:
+            order[2] = 0  # 标记为失效，由遍历时清理
+        return order
+
+    def _alive(self, order):
+        return order[2] > 0 and self.orders.get(order[0]) is order
+
+    def _fill(self, order, volume):
+        """成交 volume，全部成交后从订单簿中移除"""
+        order[2] -= volume
+        if order[2] <= 0:
+            self.orders.pop(order[0], None)
+
+    def _compact(self, side, price):
+        """清理队首失效的订单，档位为空时删除档位"""
+        level = self.levels[side].get(price)
+        if level is None:
+            return
+        while level and not self._alive(level[0]):
+            level.popleft()
+        if not level:
+            del self.levels[side][price]
+
+    def best_price(self, side):
+        """
+        当前最优价格（买方最高价/卖方最低价），没有挂单时返回None
+        """
+        heap = self.heaps[side]
+        while heap:
+            price = -heap[0] if side == 'buy' else heap[0]
+            if price in self.levels[side]:
+                self._compact(side, price)
+                if price in self.levels[side]:
+                    return price
+            heapq.heappop(heap)  # 档位已经不存在，丢弃堆中的价格
+            self.in_heap[side].discard(price)
+        return None
+
+    def _pop_level(self, side):
+        """弹出最优价格档位（档位本身仍保留），返回价格"""
+        price = self.best_price(side)
+        if price is not None:
+            heapq.heappop(self.heaps[side])
+        return price
+
+    def _restore_levels(self, side, prices):
+        """将遍历时弹出的价格放回堆中，已经清空的档位直接丢弃"""
+        for price in prices:
+            self._compact(side, price)
+            if price in self.levels[side]:
+                heapq.heappush(self.heaps[side], -price if side == 'buy' else price)
+            else:
+                self.in_heap[side].discard(price)
+
+    def match(self, try_match):
+        """
+        撮合交易，价格优先、时间优先
+        按优先级依次处理买单，每个买单从最低卖价开始向上遍历卖单，直至买单全部成交或卖价高于买价
+        同一玩家的买卖单直接跳过，留在原位，不会导致重新扫描
+        因可用资金不足被跳过的一对订单，在之后的成交改变上一笔成交价或可用资金后可能可以成交，
+        因此一遍扫描中既有跳过又有成交时，重新扫描订单簿，直至某一遍扫描没有新的成交
+        :param try_match: 回调函数 try_match(买单, 卖单) -> 成交量，返回0说明可用资金不足，这一对订单不能成交
+        :return: 0
+        """
+        while True:
+            matched, skipped = self._match_pass(try_match)
+            if not (matched and skipped):
+                break
+        return 0
+
+    def _match_pass(self, try_match):
+        """
+        从最优价格开始扫描一遍订单簿
+        :return: (是否有成交, 是否有因可用资金不足被跳过的订单对)
+        """
+        matched = skipped = False
+        best_sell = self.best_price('sell')
+        popped_buy = []
+        try:
+            while best_sell is not None:
+                buy_price = self._pop_level('buy')
+                if buy_price is None:
+                    break
+                popped_buy.append(buy_price)
+                if buy_price < best_sell:
+                    # 优先级最高的买单价格已经低于卖单价格了，无法匹配，直接退出
+                    break
+                for buy_order in list(self.levels['buy'][buy_price]):
+                    if not self._alive(buy_order):
+                        continue
+                    order_matched, order_skipped = self._sweep_sell(buy_order, try_match)
+                    matched, skipped = matched or order_matched, skipped or order_skipped
+                    best_sell = self.best_price('sell')
+                    if best_sell is None or buy_price < best_sell:
+                        break
+        finally:
+            self._restore_levels('buy', popped_buy)
+        return matched, skipped
+
+    def _sweep_sell(self, buy_order, try_match):
+        """
+        为一个买单遍历可成交的卖单
+        :return: (是否有成交, 是否有因可用资金不足被跳过的卖单)
+        """
+        matched = skipped = False
+        popped_sell = []
+        try:
+            while buy_order[2] > 0:
+                sell_price = self._pop_level('sell')
+                if sell_price is None:
+                    break
+                popped_sell.append(sell_price)
+                if buy_order[3] < sell_price:
+                    # 价格不满足，直接结束当前买单
+                    break
+                for sell_order in list(self.levels['sell'][sell_price]):
+                    if buy_order[2] <= 0:
+                        break
+                    if not self._alive(sell_order) or sell_order[1] == buy_order[1]:
+                        # 同一玩家不能成交
+                        continue
+                    volume = try_match(buy_order, sell_order)
+                    if volume > 0:
+                        self._fill(buy_order, volume)
+                        self._fill(sell_order, volume)
+                        matched = True
+                    else:
+                        skipped = True
+        finally:
+            self._restore_levels('sell', popped_sell)
+        return matched, skipped
@@ -0,0 +1,112 @@
+"""持仓簿，在内存中维护所有仍然持有（open）的合约，按玩家汇总多头/空头持仓量，成交、平仓、交割时增量更新"""
+
+
+class PositionBook:
+    """
+    持仓簿
+    deals[deal_id] = {'round': 成交回合, 'buy': 买方编号, 'sell': 卖方编号, 'lots': 成交量, 'price': 成交价,
+                      'open': {'buy', 'sell'}中仍持有的一方}
+    open[side][agent_id] = [持仓量，合约数]，即`deal_record`中 <side>_status='open' 的合约按玩家汇总
+    by_round[side][round][agent_id] = [持仓量，合约数]，按成交回合汇总的仍持有合约（用于上一回合的交易情况）
+    by_price[side][agent_id][price] = [持仓量，合约数]，玩家按成交价汇总的仍持有合约（用于账户信息）
+    注意：直接通过SQL修改`deal_record`的状态之后需要重新load
+    """
+    SIDES = ('buy', 'sell')
+
+    def __init__(self):
+        self.names = {}  # 玩家编号 -> 玩家名称
+        self.deals = {}
+        self.open = {'buy': {}, 'sell': {}}
+        self.by_round = {'buy': {}, 'sell': {}}
+        self.by_price = {'buy': {}, 'sell': {}}
+
+    def clear(self):
+        """清空所有持仓（玩家名称保留）"""
+        names = self.names
+        self.__init__()
+        self.names = names
+
+    def load(self, db):
+        """
+        从数据库中读取玩家名称与所有仍然持有的合约（两次查询）
+        :return: 0 - 成功；-1 - 失败
+        """
+        agents = db.agent_select(columns='agent_id,agent_name')
+        if agents == -1:
+            return -1
+        deals = db.execute_sql("""
+        SELECT `deal_record`.`deal_id`,`deal_record`.`deal_round`,`bid`.`agent_id`,`sell`.`agent_id`,`deal_lots`,`deal_price`,`bid_status`,`sell_status`
+        FROM `deal_record` JOIN `order` AS `bid` ON `bid`.`order_id`=`deal_record`.`bid_order_id`
+        JOIN `order` AS `sell` ON `sell`.`order_id`=`deal_record`.`sell_order_id`
+        WHERE `bid_status`='open' OR `sell_status`='open'
+        """)
+        if deals is None:
+            return -1
+        self.__init__()
+        self.names = {agent[0]: agent[1] for agent in agents}
+        for deal_id, deal_round, buy_agent_id, sell_agent_id, lots, price, bid_status, sell_status in deals:
+            self.add(deal_id, deal_round, buy_agent_id, sell_agent_id, lots, price)
+            if bid_status != 'open':
+                self.close(deal_id, 'buy')
+            if sell_status != 'open':
+                self.close(deal_id, 'sell')
+        return 0
+
+    @staticmethod
+    def _change(totals, agent_id, lots, count):
+        total = totals.setdefault(agent_id, [0, 0])
+        total[0] += lots
+        total[1] += count
+        if total[1] == 0:
+            del totals[agent_id]
+
+    def add(self, deal_id, deal_round, buy_agent_id, sell_agent_id, lots, price):
+        """新增一笔双方都持有的成交单"""
+        self.deals[deal_id] = {'round': deal_round, 'buy': buy_agent_id, 'sell': sell_agent_id, 'lots': lots,
+                               'price': price, 'open': set(self.SIDES)}
+        for side in self.SIDES:
+            agent_id = self.deals[deal_id][side]
+            self._change(self.open[side], agent_id, lots, 1)
+            self._change(self.by_round[side].setdefault(deal_round, {}), agent_id, lots, 1)
+            self._change(self.by_price[side].setdefault(agent_id, {}), price, lots, 1)
+
+    def close(self, deal_id, side=None):
+        """
+        成交单的一方（side='buy'/'sell'）或双方（side=None）不再持有（平仓或交割）
+        """
+        deal = self.deals.get(deal_id)
+        if deal is None:
+            return
+        for s in (self.SIDES if side is None else (side,)):
+            if s not in deal['open']:
+                continue
+            deal['open'].discard(s)
+            self._change(self.open[s], deal[s], -deal['lots'], -1)
+            self._change(self.by_round[s][deal['round']], deal[s], -deal['lots'], -1)
+            self._change(self.by_price[s][deal[s]], deal['price'], -deal['lots'], -1)
+        if not deal['open']:
+            del self.deals[deal_id]
+
+    def holders(self, side, deal_round=None, excluded=()):
+        """
+        持有 side 方向合约的玩家
+        :param deal_round: 只统计这一回合成交的合约，None 表示所有合约
+        :param excluded: 不统计的玩家编号
+        :return: [(玩家名称，持仓量 float),...]，按持仓量从大到小、名称排序
+        """
+        if deal_round is None:
+            totals = self.open[side]
+        else:
+            totals = self.by_round[side].get(deal_round, {})
+        result = [(self.names.get(agent_id), float(total[0])) for agent_id, total in totals.items()
+                  if agent_id not in excluded]
+        result.sort(key=lambda x: ((-1) * x[1], x[0]))
+        return result
+
+    def contracts(self, agent_id, side):
+        """
+        玩家持有的 side 方向合约，合并了价格相同的成交单
+        :return: [(持仓量 float，成交价 float),...]，按成交价排序
+        """
+        totals = self.by_price[side].get(agent_id, {})
+        return [(float(totals[price][0]), float(price)) for price in sorted(totals)]
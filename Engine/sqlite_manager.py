@@ -0,0 +1,186 @@
+"""SQLite 存储后端，数据库为一个文件或内存数据库，不需要单独的数据库服务，便于在一台机器上并行运行多个模拟"""
+import os
+import re
+import sqlite3
+from decimal import Decimal, ROUND_HALF_UP
+
+try:
+    from dbmanager import DatabaseManager, Error, TimedCursor
+except:
+    from .dbmanager import DatabaseManager, Error, TimedCursor
+
+MEMORY = ':memory:'
+
+
+class Real(float):
+    """声明为 float 的列读出的值，与表达式结果（普通 float）区分，不转换为 Decimal"""
+
+
+# Decimal 与 MySQL 的 Decimal(30,7) 一样保留7位小数后写入，数值列（NUMERIC 亲和性）中保存为数值
+sqlite3.register_adapter(Decimal, lambda value: str(value.quantize(Decimal('0.0000000'), rounding=ROUND_HALF_UP)))
+# 声明为 Decimal(...) 的列读出时转换回 Decimal
+sqlite3.register_converter('Decimal', lambda value: Decimal(value.decode()))
+sqlite3.register_converter('float', lambda value: Real(value))
+
+
+def _to_decimal(value):
+    """表达式（SUM、乘法等）的结果没有列类型，SQLite 返回浮点数；MySQL 对 Decimal 列的运算结果为 Decimal"""
+    if type(value) is float:
+        return Decimal(repr(value)).quantize(Decimal('0.0000000'), rounding=ROUND_HALF_UP)
+    return value
+
+
+def translate_schema(table_name, field):
+    """
+    将 config.py 中的 MySQL 建表字段转换为 SQLite 语句
+    enum -> varchar，AUTO_INCREMENT 主键 -> INTEGER 主键（rowid 别名，自增），INDEX 拆分为单独的 CREATE INDEX
+    索引名在 SQLite 中全局唯一，加上表名前缀
+    :return: list[str]，第一条为 CREATE TABLE
+    """
+    columns, indexes = [], []
+    for line in field.strip().splitlines():
+        line = line.strip().rstrip(',')
+        if not line:
+            continue
+        line = line.replace(' USING BTREE', '')
+        index = re.match(r"INDEX `(\w+)`\((.*)\)$", line)
+        if index:
+            indexes.append(
+                f"CREATE INDEX `{table_name}_{index.group(1)}` ON `{table_name}` ({index.group(2)})")
+            continue
+        line = re.sub(r"\benum\([^)]*\)", 'varchar(20)', line)
+        line = re.sub(r"\bint NOT NULL AUTO_INCREMENT", 'INTEGER NOT NULL', line)
+        columns.append(line)
+    return [f"CREATE TABLE `{table_name}` ({', '.join(columns)})"] + indexes
+
+
+class _Cursor:
+    """包装 sqlite3 游标，将 MySQL 风格的 %s 占位符转换为 ?，查询结果中表达式的浮点数转换为 Decimal"""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, sql, params=None):
+        return self._cursor.execute(sql.replace('%s', '?'), params or ())
+
+    def executemany(self, sql, seq_of_params):
+        return self._cursor.executemany(sql.replace('%s', '?'), seq_of_params)
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if row is None:
+            return None
+        return tuple(_to_decimal(value) for value in row)
+
+    def fetchall(self):
+        return [tuple(_to_decimal(value) for value in row) for row in self._cursor.fetchall()]
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class SQLiteDatabaseManager(DatabaseManager):
+    """
+    SQLite 存储后端，接口与 DatabaseManager 相同
+    数值列以 SQLite 数值类型保存（约15位有效数字），查询结果中的数值与 MySQL 一样以 Decimal 返回
+    """
+
+    # SQLite 不支持 UPDATE ... JOIN 与 GREATEST，使用 CTE + 关联子查询，参数顺序与 MySQL 版本相同
+    # 表达式的结果不经过 Decimal 适配器，与 Decimal(30,7) 列一样舍入到7位小数
+    settle_sql = """
+        WITH `profits` AS (
+            SELECT `agent_id`,SUM(`pnl`) AS `pnl` FROM (
+                SELECT `order`.`agent_id`,(%s-`deal_price`)*`deal_lots` AS `pnl`
+                FROM `deal_record` JOIN `order` ON `order`.`order_id`=`deal_record`.`bid_order_id`
+                WHERE `deal_record`.`bid_status`='open'
+                UNION ALL
+                SELECT `order`.`agent_id`,(`deal_price`-%s)*`deal_lots` AS `pnl`
+                FROM `deal_record` JOIN `order` ON `order`.`order_id`=`deal_record`.`sell_order_id`
+                WHERE `deal_record`.`sell_status`='open'
+            ) AS `legs` GROUP BY `agent_id`
+        )
+        UPDATE `agent_record`
+        SET `current_funds`=ROUND(MAX(`available_funds`,0)+`security_funds`+COALESCE((SELECT `pnl` FROM `profits` WHERE `profits`.`agent_id`=`agent_record`.`agent_id`),0),7),
+            `profit_loss`=ROUND(COALESCE((SELECT `pnl` FROM `profits` WHERE `profits`.`agent_id`=`agent_record`.`agent_id`),0),7),
+            `available_funds`=MAX(`available_funds`,0)
+        WHERE `round`=%s AND `agent_id`<>%s
+    """
+
+    def __init__(self, folder=MEMORY):
+        """
+        :param folder: 数据库文件所在目录，数据库 db_name 对应 <folder>/<db_name>.sqlite；':memory:' 表示内存数据库
+        """
+        self._in_transaction = False
+        self.folder = folder
+        self._conn = None
+        self._cursor = None
+
+    def _path(self, db_name):
+        if self.folder == MEMORY:
+            return MEMORY
+        return os.path.join(self.folder, f"{db_name}.sqlite")
+
+    def close_db(self):
+        if self._cursor:
+            self._cursor.close()
+        if self._conn:
+            self._conn.close()
+        self._cursor = None
+        self._conn = None
+
+    def drop_db(self, db_name):
+        path = self._path(db_name)
+        try:
+            if path != MEMORY and os.path.exists(path):
+                os.remove(path)
+            return 0
+        except OSError as e:
+            print(f"删除数据库{db_name}失败，发生错误: {e}!")
+            return -1
+
+    def create_db(self, db_name):
+        if self.folder != MEMORY:
+            os.makedirs(self.folder, exist_ok=True)
+        print(f"数据库 {db_name} 创建成功!")
+
+    def select_db(self, db_name):
+        self.close_db()
+        try:
+            # 模拟器的多个线程可能共用同一个引擎，与 MySQL 后端一样共享一个连接
+            self._conn = sqlite3.connect(self._path(db_name), detect_types=sqlite3.PARSE_DECLTYPES,
+                                         check_same_thread=False)
+            self._cursor = TimedCursor(_Cursor(self._conn.cursor()))
+            print(f"正在操作数据库:{db_name}")
+
+        except Error as e:
+            self.close_db()
+            print(f"选择数据库{db_name}失败，发生错误: {e}!")
+
+    def create_table(self, table_name, field):
+        try:
+            for sql in translate_schema(table_name, field):
+                self._cursor.execute(sql)
+            self._conn.commit()
+            print(f"表 {table_name} 创建成功!")
+
+        except Error as e:
+            self.close_db()
+            print(f"创建表失败，发生错误: {e}!")
+
+    def create_index(self, table_name, index_name, columns):
+        try:
+            # 索引名在 SQLite 中全局唯一，加上表名前缀
+            self._cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS `{table_name}_{index_name}` ON `{table_name}` ({columns})")
+            self._conn.commit()
+            print(f"索引 {table_name}.{index_name} 创建成功!")
+            return 0
+
+        except Error as e:
+            print(f"创建索引失败，发生错误: {e}!")
+            return -1
+
+    def _create_snapshot_table(self, table, key):
+        # SQLite 不支持 CREATE TABLE ... LIKE，快照表由 SELECT 的结果创建（只用于恢复，不需要约束），主键上建唯一索引
+        self._cursor.execute(f"CREATE TABLE IF NOT EXISTS `{table}_snapshot` AS SELECT * FROM `{table}` WHERE 0")
+        self._cursor.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS `{table}_snapshot_{key}` ON `{table}_snapshot` (`{key}`)")
@@ -0,0 +1,189 @@
+"""
+组合索引的基准测试：模拟多日运行中 order / deal_record 表的增长，比较有无 config.index_fields 中的索引时引擎高频查询的耗时
+用法：python benchmarks/index_benchmark.py [--backend sqlite|mysql] [--days 20]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+# 获取当前程序的路径
+current_path = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(current_path))
+
+import Engine.config as config
+from Engine.engine import Engine
+
+# 引擎中仍然访问数据库的高频查询，{round} 为当前回合，{turn} 为当前出价轮次，{price} 为回合的平均成交价，999 为超级用户编号
+# 下单统计、持仓与账户信息由引擎在内存中维护，不再查询数据库
+HOT_QUERIES = {
+    'succeeded_requests': """
+        SELECT `order`.`agent_id`,`order`.`order_id`,`order`.`order_type`,`deal_record`.`deal_lots`,`deal_record`.`deal_price`
+        FROM `deal_record` JOIN `order` ON `order`.`order_id`=`deal_record`.`bid_order_id` OR `order`.`order_id`=`deal_record`.`sell_order_id`
+        WHERE `deal_record`.`deal_round`={round} AND `deal_record`.`deal_num`={turn}
+    """,
+    'failed_requests': """
+        SELECT `agent_id`,`order_id`,`order_type`,`remain_lots`,`order_price`,`order_status`
+        FROM `order`
+        WHERE `order_round`={round} AND `order_num`={turn} AND `order_status`='pending'
+    """,
+    'avg_price': """
+        SELECT SUM(`deal_lots`*`deal_price`)/SUM(`deal_lots`)
+        FROM `deal_record`
+        WHERE `deal_round`={round} AND `deal_num`={turn}
+    """,
+    'margin_call_long': """
+        SELECT `deal_record`.`deal_id`,`bid`.`agent_id`,`sell`.`agent_id`,`deal_lots`,`deal_price`,`bid_security_funds`,`sell_security_funds`
+        FROM `deal_record` JOIN `order` AS `bid` ON `bid`.`order_id`=`deal_record`.`bid_order_id`
+        JOIN `order` AS `sell` ON `sell`.`order_id`=`deal_record`.`sell_order_id`
+        WHERE `deal_record`.`bid_status`='open' AND `bid`.`agent_id`<>999
+        AND (`deal_price`-{price})*`deal_lots`>`bid_security_funds`
+    """,
+    'margin_call_short': """
+        SELECT `deal_record`.`deal_id`,`sell`.`agent_id`,`bid`.`agent_id`,`deal_lots`,`deal_price`,`sell_security_funds`,`bid_security_funds`
+        FROM `deal_record` JOIN `order` AS `bid` ON `bid`.`order_id`=`deal_record`.`bid_order_id`
+        JOIN `order` AS `sell` ON `sell`.`order_id`=`deal_record`.`sell_order_id`
+        WHERE `deal_record`.`sell_status`='open' AND `sell`.`agent_id`<>999
+        AND ({price}-`deal_price`)*`deal_lots`>`sell_security_funds`
+    """,
+}
+
+
+class Dataset:
+    """合成的下单与成交数据，每回合每轮出价 orders_per_turn 个订单，约一半成交"""
+
+    def __init__(self, agents, turns, orders_per_turn, seed=0):
+        self.agents = agents
+        self.turns = turns
+        self.orders_per_turn = orders_per_turn
+        self.random = random.Random(seed)
+        self.order_id = 0
+        self.deal_id = 0
+        self.open_deals = []
+
+    def round(self, round):
+        """生成一个回合的订单、成交单、账户记录与平仓的成交单编号"""
+        orders, deals = [], []
+        for turn in range(self.turns):
+            turn_orders = []
+            for _ in range(self.orders_per_turn):
+                self.order_id += 1
+                lots = round_7(self.random.uniform(1, 50))
+                order = {
+                    'order_id': self.order_id, 'agent_id': self.random.randrange(self.agents), 'futures_id': 1,
+                    'order_type': self.random.choice(('buy', 'sell')), 'order_round': round, 'order_num': turn,
+                    'order_price': round_7(2.1 * (1 + self.random.uniform(-0.05, 0.05))), 'order_lots': lots,
+                    'remain_lots': lots,
+                    'order_status': self.random.choice(('pending', 'done', 'done', 'cancel', 'no_margin'))
+                }
+                turn_orders.append(order)
+            orders.extend(turn_orders)
+            buys = [order for order in turn_orders if order['order_type'] == 'buy']
+            sells = [order for order in turn_orders if order['order_type'] == 'sell']
+            for buy, sell in zip(buys, sells):
+                self.deal_id += 1
+                deals.append({
+                    'deal_id': self.deal_id, 'bid_order_id': buy['order_id'], 'sell_order_id': sell['order_id'],
+                    'deal_lots': min(buy['order_lots'], sell['order_lots']), 'deal_price': sell['order_price'],
+                    'bid_status': 'open', 'bid_security_funds': 1, 'sell_status': 'open', 'sell_security_funds': 1,
+                    'deal_round': round, 'deal_num': turn, 'delivery_round': round + 10
+                })
+        records = [{'agent_id': agent_id, 'round': round, 'current_funds': 100000, 'available_funds': 100000,
+                    'security_funds': 0, 'profit_loss': 0} for agent_id in range(self.agents)]
+        # 持仓的数量大致保持稳定：每回合平掉一部分较早的成交单
+        self.open_deals.extend(deal['deal_id'] for deal in deals)
+        closed = self.open_deals[:len(deals) * 9 // 10]
+        self.open_deals = self.open_deals[len(closed):]
+        return orders, deals, records, closed
+
+
+def round_7(value):
+    return float(f"{value:.7f}")
+
+
+def build_database(backend, db_name, indexed, agents):
+    """建库建表，indexed 为 True 时执行引擎的索引迁移"""
+    engine = Engine(backend=backend)
+    engine.db = engine._connect()
+    db = engine.db
+    db.drop_db(db_name)
+    db.create_db(db_name)
+    db.select_db(db_name)
+    db.create_table('agent', config.agent_field)
+    db.create_table('futures', config.futures_field)
+    db.create_table('order', config.order_field)
+    db.create_table('agent_record', config.agent_record_field)
+    db.create_table('futures_record', config.futures_record_field)
+    db.create_table('actuals', config.actuals_field)
+    db.create_table('deal_record', config.deal_record_field)
+    if indexed:
+        engine.migrate_schema()
+    db.insert_all('futures', [{'futures_id': 1, 'futures_name': 'Nickle', 'commodity': 'metal', 'init_price': 2.1,
+                               'price_limit': 0.1, 'margin_rate': 0.125, 'contract_round': 10}])
+    db.insert_all('agent', [{'agent_id': agent_id, 'agent_name': f'agent{agent_id}', 'agent_type': 'retail investor',
+                             'agent_info': '', 'init_fund': 100000} for agent_id in range(agents)])
+    return db
+
+
+def close_deals(db, deal_ids):
+    if deal_ids:
+        db.deal_record_update_many(columns=('bid_status', 'sell_status'),
+                                   datas=[('done', 'done', deal_id) for deal_id in deal_ids])
+
+
+def time_queries(db, round, turn, repeat):
+    """每个查询执行 repeat 次，返回 {查询名: 平均耗时（毫秒）}"""
+    result = {}
+    for name, sql in HOT_QUERIES.items():
+        start = time.perf_counter()
+        for i in range(repeat):
+            db.execute_sql(sql.format(round=round, turn=turn, price=2.1))
+        result[name] = (time.perf_counter() - start) * 1000 / repeat
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backend', default='sqlite', choices=['sqlite', 'mysql'])
+    parser.add_argument('--days', type=int, default=20, help='模拟的天数')
+    parser.add_argument('--rounds', type=int, default=10, help='每天的回合数')
+    parser.add_argument('--turns', type=int, default=5, help='每回合的出价轮次')
+    parser.add_argument('--agents', type=int, default=12)
+    parser.add_argument('--orders', type=int, default=100, help='每轮出价的订单数')
+    parser.add_argument('--repeat', type=int, default=20, help='每个查询的重复次数')
+    args = parser.parse_args()
+
+    if args.backend == 'sqlite':
+        config.sqlite_config = {'folder': ':memory:'}
+    databases = {
+        'plain': build_database(args.backend, 'fin_sim_index_benchmark_plain', False, args.agents),
+        'indexed': build_database(args.backend, 'fin_sim_index_benchmark_indexed', True, args.agents),
+    }
+    datasets = {name: Dataset(args.agents, args.turns, args.orders) for name in databases}
+
+    print(f"\n{'day':>4} {'deals':>8} {'query':>20} {'plain(ms)':>10} {'indexed(ms)':>12} {'speedup':>8}")
+    round = 0
+    for day in range(1, args.days + 1):
+        for _ in range(args.rounds):
+            round += 1
+            for name, db in databases.items():
+                orders, deals, records, closed = datasets[name].round(round)
+                with db.transaction():
+                    db.insert_all('order', orders)
+                    db.insert_all('deal_record', deals)
+                    db.insert_all('agent_record', records)
+                    close_deals(db, closed)
+        timings = {name: time_queries(db, round, args.turns - 1, args.repeat)
+                   for name, db in databases.items()}
+        for query in HOT_QUERIES:
+            plain, indexed = timings['plain'][query], timings['indexed'][query]
+            print(f"{day:>4} {datasets['plain'].deal_id:>8} {query:>20} {plain:>10.3f} {indexed:>12.3f} "
+                  f"{plain / max(indexed, 1e-9):>7.1f}x")
+
+    for db in databases.values():
+        db.close_db()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,251 @@
+"""
+撮合引擎的基准测试：由 PricePredictionFiles 中的价格、数量参数（*_price_generator.json、*_amount_generator.json）生成合成订单流，
+在内存 SQLite 数据库上统计 deal_making（撮合 _match_orders_modify 与保证金更新）与回合结算的用时，
+输出每秒处理的订单数与每轮出价用时的 p50/p99，并将撮合结果与参考结果（matching_reference.json）比较，发现撮合逻辑的回归
+只使用 CPU，不需要网络、LLM 与 MySQL
+用法：python benchmarks/matching_benchmark.py [--futures SF2503] [--orders 200] [--dispersion 1.0] [--self-trade 0.1]
+     python benchmarks/matching_benchmark.py --update-reference    # 有意修改撮合逻辑后，更新当前参数的参考结果
+"""
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import os
+import sys
+import time
+from functools import wraps
+
+import numpy as np
+
+# 获取当前程序的路径
+current_path = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(current_path))
+
+import Engine.config as config
+from Engine.engine import Engine
+from order_generator import OrderGenerator, PRICE_INDEX, AMOUNT_INDEX
+
+REFERENCE_FILE = os.path.join(current_path, 'matching_reference.json')
+PARAMETER_FOLDER = os.path.join(os.path.dirname(current_path), 'PricePredictionFiles')
+
+
+class Player:
+    """引擎初始化需要的玩家接口"""
+
+    def __init__(self, name, capital):
+        self.name = name
+        self.capital = capital
+        self.id = None
+
+    def get_name(self):
+        return self.name
+
+    def get_capital(self):
+        return self.capital
+
+    def get_profile(self):
+        return ''
+
+    def set_id(self, player_id):
+        self.id = player_id
+
+
+class OrderFlow:
+    """
+    合成订单流，每轮出价 orders 个订单 [玩家编号, 轮次, 类型, 数量, 价格]，与 ClusteredOrders 一样由 OrderGenerator 采样
+    每个玩家随机给出交易请求（方向、价格描述、数量描述），价格变化率乘以 dispersion 控制价格的离散程度
+    其中 self_trade 比例的订单是同一玩家已有订单的反向订单（价格、数量相同），用于测试同一玩家订单不成交的处理
+    每轮出价的随机数只由 (seed, 回合, 轮次) 决定，结果可复现
+    """
+
+    def __init__(self, price_file, amount_file, agents, orders, dispersion, self_trade, limit, seed=0):
+        self.generator = OrderGenerator(price_file, amount_file)
+        self.agents = agents
+        self.orders = orders
+        self.dispersion = dispersion
+        self.self_trade = self_trade
+        self.limit = limit
+        self.seed = seed
+        groups = len(self.generator.amount[0]['max'])
+        if agents > 2 * groups:
+            # 数量参数按玩家分组（每组两个玩家）
+            print(f"数量参数只有{groups}组，玩家数不能超过{2 * groups}")
+            exit(-1)
+
+    def turn(self, round, turn, price):
+        """生成一轮出价的订单，price 为当前价格"""
+        rng = np.random.default_rng([self.seed, round, turn])
+        mirrors = int(self.orders * self.self_trade)
+        base = self.orders - mirrors
+        per_agent = -(-base // self.agents)
+        transactions = []
+        for agent_id in range(self.agents):
+            request = {
+                'type': '买入' if rng.random() < 0.5 else '卖出',
+                'price': list(PRICE_INDEX)[rng.integers(len(PRICE_INDEX))],
+                'amount': list(AMOUNT_INDEX)[rng.integers(len(AMOUNT_INDEX))],
+            }
+            is_buy, rate, amount = self.generator.sample(rng, request, agent_id, self.limit, n=per_agent)
+            prices = price * (1 + rate * self.dispersion)
+            for b, a, p in zip(is_buy.tolist(), amount.tolist(), prices.tolist()):
+                transactions.append([agent_id, turn, 'buy' if b else 'sell', a, p])
+        # 打乱各玩家订单的先后（时间优先），截取 base 个
+        transactions = [transactions[i] for i in rng.permutation(len(transactions))[:base]]
+        for i in rng.integers(base, size=mirrors).tolist():
+            agent_id, _, order_type, amount, order_price = transactions[i]
+            transactions.append([agent_id, turn, 'sell' if order_type == 'buy' else 'buy', amount, order_price])
+        return transactions
+
+
+class Timings:
+    """统计引擎方法的用时，record[名称] 为当前一次 deal_making 或结算中的累计用时"""
+
+    def __init__(self):
+        self.record = {}
+
+    def wrap(self, engine, method, name):
+        """用计时的包装替换引擎实例的方法"""
+        fn = getattr(engine, method)
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.record[name] = self.record.get(name, 0.0) + time.perf_counter() - start
+        setattr(engine, method, wrapper)
+
+    def take(self):
+        """返回并清空当前的累计用时"""
+        record, self.record = self.record, {}
+        return record
+
+
+def run(args, flow):
+    """
+    运行基准测试
+    :return: (每轮出价的用时 [{阶段: 秒}], 每回合结算的用时 [秒], 撮合结果摘要)
+    """
+    config.sqlite_config = {'folder': ':memory:'}
+    engine = Engine(backend='sqlite')
+    engine.sync_system_setting(args.margin, args.limit, args.rounds + 1)
+    players = [Player(f'agent{i}', args.capital) for i in range(args.agents)]
+    engine.engine_init('fin_sim_matching_benchmark', players, args.price, args.price, 70001)
+
+    timings = Timings()
+    timings.wrap(engine, '_match_orders_modify', 'matching')
+    timings.wrap(engine, '_pay_margin', 'margin')
+    timings.wrap(engine, '_flush_ledger', 'margin')
+
+    turn_timings, settlement_timings = [], []
+    results = []    # 撮合结果，用于与参考结果比较
+    for round in range(1, args.rounds + 1):
+        engine.round_end()
+        for turn in range(args.turns):
+            transactions = flow.turn(round, turn, float(engine.last_price))
+            timings.take()
+            start = time.perf_counter()
+            succeeded, failed, deals = engine.deal_making(transactions)
+            elapsed = time.perf_counter() - start
+            record = timings.take()
+            record['deal_making'] = elapsed
+            turn_timings.append(record)
+            results.append(('turn', round, turn, len(transactions), len(succeeded), len(failed), len(deals),
+                            str(engine.last_price), engine.get_order_info()))
+        start = time.perf_counter()
+        avg_price = engine.settlement_of_round()
+        settlement_timings.append(time.perf_counter() - start)
+        timings.take()
+        results.append(('settlement', round, str(avg_price), sorted(engine.retrieve_all_account_info().items())))
+
+    summary = {
+        'orders': sum(result[3] for result in results if result[0] == 'turn'),
+        'deals': sum(result[6] for result in results if result[0] == 'turn'),
+        'last_price': str(engine.last_price),
+        'digest': hashlib.sha256(repr(results).encode()).hexdigest(),
+    }
+    engine.db.close_db()
+    return turn_timings, settlement_timings, summary
+
+
+def reference_key(args):
+    """参考结果的键：决定撮合结果的全部参数"""
+    return (f"{args.futures} agents={args.agents} rounds={args.rounds} turns={args.turns} orders={args.orders} "
+            f"dispersion={args.dispersion} self_trade={args.self_trade} limit={args.limit} margin={args.margin} "
+            f"capital={args.capital} price={args.price} seed={args.seed}")
+
+
+def check_reference(args, summary):
+    """与参考结果比较，--update-reference 时写入参考结果；返回 0 - 一致或没有参考结果，-1 - 不一致"""
+    references = {}
+    if os.path.exists(REFERENCE_FILE):
+        with open(REFERENCE_FILE, 'r', encoding='utf-8') as f:
+            references = json.load(f)
+    key = reference_key(args)
+    if args.update_reference:
+        references[key] = summary
+        with open(REFERENCE_FILE, 'w', encoding='utf-8') as f:
+            json.dump(references, f, ensure_ascii=False, indent=4, sort_keys=True)
+        print(f"参考结果已更新: {key}")
+        return 0
+    if key not in references:
+        print(f"没有当前参数的参考结果，跳过比较（使用 --update-reference 写入）: {key}")
+        return 0
+    if references[key] != summary:
+        print(f"撮合结果与参考结果不一致: {key}\n参考: {references[key]}\n当前: {summary}")
+        return -1
+    print("撮合结果与参考结果一致")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--futures', default='SF2503', help='PricePredictionFiles 中的期货名称，使用其价格与数量参数')
+    parser.add_argument('--agents', type=int, default=8)
+    parser.add_argument('--rounds', type=int, default=10, help='回合数')
+    parser.add_argument('--turns', type=int, default=5, help='每回合的出价轮次')
+    parser.add_argument('--orders', type=int, default=200, help='每轮出价的订单数')
+    parser.add_argument('--dispersion', type=float, default=1.0, help='价格变化率的缩放倍数')
+    parser.add_argument('--self-trade', type=float, default=0.1, help='同一玩家反向订单的比例')
+    parser.add_argument('--limit', type=float, default=10, help='涨跌停限制（%%）')
+    parser.add_argument('--margin', type=float, default=12.5, help='保证金比例（%%）')
+    parser.add_argument('--capital', type=float, default=1e8, help='每个玩家的初始资金')
+    parser.add_argument('--price', type=float, default=None, help='初始价格，默认为参数文件对应的 *_price_20.json 中第一天的结算价')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--update-reference', action='store_true', help='写入当前参数的参考结果')
+    args = parser.parse_args()
+
+    price_file = os.path.join(PARAMETER_FOLDER, f'{args.futures}_price_generator.json')
+    amount_file = os.path.join(PARAMETER_FOLDER, f'{args.futures}_amount_generator.json')
+    if args.price is None:
+        with open(os.path.join(PARAMETER_FOLDER, f'{args.futures}_price_20.json'), 'r', encoding='utf-8') as f:
+            args.price = json.load(f)[0]['prev_5_settle'][-1]
+    flow = OrderFlow(price_file, amount_file, args.agents, args.orders, args.dispersion, args.self_trade, args.limit,
+                     seed=args.seed)
+
+    # 引擎的运行日志不输出
+    with contextlib.redirect_stdout(io.StringIO()):
+        turn_timings, settlement_timings, summary = run(args, flow)
+
+    deal_making = np.array([record['deal_making'] for record in turn_timings])
+    print(f"\n{args.futures}: {args.rounds}回合 x {args.turns}轮, 每轮{args.orders}个订单, "
+          f"dispersion={args.dispersion}, self_trade={args.self_trade}")
+    print(f"订单 {summary['orders']}, 成交 {summary['deals']}, "
+          f"{summary['orders'] / deal_making.sum():.0f} orders/s (deal_making)")
+    print(f"\n{'stage':>12} {'count':>6} {'total(ms)':>10} {'p50(ms)':>9} {'p99(ms)':>9}")
+    stages = {name: np.array([record.get(name, 0.0) for record in turn_timings])
+              for name in ('deal_making', 'matching', 'margin')}
+    stages['settlement'] = np.array(settlement_timings)
+    for name, seconds in stages.items():
+        p50, p99 = np.percentile(seconds, [50, 99]) * 1000
+        print(f"{name:>12} {len(seconds):>6} {seconds.sum() * 1000:>10.1f} {p50:>9.3f} {p99:>9.3f}")
+    print()
+
+    if check_reference(args, summary) == -1:
+        exit(-1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,32 @@
 import numpy as np
-import faiss
-import torch
 import json
-import argparse
-from modelscope import AutoModel, AutoConfig, AutoTokenizer, snapshot_download
-
-device = 'cuda:1'
-model_dir = snapshot_download('AI-ModelScope/roberta-large', revision='master')
-tokenizer = AutoTokenizer.from_pretrained(model_dir, device_map=device)
-model = AutoModel.from_pretrained(model_dir, device_map=device)
-model.eval()
+import threading
+
+# 编码模型与索引都在第一次检索时才加载，不使用检索的实验不需要加载（也不需要GPU）
+_encoders = {}  # 设备 -> (tokenizer, model, 实际使用的设备)
+_encoders_lock = threading.Lock()
+
+
+def load_encoder(device='cuda:1'):
+    """
+    加载 roberta-large 编码模型（每个设备只加载一次）
+    :param device: 'auto' - 有GPU时使用GPU，否则使用CPU；'cpu'；'cuda:1' 等
+    :return: (tokenizer, model, 实际使用的设备)
+    """
+    with _encoders_lock:
+        if device not in _encoders:
+            import torch
+            from modelscope import AutoModel, AutoTokenizer, snapshot_download
+
+            real_device = device
+            if device == 'auto':
+                real_device = 'cuda' if torch.cuda.is_available() else 'cpu'
+            model_dir = snapshot_download('AI-ModelScope/roberta-large', revision='master')
+            tokenizer = AutoTokenizer.from_pretrained(model_dir, device_map=real_device)
+            model = AutoModel.from_pretrained(model_dir, device_map=real_device)
+            model.eval()
+            _encoders[device] = (tokenizer, model, real_device)
+        return _encoders[device]
 
 
 def normalize_vector(vec):
@@ -20,57 +37,102 @@ def normalize_vector(vec):
     return vec
 
 
-def retrieve_query(query):
-    index_path = 'vectors_index_faiss_test_1.index' # 数据路径
-    k = 2    # 返回结果数量
-
-    # 加载FAISS索引
-    # print(f"正在加载索引: {index_path}")
-    index = faiss.read_index(index_path)
+class Retriever:
+    """
+    新闻相关资料检索器
+    FAISS 索引（尽量以内存映射方式打开）与文档库只在第一次检索时加载一次，之后的检索直接复用
+    """
+
+    def __init__(self, index_path='vectors_index_faiss_test_1.index', docs_path='documents.json', device='cuda:1'):
+        """
+        :param index_path: FAISS 索引文件路径
+        :param docs_path: 文档库路径，json 格式 {"索引ID": 文档}
+        :param device: 编码模型所在设备，'auto' / 'cpu' / 'cuda:1' 等
+        """
+        self.index_path = index_path
+        self.docs_path = docs_path
+        self.device = device
+        self.index = None
+        self.docs = None    # 索引ID -> 文档
+
+    def load(self):
+        """加载索引与文档库（只在第一次调用时加载）"""
+        if self.index is None:
+            import faiss
+            try:
+                # 内存映射，不把整个索引读入内存
+                self.index = faiss.read_index(self.index_path, faiss.IO_FLAG_MMAP)
+            except RuntimeError:
+                # 该类型的索引不支持内存映射
+                self.index = faiss.read_index(self.index_path)
+        if self.docs is None:
+            with open(self.docs_path, 'r') as doc_file:
+                self.docs = {int(idx): doc for idx, doc in json.load(doc_file).items()}
+        return self
+
+    def encode(self, queries):
+        """
+        将一批查询编码为归一化的向量（一次前向计算）
+        :param queries: list[str]
+        :return: np.ndarray, shape=(len(queries), 维度)
+        """
+        import torch
+        tokenizer, model, device = load_encoder(self.device)
+        with torch.no_grad():
+            encoded_input = tokenizer(queries, return_tensors='pt', padding=True, truncation=True).to(device)
+            output = model(**encoded_input).pooler_output.to('cpu').numpy()
+        del encoded_input
+        vectors = np.asarray(output, dtype=np.float32)
+        # 余弦相似度索引，需要逐行归一化查询向量
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        return vectors / norms
+
+    def retrieve_batch(self, queries, k=2):
+        """
+        批量检索，所有查询只做一次编码和一次 index.search
+        :param queries: list[str]
+        :param k: 每个查询返回的结果数量
+        :return: list[list[str]]，与 queries 顺序一致
+        """
+        if len(queries) == 0:
+            return []
+        self.load()
+        query_vectors = self.encode(list(queries))
+        distances, indices = self.index.search(query_vectors, k)
+        # 对于内积/余弦相似度，值越大越相似；indices 中的 -1 表示结果不足 k 个
+        return [[self.docs[idx] for idx in row if idx >= 0] for row in indices.tolist()]
+
+    def retrieve(self, query, k=2):
+        """检索单个查询"""
+        return self.retrieve_batch([query], k)[0]
+
+
+_retriever = None
+
+
+def get_retriever(device=None):
+    """
+    全局共享的检索器
+    :param device: 编码模型所在设备，只在第一次创建检索器时生效，默认为 'cuda:1'
+    """
+    global _retriever
+    if _retriever is None:
+        if device is None:
+            _retriever = Retriever()
+        else:
+            _retriever = Retriever(device=device)
+    return _retriever
 
-    # 获取向量维度
-    # dimension = index.d
-    # print(f"索引向量维度: {dimension}")
-    # print(f"索引中向量总数: {index.ntotal}")
 
+def retrieve_query(query):
+    k = 2    # 返回结果数量
     try:
-        with torch.no_grad():
-            encoded_input = tokenizer(query, return_tensors='pt').to(device)
-            output = model(**encoded_input).pooler_output.to('cpu').numpy()[0]
-
-        # 解析用户输入的向量
-        try:
-            query_vector = np.array([output], dtype=np.float32)
-
-            # 如果是余弦相似度索引，需要归一化查询向量
-            # 如果不确定索引类型，可以尝试检测或总是归一化向量
-            query_vector = normalize_vector(query_vector)
-
-            # 执行查询
-            # print("执行查询...")
-            distances, indices = index.search(query_vector, k)
-
-            del encoded_input, output
-
-            # 显示结果
-            # print(f"\n找到最接近的 {k} 个结果:")
-            with open('documents.json', 'r') as doc_file:
-                docs = json.load(doc_file)
-                returnList = []
-                for i, (idx, dist) in enumerate(zip(indices[0], distances[0])):
-                    # 对于内积/余弦相似度，值越大越相似
-                    # 对于L2距离，值越小越相似
-                    similarity = dist  # 如果是内积/余弦相似度
-                    # similarity = 1 / (1 + dist)  # 如果是L2距离，转换为相似度
-
-                    # print(f"#{i+1}: 索引 ID = {idx}, 相似度 = {similarity:.6f}")
-                    # print('document:', docs[str(idx)])
-                    returnList.append(docs[str(idx)])
-                return returnList
-
-        except ValueError as e:
-            print(f"错误: 无法解析输入向量: {e}")
-            return None
+        return get_retriever().retrieve(query, k)
+
+    except ValueError as e:
+        print(f"错误: 无法解析输入向量: {e}")
+        return None
 
     except KeyboardInterrupt:
         print("\n程序被用户中断")
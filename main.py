@@ -1,7 +1,6 @@
 """主程序，初始化游戏设定，玩家和引擎"""
 import json
 import time
-import torch
 import argparse
 
 try:
@@ -10,7 +9,7 @@ except:
     from .Engine.engine import Engine
 from simulator import Simulator
 from news_init_config_updator import *
-from utils import agents_init
+from utils import agents_init, empty_cuda_cache
 import os
 
 # 获取当前主程序的路径
@@ -24,7 +23,22 @@ profile_folder = os.path.join(agent_folder, 'profiles')
 config_folder = os.path.join(agent_folder, 'configs')
 
 
-def main():
+def start_simulation(simulator, resume=False):
+    """
+    同步系统设置并开始游戏；resume 为 True 时从检查点恢复到最后一个完成的回合，不重新初始化数据库（检查点不存在时从头开始）
+    :return: 主循环的起始下标
+    """
+    simulator.sync_system_setting()
+    if resume:
+        if os.path.exists(simulator.checkpoint_file):
+            return simulator.resume()
+        # 多日连续运行时，中断之后的日期还没有检查点
+        print(f"检查点{simulator.checkpoint_file}不存在，从头开始运行")
+    simulator.game_init()
+    return 0
+
+
+def main(resume=False):
     """ 主程序 LME """
     # 计时器
     sum_time = 0.0
@@ -35,14 +49,13 @@ def main():
     engine = Engine()
     # 初始化模拟器
     simulator = Simulator(agents, engine)
-    simulator.sync_system_setting()
-    simulator.game_init()
+    start = start_simulation(simulator, resume)
 
     with open(os.path.join(current_path, "news.txt"), 'r', encoding='utf-8') as f:
         news = f.read().split('-----*****-----')
     with open(os.path.join(current_path, 'Agent/configs/SystemInitConfig.json'), 'r', encoding='utf-8') as f:
         contract_round = json.load(f)['contract_round']
-    for i in range(contract_round+1):
+    for i in range(start, contract_round+1):
 
         # 计时
         current_time = time.time()
@@ -51,7 +64,7 @@ def main():
         sum_time += interval
         last_time = current_time
 
-        torch.cuda.empty_cache()    # 清除缓存
+        empty_cuda_cache()    # 清除缓存
         if i > 0:
             if simulator.run_round(news=(news[i-1], news[i])) == -1:
                 print("Error occurred.")
@@ -67,7 +80,7 @@ def main():
 
     return 0
 
-def main_HET(num=3):
+def main_HET(num=3, resume=False):
     '''异质性消融实验'''
     assert num in [3,5,7,12],f"num={num} not in [3,5,7,12]"
     # 计时器
@@ -79,14 +92,13 @@ def main_HET(num=3):
     engine = Engine()
     # 初始化模拟器
     simulator = Simulator(agents, engine)
-    simulator.sync_system_setting()
-    simulator.game_init()
+    start = start_simulation(simulator, resume)
 
     with open(os.path.join(current_path, "news.txt"), 'r', encoding='utf-8') as f:
         news = f.read().split('-----*****-----')
     with open(os.path.join(current_path, 'Agent/configs/SystemInitConfig.json'), 'r', encoding='utf-8') as f:
         contract_round = json.load(f)['contract_round']
-    for i in range(contract_round+1):
+    for i in range(start, contract_round+1):
 
         # 计时
         current_time = time.time()
@@ -95,7 +107,7 @@ def main_HET(num=3):
         sum_time += interval
         last_time = current_time
 
-        torch.cuda.empty_cache()    # 清除缓存
+        empty_cuda_cache()    # 清除缓存
         if i > 0:
             if simulator.run_round(news=(news[i-1], news[i])) == -1:
                 print("Error occurred.")
@@ -111,7 +123,7 @@ def main_HET(num=3):
 
     return 0
 
-def main_RAG():
+def main_RAG(resume=False):
     """ 主程序 LME RAG-Agent """
     # 计时器
     sum_time = 0.0
@@ -122,14 +134,13 @@ def main_RAG():
     engine = Engine()
     # 初始化模拟器
     simulator = Simulator(agents, engine)
-    simulator.sync_system_setting()
-    simulator.game_init()
+    start = start_simulation(simulator, resume)
 
     with open(os.path.join(current_path, "news.txt"), 'r', encoding='utf-8') as f:
         news = f.read().split('-----*****-----')
     with open(os.path.join(current_path, 'Agent/configs/SystemInitConfig.json'), 'r', encoding='utf-8') as f:
         contract_round = json.load(f)['contract_round']
-    for i in range(contract_round+1):
+    for i in range(start, contract_round+1):
 
         # 计时
         current_time = time.time()
@@ -138,7 +149,7 @@ def main_RAG():
         sum_time += interval
         last_time = current_time
 
-        torch.cuda.empty_cache()    # 清除缓存
+        empty_cuda_cache()    # 清除缓存
         if i > 0:
             if simulator.run_round_rag(news=(news[i-1], news[i])) == -1:
                 print("Error occurred.")
@@ -155,7 +166,7 @@ def main_RAG():
     return 0
 
 
-def main_ablation(mode: str='w/o expert'):
+def main_ablation(mode: str='w/o expert', resume=False):
     """ 主程序 """
     # 计时器
     sum_time = 0.0
@@ -166,14 +177,13 @@ def main_ablation(mode: str='w/o expert'):
     engine = Engine()
     # 初始化模拟器
     simulator = Simulator(agents, engine)
-    simulator.sync_system_setting()
-    simulator.game_init()
+    start = start_simulation(simulator, resume)
 
     with open(os.path.join(current_path, "news.txt"), 'r', encoding='utf-8') as f:
         news = f.read().split('-----*****-----')
     with open(os.path.join(current_path, 'Agent/configs/SystemInitConfig.json'), 'r', encoding='utf-8') as f:
         contract_round = json.load(f)['contract_round']
-    for i in range(contract_round+1):
+    for i in range(start, contract_round+1):
 
         # 计时
         current_time = time.time()
@@ -182,7 +192,7 @@ def main_ablation(mode: str='w/o expert'):
         sum_time += interval
         last_time = current_time
 
-        torch.cuda.empty_cache()    # 清除缓存
+        empty_cuda_cache()    # 清除缓存
         if mode == 'w/o expert':
             function_name = simulator.run_round_without_expert
         elif mode == 'w/o generator':
@@ -205,7 +215,7 @@ def main_ablation(mode: str='w/o expert'):
     return 0
 
 
-def main_IH2412():
+def main_IH2412(resume=False):
     """ 主程序 IH2412 """
     # 计时器
     sum_time = 0.0
@@ -216,14 +226,13 @@ def main_IH2412():
     engine = Engine()
     # 初始化模拟器
     simulator = Simulator(agents, engine)
-    simulator.sync_system_setting()
-    simulator.game_init()
+    start = start_simulation(simulator, resume)
 
     with open(os.path.join(current_path, "news.txt"), 'r', encoding='utf-8') as f:
         news = f.read().split('-----*****-----')
     with open(os.path.join(current_path, 'Agent/configs/SystemInitConfig.json'), 'r', encoding='utf-8') as f:
         contract_round = json.load(f)['contract_round']
-    for i in range(contract_round+1):
+    for i in range(start, contract_round+1):
 
         # 计时
         current_time = time.time()
@@ -232,7 +241,7 @@ def main_IH2412():
         sum_time += interval
         last_time = current_time
 
-        torch.cuda.empty_cache()    # 清除缓存
+        empty_cuda_cache()    # 清除缓存
         price_file = 'PricePredictionFiles/IH2412_price_generator.json'
         amount_file = 'PricePredictionFiles/IH2412_amount_generator.json'
         if i > 0:
@@ -251,7 +260,7 @@ def main_IH2412():
     return 0
 
 
-def main_TA501():
+def main_TA501(resume=False):
     """ 主程序 TA501 """
     # 计时器
     sum_time = 0.0
@@ -262,14 +271,13 @@ def main_TA501():
     engine = Engine()
     # 初始化模拟器
     simulator = Simulator(agents, engine)
-    simulator.sync_system_setting()
-    simulator.game_init()
+    start = start_simulation(simulator, resume)
 
     with open(os.path.join(current_path, "news.txt"), 'r', encoding='utf-8') as f:
         news = f.read().split('-----*****-----')
     with open(os.path.join(current_path, 'Agent/configs/SystemInitConfig.json'), 'r', encoding='utf-8') as f:
         contract_round = json.load(f)['contract_round']
-    for i in range(contract_round+1):
+    for i in range(start, contract_round+1):
 
         # 计时
         current_time = time.time()
@@ -278,7 +286,7 @@ def main_TA501():
         sum_time += interval
         last_time = current_time
 
-        torch.cuda.empty_cache()    # 清除缓存
+        empty_cuda_cache()    # 清除缓存
         price_file = 'PricePredictionFiles/TA501_price_generator.json'
         amount_file = 'PricePredictionFiles/TA501_amount_generator.json'
         if i > 0:
@@ -296,7 +304,7 @@ def main_TA501():
 
     return 0
 
-def main_SC2501():
+def main_SC2501(resume=False):
     """ 主程序 SC2501 """
     # 计时器
     sum_time = 0.0
@@ -307,14 +315,13 @@ def main_SC2501():
     engine = Engine()
     # 初始化模拟器
     simulator = Simulator(agents, engine)
-    simulator.sync_system_setting()
-    simulator.game_init()
+    start = start_simulation(simulator, resume)
 
     with open(os.path.join(current_path, "news.txt"), 'r', encoding='utf-8') as f:
         news = f.read().split('-----*****-----')
     with open(os.path.join(current_path, 'Agent/configs/SystemInitConfig.json'), 'r', encoding='utf-8') as f:
         contract_round = json.load(f)['contract_round']
-    for i in range(contract_round+1):
+    for i in range(start, contract_round+1):
 
         # 计时
         current_time = time.time()
@@ -323,7 +330,7 @@ def main_SC2501():
         sum_time += interval
         last_time = current_time
 
-        torch.cuda.empty_cache()    # 清除缓存
+        empty_cuda_cache()    # 清除缓存
         price_file = 'PricePredictionFiles/SC2501_price_generator.json'
         amount_file = 'PricePredictionFiles/SC2501_amount_generator.json'
         if i > 0:
@@ -342,7 +349,7 @@ def main_SC2501():
     return 0
 
 
-def main_GCG2502():
+def main_GCG2502(resume=False):
     """ 主程序 SC2501 """
     # 计时器
     sum_time = 0.0
@@ -353,14 +360,13 @@ def main_GCG2502():
     engine = Engine()
     # 初始化模拟器
     simulator = Simulator(agents, engine)
-    simulator.sync_system_setting()
-    simulator.game_init()
+    start = start_simulation(simulator, resume)
 
     with open(os.path.join(current_path, "news.txt"), 'r', encoding='utf-8') as f:
         news = f.read().split('-----*****-----')
     with open(os.path.join(current_path, 'Agent/configs/SystemInitConfig.json'), 'r', encoding='utf-8') as f:
         contract_round = json.load(f)['contract_round']
-    for i in range(contract_round+1):
+    for i in range(start, contract_round+1):
 
         # 计时
         current_time = time.time()
@@ -369,7 +375,7 @@ def main_GCG2502():
         sum_time += interval
         last_time = current_time
 
-        torch.cuda.empty_cache()    # 清除缓存
+        empty_cuda_cache()    # 清除缓存
         price_file = 'PricePredictionFiles/GCG2502_price_generator.json'
         amount_file = 'PricePredictionFiles/GCG2502_amount_generator.json'
         if i > 0:
@@ -388,7 +394,7 @@ def main_GCG2502():
     return 0
 
 
-def main_CH2503():
+def main_CH2503(resume=False):
     """ 主程序 CH2503 """
     # 计时器
     sum_time = 0.0
@@ -399,14 +405,13 @@ def main_CH2503():
     engine = Engine()
     # 初始化模拟器
     simulator = Simulator(agents, engine)
-    simulator.sync_system_setting()
-    simulator.game_init()
+    start = start_simulation(simulator, resume)
 
     with open(os.path.join(current_path, "news.txt"), 'r', encoding='utf-8') as f:
         news = f.read().split('-----*****-----')
     with open(os.path.join(current_path, 'Agent/configs/SystemInitConfig.json'), 'r', encoding='utf-8') as f:
         contract_round = json.load(f)['contract_round']
-    for i in range(contract_round+1):
+    for i in range(start, contract_round+1):
 
         # 计时
         current_time = time.time()
@@ -415,7 +420,7 @@ def main_CH2503():
         sum_time += interval
         last_time = current_time
 
-        torch.cuda.empty_cache()    # 清除缓存
+        empty_cuda_cache()    # 清除缓存
         price_file = 'PricePredictionFiles/CH2503_price_generator.json'
         amount_file = 'PricePredictionFiles/CH2503_amount_generator.json'
         if i > 0:
@@ -434,7 +439,7 @@ def main_CH2503():
     return 0
 
 
-def main_SF2503():
+def main_SF2503(resume=False):
     """ 主程序 SC2503 """
     # 计时器
     sum_time = 0.0
@@ -445,14 +450,13 @@ def main_SF2503():
     engine = Engine()
     # 初始化模拟器
     simulator = Simulator(agents, engine)
-    simulator.sync_system_setting()
-    simulator.game_init()
+    start = start_simulation(simulator, resume)
 
     with open(os.path.join(current_path, "news.txt"), 'r', encoding='utf-8') as f:
         news = f.read().split('-----*****-----')
     with open(os.path.join(current_path, 'Agent/configs/SystemInitConfig.json'), 'r', encoding='utf-8') as f:
         contract_round = json.load(f)['contract_round']
-    for i in range(contract_round+1):
+    for i in range(start, contract_round+1):
 
         # 计时
         current_time = time.time()
@@ -461,7 +465,7 @@ def main_SF2503():
         sum_time += interval
         last_time = current_time
 
-        torch.cuda.empty_cache()    # 清除缓存
+        empty_cuda_cache()    # 清除缓存
         price_file = 'PricePredictionFiles/SF2503_price_generator.json'
         amount_file = 'PricePredictionFiles/SF2503_amount_generator.json'
         if i > 0:
@@ -480,11 +484,12 @@ def main_SF2503():
     return 0
 
 
-def main_20_days_3_day_mode(futures_name, start=0, end=20):
+def main_20_days_3_day_mode(futures_name, start=0, end=20, resume=False):
     """
     3 交易日模拟，连续 20 天， 计 20 组
     :param futures_name: futures_name, s.t. IH2412
     :param start: index from 0-19
+    :param resume: 每一天从各自的检查点（按数据库区分）恢复，已经完成的日期不再重新运行，没有检查点的日期从头开始
     :return:
     """
     with open(f'PricePredictionFiles/{futures_name}_price_20.json', 'r', encoding='utf-8') as f:
@@ -500,7 +505,7 @@ def main_20_days_3_day_mode(futures_name, start=0, end=20):
                 '芝加哥期货交易所大豆商品SF2503期货价格总体保持稳定，在小范围内保持震荡，没有异动。'
             )
             init_config_update(futures_name, info[i]['date'], i)
-            result = main_SF2503()
+            result = main_SF2503(resume=resume)
             if result != 0:
                 break
         elif futures_name == 'CH2503':
@@ -511,7 +516,7 @@ def main_20_days_3_day_mode(futures_name, start=0, end=20):
                 '芝加哥期货交易所大豆商品CH2503期货价格总体保持稳定，在小范围内保持震荡，没有异动。'
             )
             init_config_update(futures_name, info[i]['date'], i)
-            result = main_CH2503()
+            result = main_CH2503(resume=resume)
             if result != 0:
                 break
         elif futures_name == 'SC2501':
@@ -522,7 +527,7 @@ def main_20_days_3_day_mode(futures_name, start=0, end=20):
                 '上海期货交易所原油商品SC2501期货价格总体保持稳定，在小范围内保持震荡，没有异动。'
             )
             init_config_update(futures_name, info[i]['date'], i)
-            result = main_SC2501()
+            result = main_SC2501(resume=resume)
             if result != 0:
                 break
         elif futures_name == 'TA501':
@@ -533,7 +538,7 @@ def main_20_days_3_day_mode(futures_name, start=0, end=20):
                 '郑州商品交易所精对苯二甲酸PTA商品TA501期货价格总体保持稳定，在小范围内保持震荡，没有异动。'
             )
             init_config_update(futures_name, info[i]['date'], i)
-            result = main_TA501()
+            result = main_TA501(resume=resume)
             if result != 0:
                 break
         elif futures_name == 'GCG2502':
@@ -544,7 +549,7 @@ def main_20_days_3_day_mode(futures_name, start=0, end=20):
                 '纽约商品交易所黄金GCG2502期货价格总体保持稳定，在小范围内保持震荡，没有异动。'
             )
             init_config_update(futures_name, info[i]['date'], i)
-            result = main_GCG2502()
+            result = main_GCG2502(resume=resume)
             if result != 0:
                 break
         elif futures_name == 'IH2412':
@@ -555,7 +560,7 @@ def main_20_days_3_day_mode(futures_name, start=0, end=20):
                 '中国证券期货交易所上证50股指IH2412期货价格总体保持稳定，在小范围内保持震荡，没有异动。'
             )
             init_config_update(futures_name, info[i]['date'], i)
-            result = main_IH2412()
+            result = main_IH2412(resume=resume)
             if result != 0:
                 break
 
@@ -580,7 +585,8 @@ def main_parser():
         "--mode",
         default="main",
         required=False,
-        help="默认模式，HET为异质性实验"
+        help="实验模式：main（默认）、HET（异质性实验）、RAG、w/o expert、w/o generator、w/o expert & generator、"
+             "期货名称（如 SF2503）、20_days（连续 20 天的 3 交易日模拟）"
     )
 
     parser.add_argument(
@@ -590,6 +596,35 @@ def main_parser():
         help="在HET下参与实验的智能体个数"
     )
 
+    parser.add_argument(
+        "--futures",
+        default="SF2503",
+        required=False,
+        help="20_days 模式下的期货名称，如 SF2503"
+    )
+
+    parser.add_argument(
+        "--start",
+        type=int,
+        default=0,
+        required=False,
+        help="20_days 模式下的起始日期下标"
+    )
+
+    parser.add_argument(
+        "--end",
+        type=int,
+        default=20,
+        required=False,
+        help="20_days 模式下的结束日期下标（不含）"
+    )
+
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="从检查点（日志目录下的 checkpoint_<dbname>.json）恢复，继续运行上一次中断的模拟"
+    )
+
     args = parser.parse_args()
     return args
 
@@ -646,15 +681,22 @@ if __name__ == '__main__':
         db_name=args.db_name,
         target_dir="./Agent/configs"
     )
-    main()
-    # main_ablation('w/o expert')
-    # main_ablation('w/o generator')
-    # main_ablation('w/o expert & generator')
-    # main_IH2412()
-    # main_TA501()
-    # main_SC2501()
-    # main_GCG2502()
-    # main_CH2503()
-    # main_SF2503()
-    # main_20_days_3_day_mode('SF2503', start=0, end=20)
-    # main_RAG()
\ No newline at end of file
+    modes = {
+        'main': lambda: main(resume=args.resume),
+        'HET': lambda: main_HET(num=int(args.num), resume=args.resume),
+        'RAG': lambda: main_RAG(resume=args.resume),
+        'w/o expert': lambda: main_ablation('w/o expert', resume=args.resume),
+        'w/o generator': lambda: main_ablation('w/o generator', resume=args.resume),
+        'w/o expert & generator': lambda: main_ablation('w/o expert & generator', resume=args.resume),
+        'IH2412': lambda: main_IH2412(resume=args.resume),
+        'TA501': lambda: main_TA501(resume=args.resume),
+        'SC2501': lambda: main_SC2501(resume=args.resume),
+        'GCG2502': lambda: main_GCG2502(resume=args.resume),
+        'CH2503': lambda: main_CH2503(resume=args.resume),
+        'SF2503': lambda: main_SF2503(resume=args.resume),
+        '20_days': lambda: main_20_days_3_day_mode(args.futures, args.start, args.end, resume=args.resume),
+    }
+    if args.mode not in modes:
+        print(f"未知的实验模式{args.mode}，可选：{', '.join(modes)}")
+        exit(-1)
+    modes[args.mode]()
\ No newline at end of file
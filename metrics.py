@@ -0,0 +1,205 @@
+"""
+运行指标：各环节与子步骤的用时（span）、每个智能体的 LLM 调用延迟、tokens 与重试次数、各类数据库查询的用时
+进程内共用一个 Metrics 对象 metrics，调用 open 指定输出文件后才开始统计（未启用时各方法直接返回，不影响运行速度）
+输出格式由文件后缀决定：
+    .prom - Prometheus 文本格式，每次 flush 时重写为当前的累计值
+    其它（如 .jsonl） - JSON Lines，每个环节、每次 LLM 调用一行事件，每次 flush 时追加一行累计值 summary
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+def _escape(value):
+    """Prometheus 标签值的转义"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels) + '}'
+
+
+class Metrics:
+    """
+    指标收集
+    spans[(名称, 标签)] = [次数, 总用时（秒）, 最大用时（秒）]
+    counters[(名称, 标签)] = 累计值
+    标签为排序后的 ((键, 值), ...)；set_context 设置的回合、轮次等上下文只写入 JSONL 事件，不作为累计值的标签
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.path = None
+        self.prometheus = False
+        self.spans = {}
+        self.counters = {}
+        self.context = {}
+        self.lock = threading.Lock()
+        self._file = None
+
+    def open(self, path):
+        """
+        启用指标统计并指定输出文件（JSONL 文件以追加方式打开）
+        :param path: 输出文件，后缀 .prom 为 Prometheus 文本格式，其它为 JSONL
+        """
+        with self.lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            self.path = path
+            self.prometheus = path.endswith('.prom')
+            if not self.prometheus:
+                self._file = open(path, 'a', encoding='utf-8')
+            self.enabled = True
+        return self
+
+    def close(self):
+        """写出累计值并停止统计"""
+        self.flush()
+        with self.lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            self.enabled = False
+
+    def reset(self):
+        """清空累计值"""
+        with self.lock:
+            self.spans = {}
+            self.counters = {}
+
+    def set_context(self, **context):
+        """设置之后事件的上下文（如 round=1, turn=0），值为 None 的项被删除"""
+        with self.lock:
+            for key, value in context.items():
+                if value is None:
+                    self.context.pop(key, None)
+                else:
+                    self.context[key] = value
+
+    def _event(self, event):
+        """写入一行 JSONL 事件（调用时已持有锁）"""
+        if self._file is not None:
+            event['time'] = time.time()
+            if self.context:
+                event['context'] = dict(self.context)
+            self._file.write(json.dumps(event, ensure_ascii=False, default=str) + '\n')
+
+    def observe(self, name, seconds, event=True, **labels):
+        """
+        记录一次用时
+        :param name: 环节名称
+        :param seconds: 用时（秒）
+        :param event: 是否写入 JSONL 事件，高频的记录（如数据库查询）只统计累计值
+        :param labels: 标签，如 agent=智能体名称
+        """
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            record = self.spans.get(key)
+            if record is None:
+                self.spans[key] = [1, seconds, seconds]
+            else:
+                record[0] += 1
+                record[1] += seconds
+                if seconds > record[2]:
+                    record[2] = seconds
+            if event:
+                self._event({'type': 'span', 'name': name, 'seconds': seconds, 'labels': labels})
+
+    @contextmanager
+    def span(self, name, event=True, **labels):
+        """
+        统计代码块的用时
+            with metrics.span('deal_making'):
+                engine.deal_making(...)
+        """
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, event=event, **labels)
+
+    def inc(self, name, value=1, **labels):
+        """计数器增加 value"""
+        if not self.enabled or not value:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def record_llm(self, agent, seconds, prompt_tokens=0, completion_tokens=0, retries=0, cached=False):
+        """
+        记录一次 LLM 对话请求
+        :param agent: 智能体名称
+        :param seconds: 延迟（秒），包括失败后等待重试的时间
+        :param retries: 请求失败后的重试次数
+        :param cached: 是否命中响应缓存
+        """
+        if not self.enabled:
+            return
+        self.observe('llm.request', seconds, event=False, agent=agent, cached=cached)
+        self.inc('llm_prompt_tokens_total', prompt_tokens, agent=agent)
+        self.inc('llm_completion_tokens_total', completion_tokens, agent=agent)
+        self.inc('llm_request_retries_total', retries, agent=agent)
+        with self.lock:
+            self._event({'type': 'llm', 'agent': agent, 'seconds': seconds, 'prompt_tokens': prompt_tokens,
+                         'completion_tokens': completion_tokens, 'retries': retries, 'cached': cached})
+
+    def summary(self):
+        """当前累计值，{'spans': [...], 'counters': [...]}"""
+        with self.lock:
+            spans = [{'name': name, 'labels': dict(labels), 'count': count, 'seconds': total, 'max_seconds': maximum}
+                     for (name, labels), (count, total, maximum) in sorted(self.spans.items(), key=str)]
+            counters = [{'name': name, 'labels': dict(labels), 'value': value}
+                        for (name, labels), value in sorted(self.counters.items(), key=str)]
+        return {'spans': spans, 'counters': counters}
+
+    def prometheus_text(self):
+        """当前累计值的 Prometheus 文本格式"""
+        lines = []
+        with self.lock:
+            if self.spans:
+                lines.append('# TYPE span_seconds summary')
+                for (name, labels), (count, total, _) in sorted(self.spans.items(), key=str):
+                    label_text = _format_labels((('name', name),) + labels)
+                    lines.append(f'span_seconds_count{label_text} {count}')
+                    lines.append(f'span_seconds_sum{label_text} {total:.6f}')
+                lines.append('# TYPE span_seconds_max gauge')
+                for (name, labels), (_, _, maximum) in sorted(self.spans.items(), key=str):
+                    lines.append(f'span_seconds_max{_format_labels((("name", name),) + labels)} {maximum:.6f}')
+            counter_names = sorted({name for name, _ in self.counters})
+            for counter_name in counter_names:
+                lines.append(f'# TYPE {counter_name} counter')
+                for (name, labels), value in sorted(self.counters.items(), key=str):
+                    if name == counter_name:
+                        lines.append(f'{name}{_format_labels(labels)} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def flush(self):
+        """写出累计值（Prometheus 文件整体重写，JSONL 追加一行 summary）"""
+        if not self.enabled:
+            return
+        if self.prometheus:
+            text = self.prometheus_text()
+            with open(self.path + '.tmp', 'w', encoding='utf-8') as f:
+                f.write(text)
+            os.replace(self.path + '.tmp', self.path)
+            return
+        summary = self.summary()
+        with self.lock:
+            summary['type'] = 'summary'
+            self._event(summary)
+            self._file.flush()
+
+
+# 进程内共用的指标对象
+metrics = Metrics()
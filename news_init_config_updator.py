@@ -1,14 +1,43 @@
 """更具日期和期货种类更新初始化条件和新闻"""
 import json
 
-def news_update(futures_name, date_index, future_full_name, subfix):
+# 期货种类 -> (期货名字全称, 填充第二日和第三日的默认新闻)
+FUTURES_INFO = {
+    'SF2503': (
+        '芝加哥期货交易所大豆商品SF2503期货',
+        '芝加哥期货交易所大豆商品SF2503期货价格总体保持稳定，在小范围内保持震荡，没有异动。'
+    ),
+    'CH2503': (
+        '芝加哥期货交易所玉米商品CH2503期货',
+        '芝加哥期货交易所大豆商品CH2503期货价格总体保持稳定，在小范围内保持震荡，没有异动。'
+    ),
+    'SC2501': (
+        '上海期货交易所原油商品SC2501期货',
+        '上海期货交易所原油商品SC2501期货价格总体保持稳定，在小范围内保持震荡，没有异动。'
+    ),
+    'TA501': (
+        '郑州商品交易所精对苯二甲酸PTA商品TA501期货',
+        '郑州商品交易所精对苯二甲酸PTA商品TA501期货价格总体保持稳定，在小范围内保持震荡，没有异动。'
+    ),
+    'GCG2502': (
+        '纽约商品交易所黄金GCG2502期货',
+        '纽约商品交易所黄金GCG2502期货价格总体保持稳定，在小范围内保持震荡，没有异动。'
+    ),
+    'IH2412': (
+        '中国证券期货交易所上证50股指IH2412期货',
+        '中国证券期货交易所上证50股指IH2412期货价格总体保持稳定，在小范围内保持震荡，没有异动。'
+    ),
+}
+
+
+def build_news(futures_name, date_index, future_full_name, subfix):
     """
-    update news.txt with new price trend and nearest 2 day news
+    生成新的价格走势与最近两日新闻，不写入文件
     :param futures_name: futures_name, s.t. IH2412
     :param date_index: from 0-19
     :param future_full_name: 期货名字全称
     :param subfix: 填充第二日和第三日的默认新闻
-    :return: 0 - finish update
+    :return: str - news.txt 的内容
     """
     with open(f'PricePredictionFiles/{futures_name}_price_20.json', 'r', encoding='utf-8') as f:
         prices = json.load(f)[date_index]
@@ -36,36 +65,51 @@ def news_update(futures_name, date_index, future_full_name, subfix):
         prev_month[0] = '下跌'
         prev_month[1] = -1 * prev_month[1]
 
+    return ("{fullname:s}近一周{trend_week:s}{rate_week:.2f}%，过去5个交易日结算点数为{prev_5:s}\n"
+            "{news:s}\n"
+            "数据统计显示，{fullname:s}近一个月{trend_month:s}{rate_month:.2f}%\n"
+            "-----*****-----\n{subfix:s}\n"
+            "-----*****-----\n{subfix:s}\n-----*****-----\n").format(
+        fullname=future_full_name,
+        trend_week=prev_week[0],
+        rate_week=prev_week[1]*100,
+        prev_5=prev_5_days,
+        news=new_news,
+        trend_month=prev_month[0],
+        rate_month=prev_month[1]*100,
+        subfix=subfix
+    )
+
+
+def news_update(futures_name, date_index, future_full_name, subfix):
+    """
+    update news.txt with new price trend and nearest 2 day news
+    :param futures_name: futures_name, s.t. IH2412
+    :param date_index: from 0-19
+    :param future_full_name: 期货名字全称
+    :param subfix: 填充第二日和第三日的默认新闻
+    :return: 0 - finish update
+    """
+    new_message = build_news(futures_name, date_index, future_full_name, subfix)
     with open('news.txt', 'w', encoding='utf-8') as f:
-        new_message = ("{fullname:s}近一周{trend_week:s}{rate_week:.2f}%，过去5个交易日结算点数为{prev_5:s}\n"
-                       "{news:s}\n"
-                       "数据统计显示，{fullname:s}近一个月{trend_month:s}{rate_month:.2f}%\n"
-                       "-----*****-----\n{subfix:s}\n"
-                       "-----*****-----\n{subfix:s}\n-----*****-----\n").format(
-            fullname=future_full_name,
-            trend_week=prev_week[0],
-            rate_week=prev_week[1]*100,
-            prev_5=prev_5_days,
-            news=new_news,
-            trend_month=prev_month[0],
-            rate_month=prev_month[1]*100,
-            subfix=subfix
-        )
         f.write(new_message)
         return 0
 
 
-def init_config_update(futures_name, date:str, date_index):
+def build_init_config(futures_name, date: str, date_index, current_config=None):
     """
-    update Agent/configs/SystemInitConfig.json
+    生成某一日的系统初始化配置，不写入文件
     :param futures_name: futures_name, s.t. IH2412
     :param date: yyyy-mm-dd - str
     :param date_index: 0-19
-    :return: 0 - finish
+    :param current_config: 基础配置，None 表示读取 Agent/configs/SystemInitConfig.json
+    :return: dict - 新的配置
     """
-    with open('Agent/configs/SystemInitConfig.json', 'r', encoding='utf-8') as f:
-        current_config = json.load(f)
-    with open(f'{futures_name}_price_20.json', 'r', encoding='utf-8') as f:
+    if current_config is None:
+        with open('Agent/configs/SystemInitConfig.json', 'r', encoding='utf-8') as f:
+            current_config = json.load(f)
+    current_config = dict(current_config)
+    with open(f'PricePredictionFiles/{futures_name}_price_20.json', 'r', encoding='utf-8') as f:
         prices = json.load(f)[date_index]
 
     current_config['initial_futures_price'] = prices['prev_5_settle'][-1]
@@ -73,11 +117,23 @@ def init_config_update(futures_name, date:str, date_index):
     current_config['dbname'] = f'fin_sim_futures_{futures_name}_{date_name}'
     current_config['initial_actuals_price'] = current_config['initial_futures_price'] * 0.99
     current_config['contract_round'] = 3
+    return current_config
+
+
+def init_config_update(futures_name, date:str, date_index):
+    """
+    update Agent/configs/SystemInitConfig.json
+    :param futures_name: futures_name, s.t. IH2412
+    :param date: yyyy-mm-dd - str
+    :param date_index: 0-19
+    :return: 0 - finish
+    """
+    current_config = build_init_config(futures_name, date, date_index)
 
     with open('Agent/configs/SystemInitConfig.json', 'w', encoding='utf-8') as f:
         json.dump(current_config, f, indent=4)
 
 
 if __name__ == '__main__':
-    news_update('SF2503', 0, '芝加哥期货交易所大豆商品SF2503期货', '芝加哥期货交易所大豆商品SF2503期货价格总体保持稳定，在小范围内保持震荡，没有异动。')
+    news_update('SF2503', 0, *FUTURES_INFO['SF2503'])
     init_config_update('SF2503', '2024-11-04', 0)
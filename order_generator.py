@@ -0,0 +1,175 @@
+"""订单生成器，利用聚类得到的价格与数量参数，为一批智能体一次性生成交易请求单"""
+import json
+import os
+import threading
+
+import numpy as np
+
+# 价格描述 -> price_generator.json 中 statistics 的下标（未知描述沿用 -1，即最后一项）
+PRICE_INDEX = {
+    "极高价格": 0,
+    "极低价格": 1,
+    "更高价格": 2,
+    "更低价格": 3,
+    "略高价格": 4,
+    "略低价格": 5,
+    "当前价格": 6,
+}
+# 数量描述 -> amount_generator.json 中 avg&std 的下标，半仓与大量都偏常规交易水平
+AMOUNT_INDEX = {
+    "大量": 0,
+    "全仓": 0,
+    "半仓": 1,
+    "少量": 2,
+}
+
+# 同一份参数文件只读取一次
+_generators = {}
+_generators_lock = threading.Lock()
+
+
+def get_order_generator(price_file, amount_file, seed=None):
+    """
+    获取 (price_file, amount_file, seed) 对应的订单生成器（同一组参数只创建一个对象）
+    :return: OrderGenerator
+    """
+    key = (os.path.abspath(price_file), os.path.abspath(amount_file), seed)
+    with _generators_lock:
+        if key not in _generators:
+            _generators[key] = OrderGenerator(price_file, amount_file, seed=seed)
+        return _generators[key]
+
+
+class OrderGenerator:
+    """
+    订单生成器，每个期货合约构造一次
+    构造时读取并缓存价格参数 {'p_max', 'p_min', 'statistics'} 与数量参数 {'long', 'short'}
+    每个智能体使用独立的 np.random.Generator（由 seed 与智能体编号派生），给定 seed 时结果可复现
+    也可以由调用方传入随机数生成器（如 random_streams.RandomStreams 按回合、轮次派生的生成器），此时不使用 seed
+    价格与数量均为截断的正态分布，通过向量化的拒绝采样生成：一次为所有未被接受的订单重新采样
+    """
+
+    def __init__(self, price_file, amount_file, seed=None, orders_per_request=20):
+        """
+        :param price_file: *_price_generator.json
+        :param amount_file: *_amount_generator.json
+        :param seed: 随机种子，None 表示不固定
+        :param orders_per_request: 每个交易请求生成的订单数
+        """
+        with open(price_file, 'r', encoding='utf-8') as f:
+            price_parameters = json.load(f)
+        with open(amount_file, 'r', encoding='utf-8') as f:
+            amount_parameters = json.load(f)
+
+        self.seed = seed
+        self.orders_per_request = orders_per_request
+        self.p_max = price_parameters['p_max']
+        self.p_min = price_parameters['p_min']
+        self.price_statistics = np.asarray(price_parameters['statistics'], dtype=float)    # [j, (均值, 标准差)]
+        # amount[side] = {'avg&std': [group, j, (均值, 标准差)], 'max': [group], 'min': [group]}，side: 0 - long，1 - short
+        self.amount = []
+        for side in ('long', 'short'):
+            self.amount.append({
+                'avg&std': np.asarray(amount_parameters[side]['avg&std'], dtype=float),
+                'max': np.asarray(amount_parameters[side]['max'], dtype=float),
+                'min': np.asarray(amount_parameters[side]['min'], dtype=float),
+            })
+        self.rngs = {}  # 每个智能体的随机数生成器
+        self.lock = threading.Lock()
+
+    def rng(self, agent_id):
+        """智能体 agent_id 的随机数生成器"""
+        with self.lock:
+            if agent_id not in self.rngs:
+                if self.seed is None:
+                    self.rngs[agent_id] = np.random.default_rng()
+                else:
+                    self.rngs[agent_id] = np.random.default_rng([self.seed, agent_id])
+            return self.rngs[agent_id]
+
+    @staticmethod
+    def _truncated_normal(rng, miu, std, accept, reverse):
+        """
+        向量化拒绝采样：对每一项从 N(miu, std) 中采样，经 reverse 反归一化后，重新采样不满足 accept 的项
+        :param miu: 均值数组
+        :param std: 标准差数组
+        :return: 反归一化后的样本数组
+        """
+        result = np.empty(len(miu))
+        pending = np.arange(len(miu))
+        while len(pending):
+            samples = reverse(rng.normal(miu[pending], std[pending]), pending)
+            ok = accept(samples)
+            result[pending[ok]] = samples[ok]
+            pending = pending[~ok]
+        return result
+
+    def sample(self, rng, transaction_request, agent_id, limit, votality=True, n=None):
+        """
+        为一个交易请求生成 n 个订单的方向、价格变化率与数量
+        :return: (is_buy: bool 数组, rate: 价格变化率数组, amount: 数量数组)
+        """
+        if n is None:
+            n = self.orders_per_request
+        # 根据高斯分布生成价格变化率，超过涨跌停限制的重新生成
+        j = PRICE_INDEX.get(transaction_request["price"], -1)
+        miu = np.full(n, self.price_statistics[j][0])
+        std = np.full(n, self.price_statistics[j][1])
+        rate = self._truncated_normal(
+            rng, miu, std,
+            accept=lambda x: np.abs(x) <= limit / 100,
+            reverse=lambda x, _: self.p_max - (1 - x) * (self.p_max - self.p_min) / 2
+        )
+
+        # 25% 的概率，订单类型变更（豁免，青山，嘉能可）
+        is_buy = np.full(n, transaction_request["type"] != "卖出")
+        if votality:
+            flip = rng.random(n) > 0.75
+            is_buy ^= flip
+
+        # 根据高斯分布生成数量，小于 0 的重新生成；/30 均摊至每个回合的交易区间、代表一日
+        j = AMOUNT_INDEX.get(transaction_request["amount"], -1)
+        k = agent_id // 2    # 用户所属 group
+        side = np.where(is_buy, 0, 1)
+        params = [self.amount[0]['avg&std'][k][j], self.amount[1]['avg&std'][k][j]]
+        miu = np.array([params[s][0] for s in side])
+        std = np.array([params[s][1] for s in side])
+        a_max = np.array([self.amount[s]['max'][k] for s in (0, 1)])[side]
+        a_min = np.array([self.amount[s]['min'][k] for s in (0, 1)])[side]
+        amount = self._truncated_normal(
+            rng, miu, std,
+            accept=lambda x: x >= 0,
+            reverse=lambda x, idx: (a_max[idx] - (1 - x) * (a_max[idx] - a_min[idx])) / 30
+        )
+        return is_buy, rate, amount
+
+    def generate(self, transaction_request, agent_id, market_info, current_turn, limit, votality=True, rng=None):
+        """
+        生成一个智能体的交易请求单
+        :param transaction_request: {"type", "amount", "price"}
+        :param market_info: 市场信息，提供价格
+        :param rng: np.random.Generator，None 表示使用该智能体自己的生成器
+        :return: list - [[用户ID，下单轮次，订单类型，买入/卖出量，单位价格], ...]
+        """
+        rngs = None if rng is None else {agent_id: rng}
+        return self.generate_batch([(agent_id, transaction_request)], market_info, current_turn, limit, votality,
+                                   rngs=rngs)
+
+    def generate_batch(self, requests, market_info, current_turn, limit, votality=True, rngs=None):
+        """
+        为一批智能体生成交易请求单，结果按 requests 的顺序排列
+        :param requests: [(agent_id, transaction_request), ...]
+        :param rngs: {agent_id: np.random.Generator}，None 或缺少的智能体使用各自的生成器
+        :return: list - [[用户ID，下单轮次，订单类型，买入/卖出量，单位价格], ...]
+        """
+        Ni_price = float(market_info["current_Ni_price"])
+        returnList = []
+        for agent_id, transaction_request in requests:
+            rng = rngs.get(agent_id) if rngs else None
+            if rng is None:
+                rng = self.rng(agent_id)
+            is_buy, rate, amount = self.sample(rng, transaction_request, agent_id, limit, votality)
+            price = Ni_price * (1 + rate)
+            for b, a, p in zip(is_buy.tolist(), amount.tolist(), price.tolist()):
+                returnList.append([agent_id, current_turn, 'buy' if b else 'sell', a, p])
+        return returnList
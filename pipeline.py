@@ -0,0 +1,257 @@
+"""
+回合流水线：所有实验模式的回合都由相同的环节组成（信息收集 -> 出价与撮合 -> 结算），只在以下可替换的环节上不同
+    新闻来源 news_source：智能体分析新闻时参考的资料（专家分析 / 专家不给出意见 / 检索资料）
+    专家 expert：出价第二阶段的专家意见（专家模型 / 专家不给出意见）
+    订单生成 order_generator：出价对话与交易请求单的生成（按规则生成 / 聚类参数生成 / 无生成器）
+    撤单策略 withdraw_policy：撤单对话与撤单订单的选择（按比例随机选择 / 无生成器）
+各环节的调用次数与用时由 StageTimer 统计，同时记入 metrics（见 metrics.py）
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+from faiss_vector import get_retriever
+from metrics import metrics
+from order_generator import get_order_generator
+from utils import (generate_transactions, generate_transactions_without_generator, update_requests_after_withdraw,
+                   update_requests_after_withdraw_without_generator)
+
+
+class StageTimer:
+    """
+    环节计时，stats[环节名称] = [调用次数, 总用时（秒）]，多个线程可以同时计时（并发的对话累计各自的用时）
+    每次计时同时作为一个 span 记入 metrics，标签（如 agent、turn）只用于 metrics
+    """
+
+    def __init__(self):
+        self.stats = {}
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def __call__(self, stage, **labels):
+        """
+        统计一次调用的用时
+            with timer('deal_making'):
+                engine.deal_making(...)
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                record = self.stats.setdefault(stage, [0, 0.0])
+                record[0] += 1
+                record[1] += elapsed
+            metrics.observe(stage, elapsed, **labels)
+
+    def reset(self):
+        """清空统计，返回清空前的统计"""
+        with self.lock:
+            stats, self.stats = self.stats, {}
+        return stats
+
+    def summary(self):
+        """按总用时从高到低格式化统计结果"""
+        lines = [f"{stage}: {count}次, {seconds:.3f} s"
+                 for stage, (count, seconds) in sorted(self.stats.items(), key=lambda item: -item[1][1])]
+        return '\n'.join(lines)
+
+
+# 新闻来源
+class ExpertNews:
+    """专家模型分析新闻，智能体参考专家的分析"""
+    name = 'expert'
+
+    def observe(self, simulator, news_list):
+        """
+        为每一条新闻准备参考资料，在主线程中执行
+        news_list 中每个智能体各有一项（相同的新闻也分别分析，专家模型采样的结果互相独立）
+        :return: 与 news_list 一一对应的参考资料列表
+        """
+        return [simulator.expert.news_analysis(news) for news in news_list]
+
+    def analyze(self, agent, news, observation):
+        """智能体分析新闻（在线程中执行），返回对话轮数"""
+        return agent.news_analysis(news, observation)
+
+
+class NoExpertNews(ExpertNews):
+    """消融实验，专家不给出意见"""
+    name = 'without_expert'
+
+    def observe(self, simulator, news_list):
+        return [simulator.expert.without_expert() for _ in news_list]
+
+
+class RetrieverNews(ExpertNews):
+    """检索与新闻相关的资料（RAG），所有新闻一次批量检索"""
+    name = 'rag'
+
+    def observe(self, simulator, news_list):
+        docs_list = get_retriever(simulator.retriever_device).retrieve_batch(news_list, k=2)
+        return [docs[0] + '\n' + docs[1] for docs in docs_list]
+
+    def analyze(self, agent, news, observation):
+        return agent.news_analysis_rag(news, observation)
+
+
+# 专家
+class ExpertAdvice:
+    """专家模型评估智能体的出价策略"""
+    name = 'expert'
+
+    def advise(self, simulator, agent, strategy):
+        """出价第二阶段前的专家意见（在线程中执行）"""
+        return simulator.expert.advise_to_agent(agent.get_profile(), strategy)
+
+
+class NoExpertAdvice(ExpertAdvice):
+    """消融实验，专家不给出意见"""
+    name = 'without_expert'
+
+    def advise(self, simulator, agent, strategy):
+        return simulator.expert.without_expert()
+
+
+# 订单生成
+class RuleOrders:
+    """交易请求（价格、数量描述）由 utils.generate_transactions 按规则生成请求单，大宗商品玩家不加波动"""
+    name = 'rule'
+    major_players = ['大宗商品贸易集团', '全球性综合金属生产集团', 'NickelBuyer0']
+
+    def request_phase_1(self, agent, current_turn, attitude):
+        """确认是否参与交易（在线程中执行），返回 (对话轮数, 是否参与, 策略)"""
+        return agent.transaction_request_phase_1(current_turn=current_turn, attitude=attitude)
+
+    def request_phase_2(self, agent, expert_advise):
+        """给出交易请求（在线程中执行），返回 (对话轮数, 交易请求)"""
+        return agent.transaction_request_phase_2(expert_advise=expert_advise)
+
+    def generate(self, simulator, requests, account_infos, market_info, current_turn):
+        """
+        生成本轮次所有智能体的交易请求单，在主线程中按智能体顺序执行
+        :param requests: [(智能体, 交易请求)]
+        :param account_infos: {智能体编号: 账户信息}
+        :return: 交易请求单列表
+        """
+        transactions = []
+        for agent, transaction_request in requests:
+            transactions.extend(generate_transactions(
+                transaction_request,
+                account_infos[agent.get_id()],
+                agent.get_id(),
+                market_info,
+                current_turn,
+                simulator.security_fund_rate,
+                simulator.limit,
+                votality=agent.get_name() not in self.major_players,
+                rng=simulator.rng.generator('orders', simulator.current_round, current_turn, agent.get_id())
+            ))
+        return transactions
+
+
+class ClusteredOrders(RuleOrders):
+    """交易请求由聚类参数的 OrderGenerator 为所有智能体一次性生成请求单"""
+    name = 'clustered'
+
+    def __init__(self, price_file, amount_file):
+        """
+        :param price_file: *_price_generator.json
+        :param amount_file: *_amount_generator.json
+        """
+        self.price_file = price_file
+        self.amount_file = amount_file
+
+    def generate(self, simulator, requests, account_infos, market_info, current_turn):
+        order_generator = get_order_generator(self.price_file, self.amount_file, seed=simulator.seed)
+        return order_generator.generate_batch(
+            [(agent.get_id(), transaction_request) for agent, transaction_request in requests],
+            market_info,
+            current_turn,
+            simulator.limit,
+            votality=True,
+            rngs={agent.get_id(): simulator.rng.generator('orders', simulator.current_round, current_turn, agent.get_id())
+                  for agent, _ in requests}
+        )
+
+
+class PlainOrders(RuleOrders):
+    """消融实验，无生成器：智能体直接给出价格与数量"""
+    name = 'without_generator'
+
+    def request_phase_1(self, agent, current_turn, attitude):
+        return agent.transaction_request_phase_1_without_generator(current_turn=current_turn, attitude=attitude)
+
+    def request_phase_2(self, agent, expert_advise):
+        return agent.transaction_request_phase_2_without_generator(expert_advise=expert_advise)
+
+    def generate(self, simulator, requests, account_infos, market_info, current_turn):
+        transactions = []
+        for agent, transaction_request in requests:
+            transactions.extend(generate_transactions_without_generator(
+                transaction_request,
+                account_infos[agent.get_id()],
+                agent.get_id(),
+                market_info,
+                current_turn,
+                simulator.security_fund_rate,
+                simulator.limit
+            ))
+        return transactions
+
+
+# 撤单策略
+class RandomWithdraw:
+    """智能体给出撤单程度（少量、一半等），按比例随机选择撤销的订单"""
+    name = 'random'
+
+    def ask(self, agent, message, request_info):
+        """撮合结果通知与撤单对话（在线程中执行），返回 (对话轮数, 撤单请求)"""
+        return agent.transaction_response_and_withdraw(message=message, request_info=request_info)
+
+    def select(self, simulator, agent, failed_filtered, withdraw_requests, current_turn):
+        """选择撤销的订单，在主线程中按智能体顺序执行，返回订单编号列表"""
+        return update_requests_after_withdraw(
+            failed_filtered=failed_filtered,
+            withdraw_requests=withdraw_requests,
+            rng=simulator.rng.generator('withdraw', simulator.current_round, current_turn, agent.get_id())
+        )
+
+
+class PlainWithdraw(RandomWithdraw):
+    """消融实验，无生成器：智能体给出撤单的百分比"""
+    name = 'without_generator'
+
+    def ask(self, agent, message, request_info):
+        return agent.transaction_response_and_withdraw_without_generator(message=message, request_info=request_info)
+
+    def select(self, simulator, agent, failed_filtered, withdraw_requests, current_turn):
+        return update_requests_after_withdraw_without_generator(
+            failed_filtered=failed_filtered,
+            withdraw_requests=withdraw_requests,
+            rng=simulator.rng.generator('withdraw', simulator.current_round, current_turn, agent.get_id())
+        )
+
+
+class RoundPipeline:
+    """一个回合的流水线配置：可替换的环节与每回合的出价轮次数"""
+
+    def __init__(self, news_source=None, expert=None, order_generator=None, withdraw_policy=None, turns=5):
+        """
+        :param news_source: 新闻来源，默认 ExpertNews
+        :param expert: 专家，默认 ExpertAdvice
+        :param order_generator: 订单生成，默认 RuleOrders
+        :param withdraw_policy: 撤单策略，默认 RandomWithdraw
+        :param turns: 每回合的出价轮次数
+        """
+        self.news_source = news_source if news_source is not None else ExpertNews()
+        self.expert = expert if expert is not None else ExpertAdvice()
+        self.order_generator = order_generator if order_generator is not None else RuleOrders()
+        self.withdraw_policy = withdraw_policy if withdraw_policy is not None else RandomWithdraw()
+        self.turns = turns
+
+    def __repr__(self):
+        return (f"RoundPipeline(news_source={self.news_source.name}, expert={self.expert.name}, "
+                f"order_generator={self.order_generator.name}, withdraw_policy={self.withdraw_policy.name}, "
+                f"turns={self.turns})")
@@ -0,0 +1,38 @@
+"""随机数服务，由一个主种子为每个 (用途, 运行, 回合, 轮次, 智能体) 派生独立的 np.random.Generator，保证模拟可复现"""
+import numpy as np
+
+# 随机数的用途，作为派生键的第一项，不同用途的随机数互不影响
+PURPOSES = {
+    'orders': 0,      # 交易请求单的生成（价格、数量、方向变更）
+    'withdraw': 1,    # 撤单时选择撤销的订单
+    'news': 2,        # 新闻延迟
+}
+
+
+class RandomStreams:
+    """
+    随机数服务
+    所有随机数流都由主种子的 SeedSequence 通过 spawn_key=(用途, 运行, 回合, 轮次, 智能体) 派生：
+    同一主种子、同一派生键得到的随机数完全相同，与智能体的执行顺序、所在线程或进程无关
+    主种子为 None 时使用系统熵，entropy 记录实际使用的种子，可用于复现这一次运行
+    """
+
+    def __init__(self, seed=None, run=0):
+        """
+        :param seed: 主种子，None 表示由系统熵生成
+        :param run: 运行编号，同一主种子下的多次运行（如多日实验的不同起始日期）互不相关
+        """
+        self.entropy = np.random.SeedSequence(seed).entropy
+        self.run = run
+
+    def generator(self, purpose, round=0, turn=0, agent_id=0):
+        """
+        获取派生的随机数生成器，每次调用都返回一个从头开始的新生成器
+        :param purpose: PURPOSES 中的用途
+        :param round: 回合
+        :param turn: 回合内的出价轮次
+        :param agent_id: 智能体编号
+        :return: np.random.Generator
+        """
+        key = (PURPOSES[purpose], self.run, round, turn, agent_id)
+        return np.random.default_rng(np.random.SeedSequence(self.entropy, spawn_key=key))
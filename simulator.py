@@ -1,31 +1,73 @@
 """模拟器类，通过调用引擎和智能体，完成模拟过程"""
+import os
 import json
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
 from utils import *
-from faiss_vector import retrieve_query
+from random_streams import RandomStreams
+from metrics import metrics
+from pipeline import (StageTimer, RoundPipeline, ExpertNews, NoExpertNews, RetrieverNews, NoExpertAdvice, ClusteredOrders,
+                      PlainOrders, PlainWithdraw)
 from Agent.CFGPT import CFGPT
 
+
+def checkpointed(method):
+    """装饰器，回合正常结束（返回0）时保存检查点，见 Simulator.save_checkpoint；回合结束（包括失败）时写出指标"""
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        status = method(self, *args, **kwargs)
+        if status == 0:
+            self.save_checkpoint()
+        metrics.flush()
+        return status
+    return wrapper
+
+
 class Simulator:
     """
     模拟器类，包含期货模拟过程中的所有环节
     """
-    def __init__(self, agents: list, engine, config_file=None):
+    def __init__(self, agents: list, engine, config_file=None, configs=None):
         """
         初始化函数。一系列智能体和引擎构成模拟器
         :param agents: 智能体列表，其中的智能体必须是 Agent.players.Player 的子类
         :param engine: 引擎是引擎类
+        :param config_file: 系统配置文件，默认 ./Agent/configs/SystemInitConfig.json
+        :param configs: 系统配置字典，给定时不读取 config_file（并行运行的多个模拟各自使用内存中的配置）
         """
         self.agents = agents
         self.engine = engine
-        self.expert = CFGPT()
         self.current_round = 0
+        self.max_concurrent_agents = 8  # 并发进行LLM对话的最大智能体数，可在系统配置中修改
+        self.expert_device = 'auto'     # 专家模型所在设备，模型在第一次使用时加载
+        self.retriever_device = 'cuda:1'    # 检索编码模型所在设备，模型在第一次使用时加载
+        self.seed = None    # 主随机种子（订单生成、撤单、新闻延迟），None 表示不固定
+        self.run = 0    # 运行编号，同一主种子下不同的运行使用互不相关的随机数
+        self.checkpoint_file = None     # 检查点文件，None 表示第一个智能体日志目录下的 checkpoint_<dbname>.json
+        self.stage_timer = StageTimer()     # 回合流水线各环节的用时统计，每回合开始时清空
+        self.metrics_file = None    # 指标输出文件（.jsonl 或 .prom，见 metrics.py），None 表示不统计
+        self.share_news_analysis = False    # 收到相同新闻的智能体共用一次专家分析（不再是独立的采样），默认关闭
 
         # 其它系统配置信息
-        if config_file is None:
-            config_file = "./Agent/configs/SystemInitConfig.json"
-        with open(config_file, 'r', encoding='utf-8') as f:
-            configs = json.load(f)
+        if configs is None:
+            if config_file is None:
+                config_file = "./Agent/configs/SystemInitConfig.json"
+            with open(config_file, 'r', encoding='utf-8') as f:
+                configs = json.load(f)
         for key, value in configs.items():
             setattr(self, key, value)
+        # 随机数服务，每个 (回合, 轮次, 智能体) 使用独立的随机数流，结果与并发执行的顺序无关
+        self.rng = RandomStreams(self.seed, run=self.run)
+        if self.checkpoint_file is None:
+            # 每次运行（数据库）各有一个检查点，多日连续运行时不同的日期不会互相覆盖
+            self.checkpoint_file = os.path.join(os.path.dirname(self.agents[0].log_file),
+                                                f'checkpoint_{self.dbname}.json')
+        if self.metrics_file:
+            metrics.open(self.metrics_file)
+
+        self.expert = CFGPT(device=self.expert_device)
 
     def sync_system_setting(self):
         """同步系统设置，security_fund_rate & limit"""
@@ -48,15 +90,119 @@ class Simulator:
             self.initial_actuals_price,
             self.Ni_inventory
         )
+        self.save_checkpoint()
 
         return 0
 
+    def save_checkpoint(self):
+        """
+        保存回合边界的检查点：引擎状态（回合、最新成交价、上一回合收盘价）、数据库快照（增量更新），
+        每个智能体的对话上下文、反思与账户信息，以及所有智能体的 tokens 总用量
+        检查点先完整写入临时文件，数据库快照更新（提交）之后再替换检查点文件；
+        在两者之间中断时，resume 使用与数据库快照回合一致的临时文件
+        :return: 0
+        """
+        state = {
+            'current_round': self.current_round,
+            'engine': self.engine.checkpoint(),
+            'agents': [agent.get_state() for agent in self.agents],
+            # tokens 总用量由所有智能体共用（global_variables），通过任一智能体读写
+            'usage': list(self.agents[0].get_global_usage())
+        }
+        with open(self.checkpoint_file + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False)
+        self.engine.snapshot()
+        os.replace(self.checkpoint_file + '.tmp', self.checkpoint_file)
+        return 0
+
+    def resume(self):
+        """
+        从检查点恢复到最后一个完成的回合，代替 game_init，已经完成的回合（包括其中的LLM对话）不再重新进行
+        :return: 已经完成的回合数，即主循环中下一次调用 run_round 时的下标
+        """
+        candidates = [self.checkpoint_file]
+        if os.path.exists(self.checkpoint_file + '.tmp'):
+            # 上一次保存时数据库快照已经更新、检查点文件还没有替换
+            candidates.append(self.checkpoint_file + '.tmp')
+        for path in candidates:
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    state = json.load(f)
+            except (OSError, ValueError):
+                continue    # 检查点文件不存在，或没有写完的临时文件
+            if len(state['agents']) != len(self.agents):
+                print(f"检查点中有{len(state['agents'])}个智能体，与当前的{len(self.agents)}个智能体不一致，进程意外结束")
+                exit(-1)
+            if self.engine.resume(state['engine']) == 0:
+                break
+        else:
+            print(f"检查点{self.checkpoint_file}与数据库快照不一致，无法恢复，进程意外结束")
+            exit(-1)
+        for agent, agent_state in zip(self.agents, state['agents']):
+            agent.set_state(agent_state)
+        if 'usage' in state:
+            self.agents[0].set_global_usage(*state['usage'])
+        self.current_round = state['current_round']
+        print(f"从检查点{self.checkpoint_file}恢复，已经完成{self.current_round}个回合")
+        return self.current_round
+
     def run_round(self, news: tuple[str, str]):
         """
         游戏的第 self.current_round 回合，出现新闻 news
         :param news: （上一回合新闻，本回合新闻）
         :return: 0
         """
+        return self.run_pipeline(news, RoundPipeline())
+
+    def run_round_rag(self, news: tuple[str, str]):
+        """
+        游戏的第 self.current_round 回合，出现新闻 news，智能体参考检索到的相关资料，两轮出价
+        :param news: （上一回合新闻，本回合新闻）
+        :return: 0
+        """
+        return self.run_pipeline(news, RoundPipeline(news_source=RetrieverNews(), expert=NoExpertAdvice(), turns=2))
+
+    def run_round_without_expert(self, news: tuple[str, str]):
+        """
+        游戏的第 self.current_round 回合，出现新闻 news，专家默认回复无信息量信息，两轮出价
+        :param news: （上一回合新闻，本回合新闻）
+        :return: 0
+        """
+        return self.run_pipeline(news, RoundPipeline(news_source=NoExpertNews(), expert=NoExpertAdvice(), turns=2))
+
+    def run_round_without_generator(self, news: tuple[str, str]):
+        """
+        游戏的第 self.current_round 回合，出现新闻 news，有专家，但无生成器
+        :param news: （上一回合新闻，本回合新闻）
+        :return: 0
+        """
+        return self.run_pipeline(news, RoundPipeline(order_generator=PlainOrders(), withdraw_policy=PlainWithdraw()))
+
+    def run_round_without_expert_and_generator(self, news: tuple[str, str]):
+        """
+        游戏的第 self.current_round 回合，出现新闻 news，无专家，且无生成器
+        :param news: （上一回合新闻，本回合新闻）
+        :return: 0
+        """
+        return self.run_pipeline(news, RoundPipeline(news_source=NoExpertNews(), expert=NoExpertAdvice(),
+                                                     order_generator=PlainOrders(), withdraw_policy=PlainWithdraw()))
+
+    def run_round_new(self, news: tuple[str, str], price_file, amount_file):
+        """
+        游戏的第 self.current_round 回合，出现新闻 news，交易请求单由聚类参数生成，两轮出价
+        :param news: （上一回合新闻，本回合新闻）
+        :return: 0
+        """
+        return self.run_pipeline(news, RoundPipeline(order_generator=ClusteredOrders(price_file, amount_file), turns=2))
+
+    @checkpointed
+    def run_pipeline(self, news: tuple[str, str], pipeline: RoundPipeline):
+        """
+        按流水线 pipeline 进行游戏的第 self.current_round 回合，出现新闻 news
+        :param news: （上一回合新闻，本回合新闻）
+        :param pipeline: 回合流水线，见 pipeline.RoundPipeline
+        :return: 0 - 成功；-1 - 有智能体对话失败或结算错误
+        """
 
         # 同步回合信息
         self.current_round += 1
@@ -67,6 +213,9 @@ class Simulator:
         if self.current_round == self.contract_round + 1:
             return 0
 
+        self.stage_timer.reset()
+        metrics.set_context(round=self.current_round, turn=None)
+
         # 追加资金
         for agent in self.agents:
             self.engine.fund_supplement(agent.get_id(), agent.get_fund_supplement())
@@ -87,58 +236,30 @@ class Simulator:
             for agent in self.agents:
                 uttrs_to_be_removed[str(agent.get_id())] = agent.review_reflection()
 
-        # 回合开始
-        for agent in self.agents:
-            # 打印状态
-            print(f'\n----****----\nround {self.current_round}, agent {agent.get_name()} starts\n----****----')
-            # print(f'current context:\n{agent.get_context()}\n----****----')
-            # 智能体对新闻的分析
-            pass_list = [
-                '大宗商品贸易集团',
-                '全球性综合金属生产集团',
-                'InstitutionalProfile0',
-                'InstitutionalProfile1',
-                'InstitutionalProfile2',
-                'InstitutionalProfile3',
-            ]
-            if agent.get_name() not in pass_list:
-                # 玩家是普通玩家才会有延迟判定
-                got_news = news_delay(news)     # 新闻延迟
-            else:
-                got_news = news[-1]
-            # 专家模型对新闻的分析
-            expert_observation = self.expert.news_analysis(got_news)
-            uttrs_to_be_removed[str(agent.get_id())] += agent.news_analysis(got_news, expert_observation)
-            # 分析市场信息，生成交易前看多与看空倾向
-            for _ in range(5):
-                count, judgement_0 = agent.market_info_analysis(retrieved_market_info)
-                if count is not None:
-                    break
-            else:
-                print(f"failed in 5 times: {agent.get_name()} in round {self.current_round}. task - market info analysis.")
-                return -1
-
-            # 对话成功后
-            uttrs_to_be_removed[str(agent.get_id())] += count
-            first_judgements[str(agent.get_id())] = judgement_0['judgement']
-
-            # 同步与确认账户信息
-            account_info = self.engine.retrieve_account_info(agent.get_id())
-            agent.refresh_account_info(account_info)
-            uttrs_to_be_removed[str(agent.get_id())] += agent.account_info_confirmation()
+        # 回合开始，信息收集
+        with self.stage_timer('analysis_phase'):
+            status = self.analysis_phase(news, retrieved_market_info, first_judgements, uttrs_to_be_removed,
+                                         news_source=pipeline.news_source)
+        if status == -1:
+            return -1
 
         # 出价与交易撮合
-        temp_dict_1, succeeded_requests, failed_requests, deals = self.trade_phase(
-            first_judgements,
-            retrieved_market_info
-        )
+        with self.stage_timer('trade_phase'):
+            temp_dict_1, succeeded_requests, failed_requests, deals = self.trade_phase(
+                first_judgements,
+                retrieved_market_info,
+                pipeline
+            )
 
         # 出价与交易撮合过程中出错
         if temp_dict_1 is None:
             return -1
 
         # 回合结束，账户结算，与本轮策略保存，用于下一回合
-        temp_dict_2 = self.settlement_phase()
+        with self.stage_timer('settlement_phase'):
+            temp_dict_2 = self.settlement_phase()
+        if temp_dict_2 is None:
+            return -1
 
         # 计数，并删除提示词
         for agent in self.agents:
@@ -154,124 +275,145 @@ class Simulator:
                 f"已使用 tokens: prompt - {prompt}; completion - {completion} \n"
                 f"--------------------------\n"
             )
+        print(
+            f"\n----------time----------\n"
+            f"第{self.current_round}回合各环节用时，{pipeline}:\n"
+            f"{self.stage_timer.summary()}\n"
+            f"------------------------\n"
+        )
 
         return 0
 
-    def run_round_rag(self, news: tuple[str, str]):
+    def _gather_agents(self, fn, agents=None):
         """
-        游戏的第 self.current_round 回合，出现新闻 news
-        :param news: （上一回合新闻，本回合新闻）
-        :return: 0
+        并发执行每个智能体的阻塞调用（LLM对话），同时运行的智能体数不超过 self.max_concurrent_agents
+        引擎（数据库）操作与随机数生成不在这里执行，仍由主线程按智能体顺序完成，保证结果可复现
+        :param fn: fn(agent) -> 结果，在线程池中执行
+        :param agents: 智能体列表，默认为全部智能体
+        :return: list，结果顺序与 agents 一致
         """
+        if agents is None:
+            agents = self.agents
 
-        # 同步回合信息
-        self.current_round += 1
-        assert self.engine.round_end() == self.current_round, "Engine round number is out of sync"
-        for agent in self.agents:
-            assert agent.round_end() == self.current_round, "agent round number is out of sync"
-
-        if self.current_round == self.contract_round + 1:
-            return 0
-
-        # 追加资金
-        for agent in self.agents:
-            self.engine.fund_supplement(agent.get_id(), agent.get_fund_supplement())
-
-        # retrieve info
-        retrieved_market_info = self.engine.retrieve_market_info()
-        # analyze news, market info
-        first_judgements = {}   # 本轮的最初态度
+        async def gather():
+            loop = asyncio.get_running_loop()
+            with ThreadPoolExecutor(max_workers=max(1, int(self.max_concurrent_agents))) as executor:
+                return await asyncio.gather(*[loop.run_in_executor(executor, fn, agent) for agent in agents])
 
-        # 对话删除计数
-        uttrs_to_be_removed = {}
-        if self.current_round == 1:
-            # 第一回合，没有上一轮策略的对话，从零开始计数
-            for agent in self.agents:
-                uttrs_to_be_removed[str(agent.get_id())] = 0
-        else:
-            # 包含上一轮的策略，从确认上一轮策略使用的对话轮数开始计数
-            for agent in self.agents:
-                uttrs_to_be_removed[str(agent.get_id())] = agent.review_reflection()
+        return asyncio.run(gather())
 
-        # 回合开始
+    def _retry(self, agent, task, fn, succeeded, attempts=5):
+        """
+        重试智能体的一步对话，直到结果满足 succeeded，重试与失败的次数记入 metrics
+        :param task: 任务名称，作为 metrics 的标签
+        :param fn: fn() -> 结果
+        :param succeeded: succeeded(结果) -> bool
+        :return: 满足条件的结果；attempts 次均失败时返回 None
+        """
+        for attempt in range(attempts):
+            result = fn()
+            if succeeded(result):
+                metrics.inc('llm_task_retries_total', attempt, agent=agent.get_name(), task=task)
+                return result
+        metrics.inc('llm_task_retries_total', attempts - 1, agent=agent.get_name(), task=task)
+        metrics.inc('llm_task_failures_total', agent=agent.get_name(), task=task)
+        return None
+
+    def analysis_phase(self, news, retrieved_market_info, first_judgements, uttrs_to_be_removed, news_source=None):
+        """
+        一回合的信息收集环节：智能体分析新闻与市场信息，同步并确认账户信息
+        新闻延迟的判定、新闻来源对新闻的分析、账户信息的检索在主线程中按智能体顺序完成
+        （每个智能体各自分析一次；share_news_analysis 为 True 时同一条新闻只分析一次），
+        各智能体的LLM对话并发进行，每一步仍保留原有的重试次数
+        :param news: （上一回合新闻，本回合新闻）
+        :param retrieved_market_info: 本回合的市场信息，所有智能体共享
+        :param first_judgements: 本轮的最初态度，在此函数中填写
+        :param uttrs_to_be_removed: 对话删除计数，在此函数中累加
+        :param news_source: 新闻来源环节，默认 pipeline.ExpertNews
+        :return: 0 - 成功；-1 - 有智能体对话失败
+        """
+        if news_source is None:
+            news_source = ExpertNews()
+        pass_list = [
+            '大宗商品贸易集团',
+            '全球性综合金属生产集团',
+            'InstitutionalProfile0',
+            'InstitutionalProfile1',
+            'InstitutionalProfile2',
+            'InstitutionalProfile3',
+        ]
+        got_news_dict = {}  # 每个智能体收到的新闻
+        account_infos = {}
+        all_account_info = self.engine.retrieve_all_account_info()
         for agent in self.agents:
-            # 打印状态
-            print(f'\n----****----\nround {self.current_round}, agent {agent.get_name()} starts\n----****----')
-            # print(f'current context:\n{agent.get_context()}\n----****----')
             # 智能体对新闻的分析
-            pass_list = [
-                '大宗商品贸易集团',
-                '全球性综合金属生产集团',
-                'InstitutionalProfile0',
-                'InstitutionalProfile1',
-                'InstitutionalProfile2',
-                'InstitutionalProfile3',
-            ]
             if agent.get_name() not in pass_list:
                 # 玩家是普通玩家才会有延迟判定
-                got_news = news_delay(news)     # 新闻延迟
+                rng = self.rng.generator('news', self.current_round, 0, agent.get_id())
+                got_news = news_delay(news, rng=rng)     # 新闻延迟
             else:
                 got_news = news[-1]
-            # 专家模型对新闻的分析
-            docs = retrieve_query(got_news)
-            docs=[]
-            rag_info = docs[0] + '\n' + docs[1]
-            uttrs_to_be_removed[str(agent.get_id())] += agent.news_analysis_rag(got_news, rag_info)
-            # 分析市场信息，生成交易前看多与看空倾向
-            for _ in range(5):
-                count, judgement_0 = agent.market_info_analysis(retrieved_market_info)
-                if count is not None:
-                    break
+            got_news_dict[str(agent.get_id())] = got_news
+            # 账户信息
+            account_infos[str(agent.get_id())] = all_account_info[agent.get_id()]
+
+        # 新闻 -> 专家分析/检索资料
+        with self.stage_timer('news_source.observe'):
+            if self.share_news_analysis:
+                distinct_news = list(dict.fromkeys(got_news_dict.values()))
+                observations = dict(zip(distinct_news, news_source.observe(self, distinct_news)))
+                news_observations = {key: observations[got_news] for key, got_news in got_news_dict.items()}
             else:
-                print(f"failed in 5 times: {agent.get_name()} in round {self.current_round}. task - market info analysis.")
-                return -1
+                news_observations = dict(zip(got_news_dict, news_source.observe(self, list(got_news_dict.values()))))
+
+        def analyze(agent):
+            """
+            单个智能体的信息收集对话（在线程中执行）
+            :return: (失败的任务名称，对话轮数，最初态度)，成功时任务名称为None
+            """
+            # 打印状态
+            print(f'\n----****----\nround {self.current_round}, agent {agent.get_name()} starts\n----****----')
+            got_news = got_news_dict[str(agent.get_id())]
+            with self.stage_timer('news_source.analyze', agent=agent.get_name()):
+                uttrs = news_source.analyze(agent, got_news, news_observations[str(agent.get_id())])
+            # 分析市场信息，生成交易前看多与看空倾向
+            with self.stage_timer('market_info_analysis', agent=agent.get_name()):
+                result = self._retry(
+                    agent, 'market info analysis',
+                    lambda: agent.market_info_analysis(retrieved_market_info),
+                    lambda result: result is not None and result[0] is not None
+                )
+            if result is None:
+                return "market info analysis", uttrs, None
+            count, judgement_0 = result
 
             # 对话成功后
-            uttrs_to_be_removed[str(agent.get_id())] += count
-            first_judgements[str(agent.get_id())] = judgement_0['judgement']
+            uttrs += count
 
             # 同步与确认账户信息
-            account_info = self.engine.retrieve_account_info(agent.get_id())
-            agent.refresh_account_info(account_info)
-            uttrs_to_be_removed[str(agent.get_id())] += agent.account_info_confirmation()
-
-        # 出价与交易撮合
-        temp_dict_1, succeeded_requests, failed_requests, deals = self.trade_phase_without_expert(
-            first_judgements,
-            retrieved_market_info
-        )
-
-        # 出价与交易撮合过程中出错
-        if temp_dict_1 is None:
-            return -1
-
-        # 回合结束，账户结算，与本轮策略保存，用于下一回合
-        temp_dict_2 = self.settlement_phase()
-
-        # 计数，并删除提示词
-        for agent in self.agents:
-            key = str(agent.get_id())
-            uttrs_to_be_removed[key] += temp_dict_1[key]
-            uttrs_to_be_removed[key] += temp_dict_2[key]
-            agent.remove_agent_context(
-                beginning=-1*uttrs_to_be_removed[key],
-            )
-            prompt, completion = agent.get_usage()
-            print(
-                f"\n----------tokens----------\n"
-                f"已使用 tokens: prompt - {prompt}; completion - {completion} \n"
-                f"--------------------------\n"
-            )
-
+            agent.refresh_account_info(account_infos[str(agent.get_id())])
+            uttrs += agent.account_info_confirmation()
+            return None, uttrs, judgement_0['judgement']
+
+        results = self._gather_agents(analyze)
+        for agent, (failed_task, count, judgement) in zip(self.agents, results):
+            if failed_task is not None:
+                print(f"failed in 5 times: {agent.get_name()} in round {self.current_round}. task - {failed_task}.")
+                return -1
+            uttrs_to_be_removed[str(agent.get_id())] += count
+            first_judgements[str(agent.get_id())] = judgement
         return 0
 
-    def trade_phase(self, first_judgements, market_info):
+    def trade_phase(self, first_judgements, market_info, pipeline=None):
         """
-        在一回合的信息收集环节结束后，开始五轮出价
-        :return: 五轮结束后所有成交的和没有成交的订单
+        在一回合的信息收集环节结束后，开始 pipeline.turns 轮出价
+        每一轮中，所有智能体的出价对话与撤单对话并发进行，交易请求按智能体顺序汇总后再统一撮合
+        :param pipeline: 回合流水线，默认 RoundPipeline()（专家、按规则生成订单、五轮出价）
+        :return: 所有轮次结束后的对话删除计数，最后一轮成交的和没有成交的订单，达成的交易单
         """
-        # 交易请求列表
-        all_requests = []
+        if pipeline is None:
+            pipeline = RoundPipeline()
+        timer = self.stage_timer
         # 撮合后成功的请求，失败的请求，达成的交易单
         succeeded_requests, failed_requests, deals = [], [], []
 
@@ -280,87 +422,101 @@ class Simulator:
         for agent in self.agents:
             uttrs_to_be_removed[str(agent.get_id())] = 0
 
-        # 5 rounds
-        for i in range(5):
+        for i in range(pipeline.turns):
+            metrics.set_context(turn=i)
+            turn_start = time.perf_counter()
             # 发起请求
-            new_transactions = []
             last_turn_to_be_removed = {}
+            account_infos = {}
+            all_account_info = self.engine.retrieve_all_account_info()
             for agent in self.agents:
                 last_turn_to_be_removed[str(agent.get_id())] = uttrs_to_be_removed[str(agent.get_id())]
                 # 同步账户信息
-                account_info = self.engine.retrieve_account_info(agent.get_id())
+                account_info = all_account_info[agent.get_id()]
                 agent.refresh_account_info(account_info)
-
+                account_infos[agent.get_id()] = account_info
+
+            def request_transaction(agent):
+                """
+                确认是否参与交易，参与时请求专家意见并给出交易请求（在线程中执行）
+                :return: (失败的任务名称，对话轮数，交易请求)，成功时任务名称为None，不参与交易时交易请求为None
+                """
+                uttrs = 0
+                name = agent.get_name()
                 # 确认是否参与交易
-                for _ in range(5):
-                    count, anticipation, strategy = agent.transaction_request_phase_1(
-                        current_turn=i,
-                        attitude=first_judgements[str(agent.get_id())]
+                with timer('order_generator.request', agent=name):
+                    result = self._retry(
+                        agent, 'transaction request 1',
+                        lambda: pipeline.order_generator.request_phase_1(
+                            agent,
+                            current_turn=i,
+                            attitude=first_judgements[str(agent.get_id())]
+                        ),
+                        lambda result: result[0] is not None
                     )
-                    if count is not None:
-                        break
-                else:
-                    print(f"failed in 5 times: {agent.get_name()} in round {self.current_round}. task - transaction request 1.")
-                    return None, None, None, None
-
+                if result is None:
+                    return "transaction request 1", uttrs, None
+                count, anticipation, strategy = result
 
                 # 对话成功后
-                uttrs_to_be_removed[str(agent.get_id())] += count
+                uttrs += count
 
                 if anticipation['anticipation'] == '否':
                     # 不参与本轮交易
-                    continue
+                    return None, uttrs, None
 
                 # 进入第二阶段
-                expert_advise = self.expert.advise_to_agent(agent.get_profile(), strategy)   # 请求专家意见，使用 strategy 作为输入
-                for _ in range(5):
-                    count, transaction_request = agent.transaction_request_phase_2(
-                        expert_advise=expert_advise
+                with timer('expert.advise', agent=name):
+                    expert_advise = pipeline.expert.advise(self, agent, strategy)   # 请求专家意见，使用 strategy 作为输入
+                with timer('order_generator.request', agent=name):
+                    result = self._retry(
+                        agent, 'transaction request 2',
+                        lambda: pipeline.order_generator.request_phase_2(
+                            agent,
+                            expert_advise=expert_advise
+                        ),
+                        lambda result: result[0] is not None
                     )
-                    if count is not None:
-                        cnt = count
-                        break
-                else:
-                    print(f"failed in 5 times: {agent.get_name()} in round {self.current_round}. task - transaction request 2.")
+                if result is None:
+                    return "transaction request 2", uttrs, None
+                count, transaction_request = result
+
+                # 对话成功后
+                uttrs += count
+                return None, uttrs, transaction_request
+
+            results = self._gather_agents(request_transaction)
+            transaction_requests = []   # 本轮次参与交易的智能体与交易请求
+            for agent, (failed_task, count, transaction_request) in zip(self.agents, results):
+                if failed_task is not None:
+                    print(f"failed in 5 times: {agent.get_name()} in round {self.current_round}. task - {failed_task}.")
                     return None, None, None, None
 
                 # 对话成功后
                 uttrs_to_be_removed[str(agent.get_id())] += count
 
-                # 基于 transaction_request 生成一系列交易请求单
-                if agent.get_name() in ['大宗商品贸易集团', '全球性综合金属生产集团', 'NickelBuyer0']:
-                    transactions = generate_transactions(
-                        transaction_request,
-                        account_info,
-                        agent.get_id(),
-                        market_info,
-                        i,
-                        self.security_fund_rate,
-                        self.limit,
-                        votality=False
-                    )
-                    new_transactions.extend(transactions)
-                else:
-                    transactions = generate_transactions(
-                        transaction_request,
-                        account_info,
-                        agent.get_id(),
-                        market_info,
-                        i,
-                        self.security_fund_rate,
-                        self.limit,
-                        votality=True
-                    )
-                    new_transactions.extend(transactions)
+                if transaction_request is not None:
+                    transaction_requests.append((agent, transaction_request))
 
-            # 交易撮合 self.engine
-            succeeded_requests, failed_requests, deals = self.engine.deal_making(new_transactions)
-            # 更新 all_requests 列表，删除成功的交易
-            del all_requests
-            all_requests = copy.deepcopy(failed_requests)
+            # 基于 transaction_request 生成一系列交易请求单
+            with timer('order_generator.generate'):
+                new_transactions = pipeline.order_generator.generate(
+                    self, transaction_requests, account_infos, market_info, i
+                )
 
-            # 撮合成功与失败通知，询问是否撤单
-            for agent in self.agents:
+            # 交易撮合 self.engine
+            with timer('deal_making'):
+                succeeded_requests, failed_requests, deals = self.engine.deal_making(new_transactions)
+
+            # 请求量信息（撤单后的订单仍然计入，所以在本轮撤单前后不变）
+            buy_amount, buy_price, sell_amount, sell_price = self.engine.get_order_info()
+            request_info = (buy_amount, buy_price, sell_amount, sell_price)
+
+            def request_withdraw(agent):
+                """
+                撮合成功与失败通知，询问是否撤单（在线程中执行）
+                :return: (失败的任务名称，对话轮数，撤单请求，未成交的请求)
+                """
                 # 筛选响应，转化为通知
                 succeeded_filtered, failed_filtered = transactions_response_filter(
                     succeeded_requests,
@@ -371,32 +527,38 @@ class Simulator:
                     succeeded_filtered,
                     failed_filtered
                 )
-                # 请求量信息
-                buy_amount, buy_price, sell_amount, sell_price = self.engine.get_order_info()
-                request_info = (buy_amount, buy_price, sell_amount, sell_price)
 
                 # 生成撤单请求
-                for _ in range(5):
-                    count, withdraw_requests = agent.transaction_response_and_withdraw(
-                        message=deal_making_result_message,
-                        request_info=request_info
+                with timer('withdraw_policy.ask', agent=agent.get_name()):
+                    result = self._retry(
+                        agent, 'withdraw request',
+                        lambda: pipeline.withdraw_policy.ask(
+                            agent,
+                            message=deal_making_result_message,
+                            request_info=request_info
+                        ),
+                        lambda result: result[0] is not None
                     )
-                    if count is not None:
-                        break
-                else:
-                    print(f"failed in 5 times: {agent.get_name()} in round {self.current_round}. task - transaction request 1.")
-                    return None, None, None, None
+                if result is None:
+                    return "withdraw request", 0, None, None
+                count, withdraw_requests = result
+                return None, count, withdraw_requests, failed_filtered
 
+            # 撮合成功与失败通知，询问是否撤单
+            results = self._gather_agents(request_withdraw)
+            all_withdraws = []
+            for agent, (failed_task, count, withdraw_requests, failed_filtered) in zip(self.agents, results):
+                if failed_task is not None:
+                    print(f"failed in 5 times: {agent.get_name()} in round {self.current_round}. task - {failed_task}.")
+                    return None, None, None, None
 
                 # 对话成功后
                 uttrs_to_be_removed[str(agent.get_id())] += count
 
-                withdraws = update_requests_after_withdraw(
-                    failed_filtered=failed_filtered,
-                    withdraw_requests=withdraw_requests
-                )
-                # 引擎将撤单信息同步到数据库
-                self.engine.withdraw_requests(withdraw_requests=withdraws)
+                all_withdraws.extend(pipeline.withdraw_policy.select(self, agent, failed_filtered, withdraw_requests, i))
+            # 引擎将所有玩家的撤单信息一次性同步到数据库
+            with timer('withdraw_requests'):
+                self.engine.withdraw_requests(withdraw_requests=all_withdraws)
 
             # 轮次结束后，删除上一轮次对话上下文
             for agent in self.agents:
@@ -405,7 +567,9 @@ class Simulator:
                     -1 * (uttrs_to_be_removed[str(agent.get_id())]-last_turn_to_be_removed[str(agent.get_id())])
                 )
                 uttrs_to_be_removed[str(agent.get_id())] -= last_turn_to_be_removed[str(agent.get_id())]
+            metrics.observe('trade_turn', time.perf_counter() - turn_start)
 
+        metrics.set_context(turn=None)
         return uttrs_to_be_removed, succeeded_requests, failed_requests, deals
 
     def settlement_phase(self):
@@ -419,976 +583,19 @@ class Simulator:
             uttrs_to_be_removed[str(agent.get_id())] = 0
 
         # 账户重新结算，计算最新价格，刷新账户资产，计算平仓问题
-        avg_price = self.engine.settlement_of_round()
+        with self.stage_timer('settlement_of_round'):
+            avg_price = self.engine.settlement_of_round()
 
         if avg_price < 0:
             # 结算错误
             return None
 
         # 智能体更新账户资产，并保存这一轮次的策略，用于下一轮次的提示词
+        all_account_info = self.engine.retrieve_all_account_info()
         for agent in self.agents:
-            account_info = self.engine.retrieve_account_info(agent.get_id())
+            account_info = all_account_info[agent.get_id()]
             agent.refresh_account_info(account_info)
-            uttrs_to_be_removed[str(agent.get_id())] = agent.current_round_strategy_reflection()
+            with self.stage_timer('strategy_reflection', agent=agent.get_name()):
+                uttrs_to_be_removed[str(agent.get_id())] = agent.current_round_strategy_reflection()
 
         return uttrs_to_be_removed
-
-    def run_round_without_expert(self, news: tuple[str, str]):
-        """
-        游戏的第 self.current_round 回合，出现新闻 news，专家默认回复无信息量信息
-        :param news: （上一回合新闻，本回合新闻）
-        :return: 0
-        """
-
-        # 同步回合信息
-        self.current_round += 1
-        assert self.engine.round_end() == self.current_round, "Engine round number is out of sync"
-        for agent in self.agents:
-            assert agent.round_end() == self.current_round, "agent round number is out of sync"
-
-        if self.current_round == self.contract_round + 1:
-            return 0
-
-        # 追加资金
-        for agent in self.agents:
-            self.engine.fund_supplement(agent.get_id(), agent.get_fund_supplement())
-
-        # retrieve info
-        retrieved_market_info = self.engine.retrieve_market_info()
-        # analyze news, market info
-        first_judgements = {}   # 本轮的最初态度
-
-        # 对话删除计数
-        uttrs_to_be_removed = {}
-        if self.current_round == 1:
-            # 第一回合，没有上一轮策略的对话，从零开始计数
-            for agent in self.agents:
-                uttrs_to_be_removed[str(agent.get_id())] = 0
-        else:
-            # 包含上一轮的策略，从确认上一轮策略使用的对话轮数开始计数
-            for agent in self.agents:
-                uttrs_to_be_removed[str(agent.get_id())] = agent.review_reflection()
-
-        # 回合开始
-        for agent in self.agents:
-            # 打印状态
-            print(f'\n----****----\nround {self.current_round}, agent {agent.get_name()} starts\n----****----')
-            # print(f'current context:\n{agent.get_context()}\n----****----')
-            # 智能体对新闻的分析
-            pass_list = [
-                '大宗商品贸易集团',
-                '全球性综合金属生产集团',
-                'InstitutionalProfile0',
-                'InstitutionalProfile1',
-                'InstitutionalProfile2',
-                'InstitutionalProfile3',
-            ]
-            if agent.get_name() not in pass_list:
-                # 玩家是普通玩家才会有延迟判定
-                got_news = news_delay(news)     # 新闻延迟
-            else:
-                got_news = news[-1]
-            # 专家模型对新闻的分析
-            expert_observation = self.expert.without_expert()
-            uttrs_to_be_removed[str(agent.get_id())] += agent.news_analysis(got_news, expert_observation)
-            # 分析市场信息，生成交易前看多与看空倾向
-            for _ in range(5):
-                count, judgement_0 = agent.market_info_analysis(retrieved_market_info)
-                if count is not None:
-                    break
-            else:
-                print(f"failed in 5 times: {agent.get_name()} in round {self.current_round}. task - market info analysis.")
-                return -1
-
-            # 对话成功后
-            uttrs_to_be_removed[str(agent.get_id())] += count
-            first_judgements[str(agent.get_id())] = judgement_0['judgement']
-
-            # 同步与确认账户信息
-            account_info = self.engine.retrieve_account_info(agent.get_id())
-            agent.refresh_account_info(account_info)
-            uttrs_to_be_removed[str(agent.get_id())] += agent.account_info_confirmation()
-
-        # 出价与交易撮合
-        temp_dict_1, succeeded_requests, failed_requests, deals = self.trade_phase_without_expert(
-            first_judgements,
-            retrieved_market_info
-        )
-
-        # 出价与交易撮合过程中出错
-        if temp_dict_1 is None:
-            return -1
-
-        # 回合结束，账户结算，与本轮策略保存，用于下一回合
-        temp_dict_2 = self.settlement_phase()
-
-        # 计数，并删除提示词
-        for agent in self.agents:
-            key = str(agent.get_id())
-            uttrs_to_be_removed[key] += temp_dict_1[key]
-            uttrs_to_be_removed[key] += temp_dict_2[key]
-            agent.remove_agent_context(
-                beginning=-1*uttrs_to_be_removed[key],
-            )
-            prompt, completion = agent.get_usage()
-            print(
-                f"\n----------tokens----------\n"
-                f"已使用 tokens: prompt - {prompt}; completion - {completion} \n"
-                f"--------------------------\n"
-            )
-
-        return 0
-
-    def trade_phase_without_expert(self, first_judgements, market_info):
-        """
-        在一回合的信息收集环节结束后，开始五轮出价，专家默认回复无信息量信息
-        :return: 五轮结束后所有成交的和没有成交的订单
-        """
-        # 交易请求列表
-        all_requests = []
-        # 撮合后成功的请求，失败的请求，达成的交易单
-        succeeded_requests, failed_requests, deals = [], [], []
-
-        # 对话删除计数
-        uttrs_to_be_removed = {}
-        for agent in self.agents:
-            uttrs_to_be_removed[str(agent.get_id())] = 0
-
-        # 2 rounds
-        for i in range(2):
-            # 发起请求
-            new_transactions = []
-            last_turn_to_be_removed = {}
-            for agent in self.agents:
-                last_turn_to_be_removed[str(agent.get_id())] = uttrs_to_be_removed[str(agent.get_id())]
-                # 同步账户信息
-                account_info = self.engine.retrieve_account_info(agent.get_id())
-                agent.refresh_account_info(account_info)
-
-                # 确认是否参与交易
-                for _ in range(5):
-                    count, anticipation, strategy = agent.transaction_request_phase_1(
-                        current_turn=i,
-                        attitude=first_judgements[str(agent.get_id())]
-                    )
-                    if count is not None:
-                        break
-                else:
-                    print(f"failed in 5 times: {agent.get_name()} in round {self.current_round}. task - transaction request 1.")
-                    return None, None, None, None
-
-
-                # 对话成功后
-                uttrs_to_be_removed[str(agent.get_id())] += count
-
-                if anticipation['anticipation'] == '否':
-                    # 不参与本轮交易
-                    continue
-
-                # 进入第二阶段
-                expert_advise = self.expert.without_expert()   # 请求专家意见，使用 strategy 作为输入
-                for _ in range(5):
-                    count, transaction_request = agent.transaction_request_phase_2(
-                        expert_advise=expert_advise
-                    )
-                    if count is not None:
-                        cnt = count
-                        break
-                else:
-                    print(f"failed in 5 times: {agent.get_name()} in round {self.current_round}. task - transaction request 2.")
-                    return None, None, None, None
-
-                # 对话成功后
-                uttrs_to_be_removed[str(agent.get_id())] += count
-
-                # 基于 transaction_request 生成一系列交易请求单
-                if agent.get_name() in ['大宗商品贸易集团', '全球性综合金属生产集团', 'NickelBuyer0']:
-                    transactions = generate_transactions(
-                        transaction_request,
-                        account_info,
-                        agent.get_id(),
-                        market_info,
-                        i,
-                        self.security_fund_rate,
-                        self.limit,
-                        votality=False
-                    )
-                    new_transactions.extend(transactions)
-                else:
-                    transactions = generate_transactions(
-                        transaction_request,
-                        account_info,
-                        agent.get_id(),
-                        market_info,
-                        i,
-                        self.security_fund_rate,
-                        self.limit,
-                        votality=True
-                    )
-                    new_transactions.extend(transactions)
-
-            # 交易撮合 self.engine
-            succeeded_requests, failed_requests, deals = self.engine.deal_making(new_transactions)
-            # 更新 all_requests 列表，删除成功的交易
-            del all_requests
-            all_requests = copy.deepcopy(failed_requests)
-
-            # 撮合成功与失败通知，询问是否撤单
-            for agent in self.agents:
-                # 筛选响应，转化为通知
-                succeeded_filtered, failed_filtered = transactions_response_filter(
-                    succeeded_requests,
-                    failed_requests,
-                    agent.get_id()
-                )
-                deal_making_result_message = filtered_transactions_formatter(
-                    succeeded_filtered,
-                    failed_filtered
-                )
-                # 请求量信息
-                buy_amount, buy_price, sell_amount, sell_price = self.engine.get_order_info()
-                request_info = (buy_amount, buy_price, sell_amount, sell_price)
-
-                # 生成撤单请求
-                for _ in range(5):
-                    count, withdraw_requests = agent.transaction_response_and_withdraw(
-                        message=deal_making_result_message,
-                        request_info=request_info
-                    )
-                    if count is not None:
-                        break
-                else:
-                    print(f"failed in 5 times: {agent.get_name()} in round {self.current_round}. task - transaction request 1.")
-                    return None, None, None, None
-
-
-                # 对话成功后
-                uttrs_to_be_removed[str(agent.get_id())] += count
-
-                withdraws = update_requests_after_withdraw(
-                    failed_filtered=failed_filtered,
-                    withdraw_requests=withdraw_requests
-                )
-                # 引擎将撤单信息同步到数据库
-                self.engine.withdraw_requests(withdraw_requests=withdraws)
-
-            # 轮次结束后，删除上一轮次对话上下文
-            for agent in self.agents:
-                agent.remove_agent_context(
-                    -1 * (uttrs_to_be_removed[str(agent.get_id())]),
-                    -1 * (uttrs_to_be_removed[str(agent.get_id())]-last_turn_to_be_removed[str(agent.get_id())])
-                )
-                uttrs_to_be_removed[str(agent.get_id())] -= last_turn_to_be_removed[str(agent.get_id())]
-
-        return uttrs_to_be_removed, succeeded_requests, failed_requests, deals
-
-    def run_round_without_generator(self, news: tuple[str, str]):
-        """
-            游戏的第 self.current_round 回合，出现新闻 news，有专家，但无生成器
-            :param news: （上一回合新闻，本回合新闻）
-            :return: 0
-            """
-
-        # 同步回合信息
-        self.current_round += 1
-        assert self.engine.round_end() == self.current_round, "Engine round number is out of sync"
-        for agent in self.agents:
-            assert agent.round_end() == self.current_round, "agent round number is out of sync"
-
-        if self.current_round == self.contract_round + 1:
-            return 0
-
-        # 追加资金
-        for agent in self.agents:
-            self.engine.fund_supplement(agent.get_id(), agent.get_fund_supplement())
-
-        # retrieve info
-        retrieved_market_info = self.engine.retrieve_market_info()
-        # analyze news, market info
-        first_judgements = {}   # 本轮的最初态度
-
-        # 对话删除计数
-        uttrs_to_be_removed = {}
-        if self.current_round == 1:
-            # 第一回合，没有上一轮策略的对话，从零开始计数
-            for agent in self.agents:
-                uttrs_to_be_removed[str(agent.get_id())] = 0
-        else:
-            # 包含上一轮的策略，从确认上一轮策略使用的对话轮数开始计数
-            for agent in self.agents:
-                uttrs_to_be_removed[str(agent.get_id())] = agent.review_reflection()
-
-        # 回合开始
-        for agent in self.agents:
-            # 打印状态
-            print(f'\n----****----\nround {self.current_round}, agent {agent.get_name()} starts\n----****----')
-            # print(f'current context:\n{agent.get_context()}\n----****----')
-            # 智能体对新闻的分析
-            pass_list = [
-                '大宗商品贸易集团',
-                '全球性综合金属生产集团',
-                'InstitutionalProfile0',
-                'InstitutionalProfile1',
-                'InstitutionalProfile2',
-                'InstitutionalProfile3',
-            ]
-            if agent.get_name() not in pass_list:
-                # 玩家是普通玩家才会有延迟判定
-                got_news = news_delay(news)     # 新闻延迟
-            else:
-                got_news = news[-1]
-            # 专家模型对新闻的分析
-            expert_observation = self.expert.news_analysis(got_news)
-            uttrs_to_be_removed[str(agent.get_id())] += agent.news_analysis(got_news, expert_observation)
-            # 分析市场信息，生成交易前看多与看空倾向
-            for _ in range(5):
-                count, judgement_0 = agent.market_info_analysis(retrieved_market_info)
-                if count is not None:
-                    break
-            else:
-                print(f"failed in 5 times: {agent.get_name()} in round {self.current_round}. task - market info analysis.")
-                return -1
-
-            # 对话成功后
-            uttrs_to_be_removed[str(agent.get_id())] += count
-            first_judgements[str(agent.get_id())] = judgement_0['judgement']
-
-            # 同步与确认账户信息
-            account_info = self.engine.retrieve_account_info(agent.get_id())
-            agent.refresh_account_info(account_info)
-            uttrs_to_be_removed[str(agent.get_id())] += agent.account_info_confirmation()
-
-
-        # 出价与交易撮合
-        temp_dict_1, succeeded_requests, failed_requests, deals = self.trade_phase_without_generator(
-            first_judgements,
-            retrieved_market_info
-        )
-
-        # 出价与交易撮合过程中出错
-        if temp_dict_1 is None:
-            return -1
-
-        # 回合结束，账户结算，与本轮策略保存，用于下一回合
-        temp_dict_2 = self.settlement_phase()
-
-        # 计数，并删除提示词
-        for agent in self.agents:
-            key = str(agent.get_id())
-            uttrs_to_be_removed[key] += temp_dict_1[key]
-            uttrs_to_be_removed[key] += temp_dict_2[key]
-            agent.remove_agent_context(
-                beginning=-1*uttrs_to_be_removed[key],
-            )
-            prompt, completion = agent.get_usage()
-            print(
-                f"\n----------tokens----------\n"
-                f"已使用 tokens: prompt - {prompt}; completion - {completion} \n"
-                f"--------------------------\n"
-            )
-
-        return 0
-
-    def trade_phase_without_generator(self, first_judgements, market_info):
-        """
-        在一回合的信息收集环节结束后，开始五轮出价，有专家，但无生成器
-        :return: 五轮结束后所有成交的和没有成交的订单
-        """
-        # 交易请求列表
-        all_requests = []
-        # 撮合后成功的请求，失败的请求，达成的交易单
-        succeeded_requests, failed_requests, deals = [], [], []
-
-        # 对话删除计数
-        uttrs_to_be_removed = {}
-        for agent in self.agents:
-            uttrs_to_be_removed[str(agent.get_id())] = 0
-
-        # 5 rounds
-        for i in range(5):
-            # 发起请求
-            new_transactions = []
-            last_turn_to_be_removed = {}
-            for agent in self.agents:
-                last_turn_to_be_removed[str(agent.get_id())] = uttrs_to_be_removed[str(agent.get_id())]
-                # 同步账户信息
-                account_info = self.engine.retrieve_account_info(agent.get_id())
-                agent.refresh_account_info(account_info)
-
-                # 确认是否参与交易
-                for _ in range(5):
-                    count, anticipation, strategy = agent.transaction_request_phase_1_without_generator(
-                        current_turn=i,
-                        attitude=first_judgements[str(agent.get_id())]
-                    )
-                    if count is not None:
-                        break
-                else:
-                    print(f"failed in 5 times: {agent.get_name()} in round {self.current_round}. task - transaction request 1.")
-                    return None, None, None, None
-
-
-                # 对话成功后
-                uttrs_to_be_removed[str(agent.get_id())] += count
-
-                if anticipation['anticipation'] == '否':
-                    # 不参与本轮交易
-                    continue
-
-                # 进入第二阶段
-                expert_advise = self.expert.advise_to_agent(agent.get_profile(), strategy)   # 请求专家意见，使用 strategy 作为输入
-                for _ in range(5):
-                    count, transaction_request = agent.transaction_request_phase_2_without_generator(
-                        expert_advise=expert_advise
-                    )
-                    if count is not None:
-                        cnt = count
-                        break
-                else:
-                    print(f"failed in 5 times: {agent.get_name()} in round {self.current_round}. task - transaction request 2.")
-                    return None, None, None, None
-
-                # 对话成功后
-                uttrs_to_be_removed[str(agent.get_id())] += count
-
-                # 基于 transaction_request 生成一系列交易请求单
-                transactions = generate_transactions_without_generator(
-                    transaction_request,
-                    account_info,
-                    agent.get_id(),
-                    market_info,
-                    i,
-                    self.security_fund_rate,
-                    self.limit
-                )
-                new_transactions.extend(transactions)
-
-            # 交易撮合 self.engine
-            succeeded_requests, failed_requests, deals = self.engine.deal_making(new_transactions)
-            # 更新 all_requests 列表，删除成功的交易
-            del all_requests
-            all_requests = copy.deepcopy(failed_requests)
-
-            # 撮合成功与失败通知，询问是否撤单
-            for agent in self.agents:
-                # 筛选响应，转化为通知
-                succeeded_filtered, failed_filtered = transactions_response_filter(
-                    succeeded_requests,
-                    failed_requests,
-                    agent.get_id()
-                )
-                deal_making_result_message = filtered_transactions_formatter(
-                    succeeded_filtered,
-                    failed_filtered
-                )
-                # 请求量信息
-                buy_amount, buy_price, sell_amount, sell_price = self.engine.get_order_info()
-                request_info = (buy_amount, buy_price, sell_amount, sell_price)
-
-                # 生成撤单请求
-                for _ in range(5):
-                    count, withdraw_requests = agent.transaction_response_and_withdraw_without_generator(
-                        message=deal_making_result_message,
-                        request_info=request_info
-                    )
-                    if count is not None:
-                        break
-                else:
-                    print(f"failed in 5 times: {agent.get_name()} in round {self.current_round}. task - transaction request 1.")
-                    return None, None, None, None
-
-
-                # 对话成功后
-                uttrs_to_be_removed[str(agent.get_id())] += count
-
-                withdraws = update_requests_after_withdraw_without_generator(
-                    failed_filtered=failed_filtered,
-                    withdraw_requests=withdraw_requests
-                )
-                # 引擎将撤单信息同步到数据库
-                self.engine.withdraw_requests(withdraw_requests=withdraws)
-
-            # 轮次结束后，删除上一轮次对话上下文
-            for agent in self.agents:
-                agent.remove_agent_context(
-                    -1 * (uttrs_to_be_removed[str(agent.get_id())]),
-                    -1 * (uttrs_to_be_removed[str(agent.get_id())]-last_turn_to_be_removed[str(agent.get_id())])
-                )
-                uttrs_to_be_removed[str(agent.get_id())] -= last_turn_to_be_removed[str(agent.get_id())]
-
-        return uttrs_to_be_removed, succeeded_requests, failed_requests, deals
-
-    def run_round_without_expert_and_generator(self, news: tuple[str, str]):
-        """
-            游戏的第 self.current_round 回合，出现新闻 news，无专家，且无生成器
-            :param news: （上一回合新闻，本回合新闻）
-            :return: 0
-            """
-
-        # 同步回合信息
-        self.current_round += 1
-        assert self.engine.round_end() == self.current_round, "Engine round number is out of sync"
-        for agent in self.agents:
-            assert agent.round_end() == self.current_round, "agent round number is out of sync"
-
-        if self.current_round == self.contract_round + 1:
-            return 0
-
-        # 追加资金
-        for agent in self.agents:
-            self.engine.fund_supplement(agent.get_id(), agent.get_fund_supplement())
-
-        # retrieve info
-        retrieved_market_info = self.engine.retrieve_market_info()
-        # analyze news, market info
-        first_judgements = {}   # 本轮的最初态度
-
-        # 对话删除计数
-        uttrs_to_be_removed = {}
-        if self.current_round == 1:
-            # 第一回合，没有上一轮策略的对话，从零开始计数
-            for agent in self.agents:
-                uttrs_to_be_removed[str(agent.get_id())] = 0
-        else:
-            # 包含上一轮的策略，从确认上一轮策略使用的对话轮数开始计数
-            for agent in self.agents:
-                uttrs_to_be_removed[str(agent.get_id())] = agent.review_reflection()
-
-        # 回合开始
-        for agent in self.agents:
-            # 打印状态
-            print(f'\n----****----\nround {self.current_round}, agent {agent.get_name()} starts\n----****----')
-            # print(f'current context:\n{agent.get_context()}\n----****----')
-            # 智能体对新闻的分析
-            pass_list = [
-                '大宗商品贸易集团',
-                '全球性综合金属生产集团',
-                'InstitutionalProfile0',
-                'InstitutionalProfile1',
-                'InstitutionalProfile2',
-                'InstitutionalProfile3',
-            ]
-            if agent.get_name() not in pass_list:
-                # 玩家是普通玩家才会有延迟判定
-                got_news = news_delay(news)     # 新闻延迟
-            else:
-                got_news = news[-1]
-            # 专家模型对新闻的分析
-            expert_observation = self.expert.without_expert()
-            uttrs_to_be_removed[str(agent.get_id())] += agent.news_analysis(got_news, expert_observation)
-            # 分析市场信息，生成交易前看多与看空倾向
-            for _ in range(5):
-                count, judgement_0 = agent.market_info_analysis(retrieved_market_info)
-                if count is not None:
-                    break
-            else:
-                print(f"failed in 5 times: {agent.get_name()} in round {self.current_round}. task - market info analysis.")
-                return -1
-
-            # 对话成功后
-            uttrs_to_be_removed[str(agent.get_id())] += count
-            first_judgements[str(agent.get_id())] = judgement_0['judgement']
-
-            # 同步与确认账户信息
-            account_info = self.engine.retrieve_account_info(agent.get_id())
-            agent.refresh_account_info(account_info)
-            uttrs_to_be_removed[str(agent.get_id())] += agent.account_info_confirmation()
-
-        # 出价与交易撮合
-        temp_dict_1, succeeded_requests, failed_requests, deals = self.trade_phase_without_generator(
-            first_judgements,
-            retrieved_market_info
-        )
-
-        # 出价与交易撮合过程中出错
-        if temp_dict_1 is None:
-            return -1
-
-        # 回合结束，账户结算，与本轮策略保存，用于下一回合
-        temp_dict_2 = self.settlement_phase()
-
-        # 计数，并删除提示词
-        for agent in self.agents:
-            key = str(agent.get_id())
-            uttrs_to_be_removed[key] += temp_dict_1[key]
-            uttrs_to_be_removed[key] += temp_dict_2[key]
-            agent.remove_agent_context(
-                beginning=-1*uttrs_to_be_removed[key],
-            )
-            prompt, completion = agent.get_usage()
-            print(
-                f"\n----------tokens----------\n"
-                f"已使用 tokens: prompt - {prompt}; completion - {completion} \n"
-                f"--------------------------\n"
-            )
-
-        return 0
-
-    def trade_phase_without_expert_and_generator(self, first_judgements, market_info):
-        """
-        在一回合的信息收集环节结束后，开始五轮出价，无专家，且无生成器
-        :return: 五轮结束后所有成交的和没有成交的订单
-        """
-        # 交易请求列表
-        all_requests = []
-        # 撮合后成功的请求，失败的请求，达成的交易单
-        succeeded_requests, failed_requests, deals = [], [], []
-
-        # 对话删除计数
-        uttrs_to_be_removed = {}
-        for agent in self.agents:
-            uttrs_to_be_removed[str(agent.get_id())] = 0
-
-        # 5 rounds
-        for i in range(5):
-            # 发起请求
-            new_transactions = []
-            last_turn_to_be_removed = {}
-            for agent in self.agents:
-                last_turn_to_be_removed[str(agent.get_id())] = uttrs_to_be_removed[str(agent.get_id())]
-                # 同步账户信息
-                account_info = self.engine.retrieve_account_info(agent.get_id())
-                agent.refresh_account_info(account_info)
-
-                # 确认是否参与交易
-                for _ in range(5):
-                    count, anticipation, strategy = agent.transaction_request_phase_1_without_generator(
-                        current_turn=i,
-                        attitude=first_judgements[str(agent.get_id())]
-                    )
-                    if count is not None:
-                        break
-                else:
-                    print(f"failed in 5 times: {agent.get_name()} in round {self.current_round}. task - transaction request 1.")
-                    return None, None, None, None
-
-
-                # 对话成功后
-                uttrs_to_be_removed[str(agent.get_id())] += count
-
-                if anticipation['anticipation'] == '否':
-                    # 不参与本轮交易
-                    continue
-
-                # 进入第二阶段
-                expert_advise = self.expert.without_expert()   # 请求专家意见，使用 strategy 作为输入
-                for _ in range(5):
-                    count, transaction_request = agent.transaction_request_phase_2_without_generator(
-                        expert_advise=expert_advise
-                    )
-                    if count is not None:
-                        cnt = count
-                        break
-                else:
-                    print(f"failed in 5 times: {agent.get_name()} in round {self.current_round}. task - transaction request 2.")
-                    return None, None, None, None
-
-                # 对话成功后
-                uttrs_to_be_removed[str(agent.get_id())] += count
-
-                # 基于 transaction_request 生成一系列交易请求单
-                transactions = generate_transactions_without_generator(
-                    transaction_request,
-                    account_info,
-                    agent.get_id(),
-                    market_info,
-                    i,
-                    self.security_fund_rate,
-                    self.limit
-                )
-                new_transactions.extend(transactions)
-
-            # 交易撮合 self.engine
-            succeeded_requests, failed_requests, deals = self.engine.deal_making(new_transactions)
-            # 更新 all_requests 列表，删除成功的交易
-            del all_requests
-            all_requests = copy.deepcopy(failed_requests)
-
-            # 撮合成功与失败通知，询问是否撤单
-            for agent in self.agents:
-                # 筛选响应，转化为通知
-                succeeded_filtered, failed_filtered = transactions_response_filter(
-                    succeeded_requests,
-                    failed_requests,
-                    agent.get_id()
-                )
-                deal_making_result_message = filtered_transactions_formatter(
-                    succeeded_filtered,
-                    failed_filtered
-                )
-                # 请求量信息
-                buy_amount, buy_price, sell_amount, sell_price = self.engine.get_order_info()
-                request_info = (buy_amount, buy_price, sell_amount, sell_price)
-
-                # 生成撤单请求
-                for _ in range(5):
-                    count, withdraw_requests = agent.transaction_response_and_withdraw_without_generator(
-                        message=deal_making_result_message,
-                        request_info=request_info
-                    )
-                    if count is not None:
-                        break
-                else:
-                    print(f"failed in 5 times: {agent.get_name()} in round {self.current_round}. task - transaction request 1.")
-                    return None, None, None, None
-
-
-                # 对话成功后
-                uttrs_to_be_removed[str(agent.get_id())] += count
-
-                withdraws = update_requests_after_withdraw_without_generator(
-                    failed_filtered=failed_filtered,
-                    withdraw_requests=withdraw_requests
-                )
-                # 引擎将撤单信息同步到数据库
-                self.engine.withdraw_requests(withdraw_requests=withdraws)
-
-            # 轮次结束后，删除上一轮次对话上下文
-            for agent in self.agents:
-                agent.remove_agent_context(
-                    -1 * (uttrs_to_be_removed[str(agent.get_id())]),
-                    -1 * (uttrs_to_be_removed[str(agent.get_id())]-last_turn_to_be_removed[str(agent.get_id())])
-                )
-                uttrs_to_be_removed[str(agent.get_id())] -= last_turn_to_be_removed[str(agent.get_id())]
-
-        return uttrs_to_be_removed, succeeded_requests, failed_requests, deals
-
-    def run_round_new(self, news: tuple[str, str], price_file, amount_file):
-        """
-        游戏的第 self.current_round 回合，出现新闻 news
-        :param news: （上一回合新闻，本回合新闻）
-        :return: 0
-        """
-
-        # 同步回合信息
-        self.current_round += 1
-        assert self.engine.round_end() == self.current_round, "Engine round number is out of sync"
-        for agent in self.agents:
-            assert agent.round_end() == self.current_round, "agent round number is out of sync"
-
-        if self.current_round == self.contract_round + 1:
-            return 0
-
-        # 追加资金
-        for agent in self.agents:
-            self.engine.fund_supplement(agent.get_id(), agent.get_fund_supplement())
-
-        # retrieve info
-        retrieved_market_info = self.engine.retrieve_market_info()
-        # analyze news, market info
-        first_judgements = {}   # 本轮的最初态度
-
-        # 对话删除计数
-        uttrs_to_be_removed = {}
-        if self.current_round == 1:
-            # 第一回合，没有上一轮策略的对话，从零开始计数
-            for agent in self.agents:
-                uttrs_to_be_removed[str(agent.get_id())] = 0
-        else:
-            # 包含上一轮的策略，从确认上一轮策略使用的对话轮数开始计数
-            for agent in self.agents:
-                uttrs_to_be_removed[str(agent.get_id())] = agent.review_reflection()
-
-        # 回合开始
-        for agent in self.agents:
-            # 打印状态
-            print(f'\n----****----\nround {self.current_round}, agent {agent.get_name()} starts\n----****----')
-            # print(f'current context:\n{agent.get_context()}\n----****----')
-            # 智能体对新闻的分析
-            pass_list = [
-                '大宗商品贸易集团',
-                '全球性综合金属生产集团',
-                'InstitutionalProfile0',
-                'InstitutionalProfile1',
-                'InstitutionalProfile2',
-                'InstitutionalProfile3',
-            ]
-            if agent.get_name() not in pass_list:
-                # 玩家是普通玩家才会有延迟判定
-                got_news = news_delay(news)     # 新闻延迟
-            else:
-                got_news = news[-1]
-            # 专家模型对新闻的分析
-            expert_observation = self.expert.news_analysis(got_news)
-            uttrs_to_be_removed[str(agent.get_id())] += agent.news_analysis(got_news, expert_observation)
-            # 分析市场信息，生成交易前看多与看空倾向
-            for _ in range(5):
-                count, judgement_0 = agent.market_info_analysis(retrieved_market_info)
-                if count is not None:
-                    break
-            else:
-                print(f"failed in 5 times: {agent.get_name()} in round {self.current_round}. task - market info analysis.")
-                return -1
-
-            # 对话成功后
-            uttrs_to_be_removed[str(agent.get_id())] += count
-            first_judgements[str(agent.get_id())] = judgement_0['judgement']
-
-            # 同步与确认账户信息
-            account_info = self.engine.retrieve_account_info(agent.get_id())
-            agent.refresh_account_info(account_info)
-            uttrs_to_be_removed[str(agent.get_id())] += agent.account_info_confirmation()
-
-        # 出价与交易撮合
-        temp_dict_1, succeeded_requests, failed_requests, deals = self.trade_phase_new(
-            first_judgements,
-            retrieved_market_info,
-            price_file,
-            amount_file
-        )
-
-        # 出价与交易撮合过程中出错
-        if temp_dict_1 is None:
-            return -1
-
-        # 回合结束，账户结算，与本轮策略保存，用于下一回合
-        temp_dict_2 = self.settlement_phase()
-
-        # 计数，并删除提示词
-        for agent in self.agents:
-            key = str(agent.get_id())
-            uttrs_to_be_removed[key] += temp_dict_1[key]
-            uttrs_to_be_removed[key] += temp_dict_2[key]
-            agent.remove_agent_context(
-                beginning=-1*uttrs_to_be_removed[key],
-            )
-            prompt, completion = agent.get_usage()
-            print(
-                f"\n----------tokens----------\n"
-                f"已使用 tokens: prompt - {prompt}; completion - {completion} \n"
-                f"--------------------------\n"
-            )
-
-        return 0
-
-    def trade_phase_new(self, first_judgements, market_info, price_file, amount_file):
-        """
-        在一回合的信息收集环节结束后，开始五轮出价
-        :return: 五轮结束后所有成交的和没有成交的订单
-        """
-        # 交易请求列表
-        all_requests = []
-        # 撮合后成功的请求，失败的请求，达成的交易单
-        succeeded_requests, failed_requests, deals = [], [], []
-
-        # 对话删除计数
-        uttrs_to_be_removed = {}
-        for agent in self.agents:
-            uttrs_to_be_removed[str(agent.get_id())] = 0
-
-        # 2 rounds
-        for i in range(2):
-            # 发起请求
-            new_transactions = []
-            last_turn_to_be_removed = {}
-            for agent in self.agents:
-                last_turn_to_be_removed[str(agent.get_id())] = uttrs_to_be_removed[str(agent.get_id())]
-                # 同步账户信息
-                account_info = self.engine.retrieve_account_info(agent.get_id())
-                agent.refresh_account_info(account_info)
-
-                # 确认是否参与交易
-                for _ in range(5):
-                    count, anticipation, strategy = agent.transaction_request_phase_1(
-                        current_turn=i,
-                        attitude=first_judgements[str(agent.get_id())]
-                    )
-                    if count is not None:
-                        break
-                else:
-                    print(f"failed in 5 times: {agent.get_name()} in round {self.current_round}. task - transaction request 1.")
-                    return None, None, None, None
-
-
-                # 对话成功后
-                uttrs_to_be_removed[str(agent.get_id())] += count
-
-                if anticipation['anticipation'] == '否':
-                    # 不参与本轮交易
-                    continue
-
-                # 进入第二阶段
-                expert_advise = self.expert.advise_to_agent(agent.get_profile(), strategy)   # 请求专家意见，使用 strategy 作为输入
-                for _ in range(5):
-                    count, transaction_request = agent.transaction_request_phase_2(
-                        expert_advise=expert_advise
-                    )
-                    if count is not None:
-                        cnt = count
-                        break
-                else:
-                    print(f"failed in 5 times: {agent.get_name()} in round {self.current_round}. task - transaction request 2.")
-                    return None, None, None, None
-
-                # 对话成功后
-                uttrs_to_be_removed[str(agent.get_id())] += count
-
-                # 基于 transaction_request 生成一系列交易请求单
-                transactions = generate_transactions_new(
-                    price_file,
-                    amount_file,
-                    transaction_request,
-                    account_info,
-                    agent.get_id(),
-                    market_info,
-                    i,
-                    self.security_fund_rate,
-                    self.limit,
-                    votality=True
-                )
-                new_transactions.extend(transactions)
-
-            # 交易撮合 self.engine
-            succeeded_requests, failed_requests, deals = self.engine.deal_making(new_transactions)
-            # 更新 all_requests 列表，删除成功的交易
-            del all_requests
-            all_requests = copy.deepcopy(failed_requests)
-
-            # 撮合成功与失败通知，询问是否撤单
-            for agent in self.agents:
-                # 筛选响应，转化为通知
-                succeeded_filtered, failed_filtered = transactions_response_filter(
-                    succeeded_requests,
-                    failed_requests,
-                    agent.get_id()
-                )
-                deal_making_result_message = filtered_transactions_formatter(
-                    succeeded_filtered,
-                    failed_filtered
-                )
-                # 请求量信息
-                buy_amount, buy_price, sell_amount, sell_price = self.engine.get_order_info()
-                request_info = (buy_amount, buy_price, sell_amount, sell_price)
-
-                # 生成撤单请求
-                for _ in range(5):
-                    count, withdraw_requests = agent.transaction_response_and_withdraw(
-                        message=deal_making_result_message,
-                        request_info=request_info
-                    )
-                    if count is not None:
-                        break
-                else:
-                    print(f"failed in 5 times: {agent.get_name()} in round {self.current_round}. task - transaction request 1.")
-                    return None, None, None, None
-
-
-                # 对话成功后
-                uttrs_to_be_removed[str(agent.get_id())] += count
-
-                withdraws = update_requests_after_withdraw(
-                    failed_filtered=failed_filtered,
-                    withdraw_requests=withdraw_requests
-                )
-                # 引擎将撤单信息同步到数据库
-                self.engine.withdraw_requests(withdraw_requests=withdraws)
-
-            # 轮次结束后，删除上一轮次对话上下文
-            for agent in self.agents:
-                agent.remove_agent_context(
-                    -1 * (uttrs_to_be_removed[str(agent.get_id())]),
-                    -1 * (uttrs_to_be_removed[str(agent.get_id())]-last_turn_to_be_removed[str(agent.get_id())])
-                )
-                uttrs_to_be_removed[str(agent.get_id())] -= last_turn_to_be_removed[str(agent.get_id())]
-
-        return uttrs_to_be_removed, succeeded_requests, failed_requests, deals
\ No newline at end of file
@@ -0,0 +1,183 @@
+"""
+多日实验的并行调度：每个 (期货种类, 起始日期) 为一个独立的任务，在进程池中并行运行
+每个任务的新闻与系统配置在内存中生成（不修改 news.txt 与 SystemInitConfig.json），使用各自的数据库与日志目录
+任务状态记录在输出目录下的 manifest.json 中，重新运行同一命令时跳过已经完成的任务，中断的任务从各自的检查点继续
+用法：python sweep.py --futures SF2503 CH2503 --start 0 --end 20 --workers 4 --out sweeps/3_day_mode
+"""
+import argparse
+import contextlib
+import json
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+
+from news_init_config_updator import FUTURES_INFO, build_news, build_init_config
+
+# 获取当前程序的路径
+current_path = os.path.dirname(os.path.abspath(__file__))
+
+MANIFEST_FILE = 'manifest.json'
+NEWS_SEPARATOR = '-----*****-----'
+
+
+def load_manifest(out_dir):
+    """读取任务清单，不存在时返回空清单"""
+    path = os.path.join(out_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {'jobs': {}}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_manifest(out_dir, manifest):
+    """写入任务清单（先写临时文件再替换，中断时不会留下不完整的清单）"""
+    path = os.path.join(out_dir, MANIFEST_FILE)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=4)
+    os.replace(path + '.tmp', path)
+
+
+def build_jobs(futures_names, start, end, out_dir, base_config=None, seed=None):
+    """
+    生成所有任务，新闻与配置在此时一次性生成，保存在任务中
+    :return: {任务编号: 任务字典}
+    """
+    jobs = {}
+    for futures_name in futures_names:
+        full_name, subfix = FUTURES_INFO[futures_name]
+        with open(os.path.join(current_path, f'PricePredictionFiles/{futures_name}_price_20.json'), 'r',
+                  encoding='utf-8') as f:
+            info = json.load(f)
+        for i in range(start, end):
+            date = info[i]['date']
+            job_id = f"{futures_name}_{date.replace('-', '')}"
+            config = build_init_config(futures_name, date, i, current_config=base_config)
+            config['run'] = i   # 同一主种子下，不同起始日期使用互不相关的随机数
+            if seed is not None:
+                config['seed'] = seed
+            log_dir = os.path.abspath(os.path.join(out_dir, 'logs', job_id))
+            config.setdefault('metrics_file', os.path.join(log_dir, 'metrics.jsonl'))   # 每个任务的运行指标
+            jobs[job_id] = {
+                'job_id': job_id,
+                'futures_name': futures_name,
+                'index': i,
+                'date': date,
+                'dbname': config['dbname'],
+                'log_dir': log_dir,
+                'news': build_news(futures_name, i, full_name, subfix),
+                'config': config,
+            }
+    return jobs
+
+
+def run_job(job):
+    """
+    在子进程中运行一个任务（3 交易日模拟），输出重定向到任务日志目录下的 stdout.log
+    :return: (任务编号, 0 - 成功 / -1 - 失败, 用时（秒）, 错误信息)
+    """
+    os.makedirs(job['log_dir'], exist_ok=True)
+    start_time = time.time()
+    with open(os.path.join(job['log_dir'], 'stdout.log'), 'a', encoding='utf-8') as out, \
+            contextlib.redirect_stdout(out):
+        try:
+            from Engine.engine import Engine
+            from simulator import Simulator
+            from utils import agents_init, empty_cuda_cache
+
+            agents = agents_init(mode=job['futures_name'], log_dir=job['log_dir'])
+            engine = Engine()
+            simulator = Simulator(agents, engine, configs=job['config'])
+            simulator.sync_system_setting()
+            if os.path.exists(simulator.checkpoint_file):
+                start = simulator.resume()  # 上一次运行中断（失败重试），从最后一个完成的回合继续
+            else:
+                simulator.game_init()
+                start = 0
+
+            news = job['news'].split(NEWS_SEPARATOR)
+            contract_round = job['config']['contract_round']
+            price_file = f"PricePredictionFiles/{job['futures_name']}_price_generator.json"
+            amount_file = f"PricePredictionFiles/{job['futures_name']}_amount_generator.json"
+            for i in range(start, contract_round + 1):
+                print(f"{job['job_id']} 第{i}轮开始：{time.time() - start_time} s")
+                empty_cuda_cache()
+                if i > 0:
+                    result = simulator.run_round_new((news[i - 1], news[i]), price_file, amount_file)
+                else:
+                    result = simulator.run_round_new((news[0], news[i]), price_file, amount_file)
+                if result == -1:
+                    print("Error occurred.")
+                    return job['job_id'], -1, time.time() - start_time, f"round {i} failed"
+            return job['job_id'], 0, time.time() - start_time, None
+        except Exception:
+            error = traceback.format_exc()
+            print(error)
+            return job['job_id'], -1, time.time() - start_time, error
+
+
+def sweep(futures_names, start=0, end=20, workers=2, out_dir='sweeps', retry_failed=False, seed=None):
+    """
+    并行运行所有任务
+    :param retry_failed: 是否重新运行上次失败的任务（已完成的任务总是跳过）
+    :return: 任务清单
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    manifest = load_manifest(out_dir)
+    jobs = build_jobs(futures_names, start, end, out_dir, seed=seed)
+    todo = []
+    for job_id, job in jobs.items():
+        record = manifest['jobs'].get(job_id)
+        if record is not None and record['status'] == 'done':
+            continue
+        if record is not None and record['status'] == 'failed' and not retry_failed:
+            continue
+        manifest['jobs'][job_id] = {'futures_name': job['futures_name'], 'date': job['date'],
+                                    'dbname': job['dbname'], 'log_dir': job['log_dir'], 'status': 'pending'}
+        todo.append(job)
+    save_manifest(out_dir, manifest)
+    print(f"共{len(jobs)}个任务，本次运行{len(todo)}个，并行进程数{workers}")
+
+    # spawn：每个子进程重新导入模块，不共享 CUDA 上下文
+    pool_kwargs = {'max_workers': workers, 'mp_context': get_context('spawn')}
+    if sys.version_info >= (3, 11):
+        pool_kwargs['max_tasks_per_child'] = 1  # 每个进程只运行一个任务，模块级的缓存与计数不会在任务之间残留
+    with ProcessPoolExecutor(**pool_kwargs) as pool:
+        futures = {}
+        for job in todo:
+            futures[pool.submit(run_job, job)] = job['job_id']
+            manifest['jobs'][job['job_id']]['status'] = 'running'
+        save_manifest(out_dir, manifest)
+        for future in as_completed(futures):
+            job_id = futures[future]
+            try:
+                _, status, seconds, error = future.result()
+            except Exception as e:  # 子进程意外退出
+                status, seconds, error = -1, None, repr(e)
+            record = manifest['jobs'][job_id]
+            record['status'] = 'done' if status == 0 else 'failed'
+            record['seconds'] = seconds
+            record['error'] = error
+            save_manifest(out_dir, manifest)
+            print(f"{job_id}: {record['status']}，用时{seconds} s")
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--futures', nargs='+', default=['SF2503'], choices=sorted(FUTURES_INFO),
+                        help='期货种类')
+    parser.add_argument('--start', type=int, default=0, help='起始日期下标（0-19）')
+    parser.add_argument('--end', type=int, default=20, help='结束日期下标（不含）')
+    parser.add_argument('--workers', type=int, default=2, help='并行的进程数')
+    parser.add_argument('--out', default='sweeps/3_day_mode', help='输出目录（任务清单与日志）')
+    parser.add_argument('--retry-failed', action='store_true', help='重新运行上次失败的任务')
+    parser.add_argument('--seed', type=int, default=None, help='主随机种子')
+    args = parser.parse_args()
+    sweep(args.futures, args.start, args.end, args.workers, args.out, args.retry_failed, args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -4,9 +4,9 @@ import os, copy
 import random
 
 import numpy as np
-import torch.cuda
 
 from Agent.players import QingShanPlayer, GlencorePlayer, OrdinaryPlayers
+from order_generator import get_order_generator
 
 # 获取当前主程序的路径
 current_path = os.path.dirname(os.path.abspath(__file__))
@@ -19,19 +19,31 @@ profile_folder = os.path.join(agent_folder, 'profiles')
 config_folder = os.path.join(agent_folder, 'configs')
 
 
-def agents_init(mode='LME',num=3):
+def empty_cuda_cache():
+    """清除显存缓存（没有安装 torch 时跳过）"""
+    try:
+        import torch
+    except ImportError:
+        return
+    torch.cuda.empty_cache()
+
+
+def agents_init(mode='LME',num=3, log_dir=None):
     """
     初始化所有智能体
+    :param log_dir: 日志目录，None 表示使用配置文件中 log_file 的目录
     :return: 一个智能体组成的列表
     """
     if mode == 'LME':
         QS = QingShanPlayer(
             profile_file=os.path.join(profile_folder, 'QingShanProfile0.txt'),
-            config_file=os.path.join(config_folder, 'QingShanConfig.json')
+            config_file=os.path.join(config_folder, 'QingShanConfig.json'),
+            log_dir=log_dir
         )
         GLE = GlencorePlayer(
             profile_file=os.path.join(profile_folder, 'GlencoreProfile0.txt'),
-            config_file=os.path.join(config_folder, 'GlencoreConfig.json')
+            config_file=os.path.join(config_folder, 'GlencoreConfig.json'),
+            log_dir=log_dir
         )
         OPs = []
         for i in range(8):
@@ -42,7 +54,8 @@ def agents_init(mode='LME',num=3):
             OPs.append(
                 OrdinaryPlayers(
                     profile_file=profile_file,
-                    config_file=config_file
+                    config_file=config_file,
+                    log_dir=log_dir
                 )
             )
 
@@ -57,11 +70,13 @@ def agents_init(mode='LME',num=3):
     elif mode == 'HET': #异质性 3/5/7/10个智能体
         QS = QingShanPlayer(
             profile_file=os.path.join(profile_folder, 'QingShanProfile0.txt'),
-            config_file=os.path.join(config_folder, 'QingShanConfig.json')
+            config_file=os.path.join(config_folder, 'QingShanConfig.json'),
+            log_dir=log_dir
         )
         GLE = GlencorePlayer(
             profile_file=os.path.join(profile_folder, 'GlencoreProfile0.txt'),
-            config_file=os.path.join(config_folder, 'GlencoreConfig.json')
+            config_file=os.path.join(config_folder, 'GlencoreConfig.json'),
+            log_dir=log_dir
         )
         OPs = []
         if num==3:
@@ -73,7 +88,8 @@ def agents_init(mode='LME',num=3):
             OPs.append(
                 OrdinaryPlayers(
                     profile_file=profile_file,
-                    config_file=config_file
+                    config_file=config_file,
+                    log_dir=log_dir
                 )
             )
         elif num==5:#5个智能体：青山，嘉能可，InstitutionalProfile+ConservatismProfile，AggressiveProfile+NickelBuyer，ConservatismProfile
@@ -85,7 +101,8 @@ def agents_init(mode='LME',num=3):
                 OPs.append(
                     OrdinaryPlayers(
                         profile_file=profile_file,
-                        config_file=config_file
+                        config_file=config_file,
+                        log_dir=log_dir
                     )
                 )
         elif num==7:#7个智能体：青山，嘉能可，InstitutionalProfile，AggressiveProfile，NickelBuyer，ConservatismProfile，ContrarianProfile
@@ -97,7 +114,8 @@ def agents_init(mode='LME',num=3):
                 OPs.append(
                     OrdinaryPlayers(
                         profile_file=profile_file,
-                        config_file=config_file
+                        config_file=config_file,
+                        log_dir=log_dir
                     )
                 )
         elif num==12: #12个智能体，在LME的基础上增加InstitutionalProfile2，ConservatismProfile2
@@ -109,7 +127,8 @@ def agents_init(mode='LME',num=3):
                 OPs.append(
                     OrdinaryPlayers(
                         profile_file=profile_file,
-                        config_file=config_file
+                        config_file=config_file,
+                        log_dir=log_dir
                     )
                 )
         returnList = [
@@ -130,7 +149,8 @@ def agents_init(mode='LME',num=3):
             OPs.append(
                 OrdinaryPlayers(
                     profile_file=profile_file,
-                    config_file=config_file
+                    config_file=config_file,
+                    log_dir=log_dir
                 )
             )
     elif mode == 'TA501':
@@ -143,7 +163,8 @@ def agents_init(mode='LME',num=3):
             OPs.append(
                 OrdinaryPlayers(
                     profile_file=profile_file,
-                    config_file=config_file
+                    config_file=config_file,
+                    log_dir=log_dir
                 )
             )
 
@@ -158,7 +179,8 @@ def agents_init(mode='LME',num=3):
             OPs.append(
                 OrdinaryPlayers(
                     profile_file=profile_file,
-                    config_file=config_file
+                    config_file=config_file,
+                    log_dir=log_dir
                 )
             )
 
@@ -173,7 +195,8 @@ def agents_init(mode='LME',num=3):
             OPs.append(
                 OrdinaryPlayers(
                     profile_file=profile_file,
-                    config_file=config_file
+                    config_file=config_file,
+                    log_dir=log_dir
                 )
             )
 
@@ -188,7 +211,8 @@ def agents_init(mode='LME',num=3):
             OPs.append(
                 OrdinaryPlayers(
                     profile_file=profile_file,
-                    config_file=config_file
+                    config_file=config_file,
+                    log_dir=log_dir
                 )
             )
 
@@ -203,14 +227,15 @@ def agents_init(mode='LME',num=3):
             OPs.append(
                 OrdinaryPlayers(
                     profile_file=profile_file,
-                    config_file=config_file
+                    config_file=config_file,
+                    log_dir=log_dir
                 )
             )
 
         return OPs
 
 
-def generate_transactions(transaction_request, account_info, agent_id, market_info, current_turn, security_fund_rate, limit, votality=True):
+def generate_transactions(transaction_request, account_info, agent_id, market_info, current_turn, security_fund_rate, limit, votality=True, rng=None):
     """
     生成交易请求
     :param transaction_request: {"type", "amount", "price"}
@@ -218,8 +243,11 @@ def generate_transactions(transaction_request, account_info, agent_id, market_in
     :param agent_id: 智能体 ID
     :param market_info: 市场信息，提供价格
     :param current_turn: 轮次信息
+    :param rng: np.random.Generator（见 random_streams.py），None 表示使用 numpy 的全局随机状态
     :return: list - [用户ID，下单轮次，订单类型（请将买入卖出换成buy和sell)，买入/卖出量（请给数据），单位价格（请给数据）]
     """
+    if rng is None:
+        rng = np.random
     returnList = []
     # 账户与市场信息
     available_deposit = float(account_info["available_deposit"])
@@ -255,13 +283,13 @@ def generate_transactions(transaction_request, account_info, agent_id, market_in
             if abs(rate) > 50:
                 price_delta = abs(rate) * 0.1
 
-            rate = np.random.normal(rate, price_delta)
+            rate = rng.normal(rate, price_delta)
 
 
         # 10% 的概率，订单类型变更，买->卖，价格提升 5%；卖->买，价格降低5%
         if votality:
             # 豁免，青山，嘉能可
-            p = random.random()
+            p = rng.random()
             if p > 0.9:
                 if type_order == 'buy':
                     type_order = 'sell'
@@ -286,7 +314,7 @@ def generate_transactions(transaction_request, account_info, agent_id, market_in
                 portion = 75.0
             elif a == "全仓":
                 portion = 100.0
-            portion = np.random.normal(portion, amount_delta)
+            portion = rng.normal(portion, amount_delta)
 
         amount = amount_max * portion / 100.0
 
@@ -362,122 +390,22 @@ def custom_normalize_amount_reverse(series, p_max, p_min):
     return p_max - (1-series) * (p_max - p_min)
 
 
-def generate_transactions_new(price_file, amount_file, transaction_request, account_info, agent_id, market_info, current_turn, security_fund_rate, limit, votality=True):
+def generate_transactions_new(price_file, amount_file, transaction_request, account_info, agent_id, market_info, current_turn, security_fund_rate, limit, votality=True, seed=None, rng=None):
     """
     生成交易请求，新增利用聚类得到的参数进行订单生产
+    参数文件只在第一次使用时读取，订单由 order_generator.OrderGenerator 向量化生成
     :param transaction_request: {"type", "amount", "price"}
     :param account_info: 账户信息
     :param agent_id: 智能体 ID
     :param market_info: 市场信息，提供价格
     :param current_turn: 轮次信息
+    :param seed: 随机种子，None 表示不固定
+    :param rng: np.random.Generator（见 random_streams.py），给定时代替生成器中该智能体的随机数生成器
     :return: list - [用户ID，下单轮次，订单类型（请将买入卖出换成buy和sell)，买入/卖出量（请给数据），单位价格（请给数据）]
     """
-    returnList = []
-    # 账户与市场信息
-    Ni_price = float(market_info["current_Ni_price"])
-    # specialized generator
-    with open(price_file, 'r', encoding='utf-8') as f:
-        price_parameters = json.load(f)
-        # {'p_max': p_max # 最大涨幅, 'p_min': p_min # 最大跌幅, 'statistics': statistics # 归一化均值与标准差}
-
-    with open(amount_file, 'r', encoding='utf-8') as f:
-        amount_parameters = json.load(f)
-        # amountReturnDict = {
-        #     'avg_std_order': ['大量', '中量', '少量'],
-        #     'long': {'max': [], 'min':[], 'avg&std': []},
-        #     'short': {'max': [], 'min':[], 'avg&std':[]}
-        # }
-        # index - group_id - agent_id
-
-    # 随机生成10个订单
-    for i in range(20):
-        type_order = "buy"
-        if transaction_request["type"] == "卖出":
-            type_order = "sell"
-        ## 根据高斯分布生成价格
-        rate = limit + 1
-        p = transaction_request["price"]
-        while abs(rate) > limit/100:
-            j = -1
-            if p == "当前价格":
-                j = 6
-            elif p == "略高价格":
-                j = 4
-            elif p == "略低价格":
-                j = 5
-            elif p == "更高价格":
-                j = 2
-            elif p == "更低价格":
-                j = 3
-            elif p == "极高价格":
-                j = 0
-            elif p == "极低价格":
-                j = 1
-
-            price_miu, price_delta = price_parameters['statistics'][j][0], price_parameters['statistics'][j][1]
-
-            rate = np.random.normal(price_miu, price_delta)
-            rate = custom_normalize_price_reverse(rate, price_parameters['p_max'], price_parameters['p_min'])
-
-            # print(rate)
-
-        # 15% 的概率，订单类型变更，买->卖，价格提升 0.2%；卖->买，价格降低0.2%
-        if votality:
-            # 豁免，青山，嘉能可
-            po = random.random()
-            if po > 0.75:
-                if type_order == 'buy':
-                    type_order = 'sell'
-                    rate += 0.000
-                else:
-                    type_order = 'buy'
-                    rate -= 0.000
-
-            # if p == "略高价格":
-            #     rate += 0.015
-            # elif p == "略低价格":
-            #     rate -= 0.015
-
-        price = Ni_price * (1+rate)
-
-        ## 根据高斯分布生成数量
-        amount = -1
-        a = transaction_request["amount"]
-        ## 半仓与大量都偏常规交易水平
-        while amount < 0:
-            j = -1
-            if a == "少量":
-                j = 2
-            elif a == "半仓":
-                j = 1
-            elif a == "大量":
-                j = 0
-            elif a == "全仓":
-                j = 0
-
-            k = agent_id // 2    # 用户所属 group
-            if type_order == 'buy':
-                amount_miu, amount_std = amount_parameters['long']['avg&std'][k][j][0], amount_parameters['long']['avg&std'][k][j][1]
-                amount = np.random.normal(amount_miu, amount_std)
-                amount = custom_normalize_amount_reverse(
-                    amount,
-                    amount_parameters['long']['max'][k],
-                    amount_parameters['long']['min'][k]
-                ) / 30   # /30 均摊至每个回合的交易区间、代表一日
-            elif type_order == 'sell':
-                amount_miu, amount_std = amount_parameters['short']['avg&std'][k][j][0], amount_parameters['short']['avg&std'][k][j][1]
-                amount = np.random.normal(amount_miu, amount_std)
-                amount = custom_normalize_amount_reverse(
-                    amount,
-                    amount_parameters['short']['max'][k],
-                    amount_parameters['short']['min'][k]
-                ) / 30
-
-            # print(amount)
-
-        returnList.append([agent_id, current_turn, type_order, amount, price])
-
-    return returnList
+    generator = get_order_generator(price_file, amount_file, seed=seed)
+    return generator.generate(transaction_request, agent_id, market_info, current_turn, limit, votality=votality,
+                              rng=rng)
 
 
 def filtered_transactions_formatter(succeeded, failed):
@@ -518,13 +446,16 @@ def filtered_transactions_formatter(succeeded, failed):
     return f"{success_summary};\n {failed_summary}"
 
 
-def update_requests_after_withdraw(failed_filtered, withdraw_requests):
+def update_requests_after_withdraw(failed_filtered, withdraw_requests, rng=None):
     """
     撤单发起后，从请求列表中删除成功撮合的请求
     :param failed_filtered: 当前用户所有撮合失败的所有请求
     :param withdraw_requests: 撤单请求
+    :param rng: np.random.Generator，None 表示使用 random 模块的全局随机状态
     :return: 新的 all_requests，仅含有 order_id, list[int]
     """
+    if rng is None:
+        rng = random
     amount = withdraw_requests["withdrawal"]
     p = 0.0
     if amount == "不撤单":
@@ -538,32 +469,38 @@ def update_requests_after_withdraw(failed_filtered, withdraw_requests):
     elif amount == "全部":
         p = 1.0
 
-    remained_requests = [r[1] for r in failed_filtered if random.random() > (1-p)]
+    remained_requests = [r[1] for r in failed_filtered if rng.random() > (1-p)]
     return remained_requests
 
 
 # ablation study
-def update_requests_after_withdraw_without_generator(failed_filtered, withdraw_requests):
+def update_requests_after_withdraw_without_generator(failed_filtered, withdraw_requests, rng=None):
     """
     撤单发起后，从请求列表中删除成功撮合的请求，无生成器模式，withdrawal 为百分比小数
     :param failed_filtered: 当前用户所有撮合失败的所有请求
     :param withdraw_requests: 撤单请求
+    :param rng: np.random.Generator，None 表示使用 random 模块的全局随机状态
     :return: 新的 all_requests，仅含有 order_id, list[int]
     """
+    if rng is None:
+        rng = random
     p = withdraw_requests["withdrawal"] / 100.0
 
-    remained_requests = [r[1] for r in failed_filtered if random.random() > (1-p)]
+    remained_requests = [r[1] for r in failed_filtered if rng.random() > (1-p)]
     return remained_requests
 
 
-def news_delay(news: tuple[str, str], p=0.1):
+def news_delay(news: tuple[str, str], p=0.1, rng=None):
     """
     模拟消息延迟，以 p(default 0.1) 的概率收到上一轮的新闻
     :param news: （上一回合新闻，本回合新闻）
     :param p: 延迟概率
+    :param rng: np.random.Generator，None 表示使用 random 模块的全局随机状态
     :return: str 返回的新闻
     """
-    if random.random() > p:
+    if rng is None:
+        rng = random
+    if rng.random() > p:
         return news[-1]
     else:
         return news[0]